@@ -0,0 +1,196 @@
+import os
+import re
+import json
+import sqlite3
+import numpy as np
+
+FORMAT_VERSION = 1
+
+
+class Embedding_Store:
+    """
+    Versioned, memory-mapped matrix of product embeddings which outlives the chroma
+    database, so rebuilding collections does not require re-encoding the catalogue.
+
+    Every model gets its own directory holding a manifest, a raw float32/float16 matrix
+    with one row per embedded text, and a SQLite index mapping (product_id, text_hash)
+    to the matrix row. Vectors are only ever appended, so rows stay valid. A float16
+    store halves the disk size but rounds the vectors read back from it, so their
+    search results can differ slightly from freshly encoded vectors.
+
+    Attributes:
+        model_name (str): The embedding model the vectors belong to.
+        dim (int): The embedding dimension.
+        dtype (numpy.dtype): The dtype of the stored vectors.
+        rows (int): The number of stored vectors.
+    """
+
+    def __init__(self, root: str, model_name: str, dim: int, dtype="float32"):
+        self.directory = os.path.join(root, re.sub(r"[^A-Za-z0-9_.-]", "_", model_name))
+        os.makedirs(self.directory, exist_ok=True)
+        self.model_name = model_name
+        self.dim = dim
+        self.dtype = np.dtype(dtype)
+        self.matrix_path = os.path.join(self.directory, f"vectors.{self.dtype.name}")
+        self.manifest_path = os.path.join(self.directory, "manifest.json")
+        self._row_bytes = self.dim * self.dtype.itemsize
+        self._matrix = None
+
+        self.index = sqlite3.connect(os.path.join(self.directory, "index.sqlite3"))
+        with self.index:
+            self.index.execute(
+                "CREATE TABLE IF NOT EXISTS vectors ("
+                "product_id TEXT NOT NULL, "
+                "text_hash TEXT NOT NULL, "
+                "row INTEGER NOT NULL, "
+                "PRIMARY KEY (product_id, text_hash))"
+            )
+        self.rows = self._load_manifest()
+
+    def _load_manifest(self):
+        """
+        Validates the manifest and drops rows written after the last committed append.
+
+        Returns:
+            int: The number of committed rows.
+        """
+        manifest = {"rows": 0}
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, "r") as file:
+                manifest = json.load(file)
+            expected = {
+                "format_version": FORMAT_VERSION,
+                "model_name": self.model_name,
+                "dim": self.dim,
+                "dtype": self.dtype.name,
+            }
+            for key, value in expected.items():
+                if manifest.get(key) != value:
+                    raise ValueError(
+                        f"Embedding store {self.directory} has "
+                        f"{key}={manifest.get(key)}, expected {value}."
+                    )
+
+        rows = manifest["rows"]
+        with open(self.matrix_path, "ab") as file:
+            file.truncate(rows * self._row_bytes)
+        with self.index:
+            self.index.execute("DELETE FROM vectors WHERE row >= ?", (rows,))
+        return rows
+
+    def _save_manifest(self):
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(
+                {
+                    "format_version": FORMAT_VERSION,
+                    "model_name": self.model_name,
+                    "dim": self.dim,
+                    "dtype": self.dtype.name,
+                    "rows": self.rows,
+                },
+                file,
+            )
+        os.replace(tmp_path, self.manifest_path)
+
+    @property
+    def matrix(self):
+        """The read-only memory-mapped matrix of all committed vectors."""
+        if self._matrix is None or len(self._matrix) != self.rows:
+            if self.rows == 0:
+                return np.empty((0, self.dim), dtype=self.dtype)
+            self._matrix = np.memmap(
+                self.matrix_path,
+                dtype=self.dtype,
+                mode="r",
+                shape=(self.rows, self.dim),
+            )
+        return self._matrix
+
+    def lookup(self, product_ids, text_hashes):
+        """
+        Finds the rows of stored vectors.
+
+        Args:
+            product_ids (list): The product IDs.
+            text_hashes (list): The hashes of the embedded texts of the products.
+
+        Returns:
+            numpy.ndarray: The row of every product, -1 if its vector is not stored.
+        """
+        rows = np.full(len(product_ids), -1, dtype=np.int64)
+        positions = {key: i for i, key in enumerate(zip(product_ids, text_hashes))}
+        keys = list(positions)
+        # stay well below the SQLite limit of host parameters
+        for start in range(0, len(keys), 400):
+            chunk = keys[start : start + 400]
+            condition = "(product_id = ? AND text_hash = ?)"
+            conditions = " OR ".join([condition] * len(chunk))
+            params = [value for key in chunk for value in key]
+            query = f"SELECT product_id, text_hash, row FROM vectors WHERE {conditions}"
+            for product_id, text_hash, row in self.index.execute(query, params):
+                rows[positions[(product_id, text_hash)]] = row
+        # duplicated keys in the input share a single lookup
+        for i, key in enumerate(zip(product_ids, text_hashes)):
+            rows[i] = rows[positions[key]]
+        return rows
+
+    def append(self, product_ids, text_hashes, embeddings):
+        """
+        Appends vectors to the store.
+
+        Args:
+            product_ids (list): The product IDs.
+            text_hashes (list): The hashes of the embedded texts of the products.
+            embeddings (numpy.ndarray): The embeddings, one row per product.
+
+        Returns:
+            numpy.ndarray: The rows of the appended vectors.
+        """
+        embeddings = np.ascontiguousarray(embeddings, dtype=self.dtype)
+        rows = np.arange(self.rows, self.rows + len(embeddings), dtype=np.int64)
+        with open(self.matrix_path, "ab") as file:
+            file.write(embeddings.tobytes())
+            file.flush()
+            os.fsync(file.fileno())
+        with self.index:
+            self.index.executemany(
+                "INSERT OR REPLACE INTO vectors VALUES (?, ?, ?)",
+                zip(product_ids, text_hashes, rows.tolist()),
+            )
+        self.rows += len(embeddings)
+        self._save_manifest()
+        return rows
+
+    def get_or_encode(self, product_ids, text_hashes, texts, encode):
+        """
+        Returns the embeddings of texts, only encoding the ones not yet stored.
+
+        Args:
+            product_ids (list): The product IDs.
+            text_hashes (list): The hashes of the texts.
+            texts (list): The texts to embed.
+            encode (callable): Encodes a list of texts into a numpy matrix.
+
+        Returns:
+            tuple: The float32 embeddings and the number of texts encoded.
+        """
+        rows = self.lookup(product_ids, text_hashes)
+        missing = np.flatnonzero(rows < 0)
+        stored = np.flatnonzero(rows >= 0)
+        embeddings = np.empty((len(texts), self.dim), dtype=np.float32)
+        if len(stored):
+            embeddings[stored] = self.matrix[rows[stored]]
+        if len(missing):
+            encoded = encode([texts[i] for i in missing])
+            self.append(
+                [product_ids[i] for i in missing],
+                [text_hashes[i] for i in missing],
+                encoded,
+            )
+            # fresh vectors are returned as encoded, not rounded to the store dtype
+            embeddings[missing] = encoded
+        return embeddings, len(missing)
+
+    def close(self):
+        self.index.close()
@@ -0,0 +1,124 @@
+import os
+import json
+import shutil
+import sqlite3
+import argparse
+import numpy as np
+import chromadb
+from init_db import COLLECTION_NAMES
+
+
+def export_collection(collection, directory, dtype, batch_size):
+    """
+    Exports the embeddings, documents and metadatas of a collection into a
+    memory-mappable matrix and a SQLite table of rows.
+
+    Args:
+        collection (Collection): The chroma collection.
+        directory (str): The output directory of the locale.
+        dtype (str): The dtype of the exported matrix.
+        batch_size (int): The number of rows read from the collection at once.
+
+    Returns:
+        int: The number of exported rows.
+    """
+    tmp_directory = f"{directory}.tmp"
+    shutil.rmtree(tmp_directory, ignore_errors=True)
+    os.makedirs(tmp_directory)
+
+    count = collection.count()
+    matrix = None
+    rows = sqlite3.connect(os.path.join(tmp_directory, "rows.sqlite3"))
+    rows.execute(
+        "CREATE TABLE rows ("
+        "row INTEGER PRIMARY KEY, "
+        "product_id TEXT NOT NULL, "
+        "document TEXT, "
+        "metadata TEXT NOT NULL)"
+    )
+    offset = 0
+    while offset < count:
+        batch = collection.get(
+            limit=batch_size,
+            offset=offset,
+            include=["embeddings", "documents", "metadatas"],
+        )
+        if not batch["ids"]:
+            break
+        embeddings = np.asarray(batch["embeddings"], dtype=dtype)
+        if matrix is None:
+            matrix = np.lib.format.open_memmap(
+                os.path.join(tmp_directory, "vectors.npy"),
+                mode="w+",
+                dtype=dtype,
+                shape=(count, embeddings.shape[1]),
+            )
+        matrix[offset : offset + len(embeddings)] = embeddings
+        rows.executemany(
+            "INSERT INTO rows VALUES (?, ?, ?, ?)",
+            [
+                (offset + i, product_id, document, json.dumps(metadata))
+                for i, (product_id, document, metadata) in enumerate(
+                    zip(batch["ids"], batch["documents"], batch["metadatas"])
+                )
+            ],
+        )
+        offset += len(batch["ids"])
+
+    if matrix is None:
+        raise RuntimeError(f"Collection {collection.name} is empty.")
+    matrix.flush()
+    rows.execute("CREATE INDEX rows_product_id ON rows (product_id)")
+    rows.commit()
+    rows.close()
+    with open(os.path.join(tmp_directory, "manifest.json"), "w") as file:
+        json.dump(
+            {
+                "rows": offset,
+                "dim": matrix.shape[1],
+                "dtype": dtype,
+                "metric": (collection.metadata or {}).get("hnsw:space", "l2"),
+            },
+            file,
+        )
+
+    shutil.rmtree(directory, ignore_errors=True)
+    os.replace(tmp_directory, directory)
+    return offset
+
+
+def main():
+    """Exports the chroma collections for the local vector backend of llm_service."""
+    parser = argparse.ArgumentParser(
+        description="Export the products database for the local vector backend."
+    )
+    parser.add_argument("--database-dir", default="./database")
+    parser.add_argument("--output-dir", default="./local_index")
+    parser.add_argument(
+        "--dtype",
+        choices=["float16", "float32"],
+        default="float32",
+        help="Dtype of the exported embedding matrices.",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=10000,
+        help="Number of rows read from a collection at once.",
+    )
+    args = parser.parse_args()
+
+    client = chromadb.PersistentClient(path=args.database_dir)
+    for locale, name in COLLECTION_NAMES.items():
+        collection = client.get_collection(name=name)
+        rows = export_collection(
+            collection,
+            os.path.join(args.output_dir, locale),
+            args.dtype,
+            args.batch_size,
+        )
+        print(f"Exported {rows} rows of collection {name}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+import json
+import sqlite3
+import hashlib
+import threading
+
+
+def fingerprint(value):
+    """
+    Computes the content hash of a value.
+
+    Args:
+        value: A string, or a JSON serializable value such as a metadata dict.
+
+    Returns:
+        str: The hex digest of the value.
+    """
+    if not isinstance(value, str):
+        value = json.dumps(value, sort_keys=True, ensure_ascii=False)
+    return hashlib.blake2b(value.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class Fingerprint_Store:
+    """
+    Fingerprints of the products stored in the chroma collections, kept in a SQLite
+    file next to the database.
+
+    Every product has a hash of its embedded text, a hash of its metadata, and the ID
+    of the last ingestion run which saw it in the dataset.
+    """
+
+    def __init__(self, path: str):
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS fingerprints ("
+                "locale TEXT NOT NULL, "
+                "product_id TEXT NOT NULL, "
+                "text_hash TEXT NOT NULL, "
+                "row_hash TEXT NOT NULL, "
+                "run_id INTEGER NOT NULL, "
+                "PRIMARY KEY (locale, product_id))"
+            )
+
+    def lookup(self, locale: str, product_ids):
+        """
+        Returns the stored fingerprints of the given products.
+
+        Args:
+            locale (str): The locale of the products.
+            product_ids (list): The product IDs.
+
+        Returns:
+            dict: Mapping of product ID to a (text_hash, row_hash) tuple.
+        """
+        found = {}
+        with self._lock:
+            # stay well below the SQLite limit of host parameters
+            for i in range(0, len(product_ids), 900):
+                chunk = product_ids[i : i + 900]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self.connection.execute(
+                    "SELECT product_id, text_hash, row_hash FROM fingerprints "
+                    f"WHERE locale = ? AND product_id IN ({placeholders})",
+                    [locale, *chunk],
+                )
+                for product_id, text_hash, row_hash in rows:
+                    found[product_id] = (text_hash, row_hash)
+        return found
+
+    def save(self, locale: str, rows, run_id: int):
+        """
+        Stores the fingerprints of written products.
+
+        Args:
+            locale (str): The locale of the products.
+            rows (list): (product_id, text_hash, row_hash) tuples.
+            run_id (int): The ID of the current ingestion run.
+        """
+        with self._lock, self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO fingerprints VALUES (?, ?, ?, ?, ?)",
+                [(locale, *row, run_id) for row in rows],
+            )
+
+    def mark_seen(self, locale: str, product_ids, run_id: int):
+        """Records that unchanged products were seen by the current ingestion run."""
+        with self._lock, self.connection:
+            self.connection.executemany(
+                "UPDATE fingerprints SET run_id = ? "
+                "WHERE locale = ? AND product_id = ?",
+                [(run_id, locale, product_id) for product_id in product_ids],
+            )
+
+    def stale(self, locale: str, run_id: int):
+        """Returns the IDs of the products which were not seen by the given run."""
+        with self._lock:
+            rows = self.connection.execute(
+                "SELECT product_id FROM fingerprints WHERE locale = ? AND run_id != ?",
+                (locale, run_id),
+            )
+            return [row[0] for row in rows]
+
+    def delete(self, locale: str, product_ids):
+        """Removes the fingerprints of deleted products."""
+        with self._lock, self.connection:
+            self.connection.executemany(
+                "DELETE FROM fingerprints WHERE locale = ? AND product_id = ?",
+                [(locale, product_id) for product_id in product_ids],
+            )
+
+    def close(self):
+        self.connection.close()
@@ -1,25 +1,301 @@
 import os
+import re
 import time
+import queue
 import shutil
+import hashlib
+import argparse
+import threading
+from functools import partial
+from collections import defaultdict
 from git import Repo
-import pandas as pd
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
 import chromadb
 from sentence_transformers import SentenceTransformer
 from chromadb import Documents, EmbeddingFunction, Embeddings
 from chromadb.utils.batch_utils import create_batches
+from fingerprint_store import Fingerprint_Store, fingerprint
+from embedding_store import Embedding_Store
+from product_store import Product_Store
+from lexical_index import Lexical_Index_Builder, lexical_text
+
+MODEL_NAME = "multi-qa-mpnet-base-dot-v1"
+
+COLLECTION_NAMES = {"us": "us_products", "es": "es_products", "jp": "jp_products"}
+
+METADATA_COLUMNS = [
+    "product_title",
+    "product_id",
+    "product_brand",
+    "product_color",
+    "product_description",
+    "product_bullet_point",
+]
 
 
 class CustomEmbeddingFunction(EmbeddingFunction):
     """Custom embedding function that uses SentenceTransformer to embed documents."""
 
-    def __init__(self, model_name: str):
-        self.model = SentenceTransformer(model_name)
+    def __init__(self, model):
+        self.model = model
 
     def __call__(self, input: Documents) -> Embeddings:
         # embed the documents somehow
         return self.model.encode(input).tolist()
 
 
+def vocab_fingerprint(llama):
+    """
+    Returns a fingerprint of the vocabulary of a llama_cpp model. The chat service
+    computes the same fingerprint for its model, see llm_service's llamacpp.py.
+
+    Args:
+        llama (Llama): The llama_cpp model.
+
+    Returns:
+        str: The hex fingerprint.
+    """
+    digest = hashlib.sha1()
+    for token in range(llama.n_vocab()):
+        digest.update(llama.detokenize([token]) + b"\0")
+    return digest.hexdigest()[:16]
+
+
+class Context_Builder:
+    """
+    Builds the LLM-ready context fragment of a product at ingestion, so the RAG
+    chain only joins precomputed fragments instead of cleaning raw HTML per request.
+
+    The description is cleaned and truncated to max_chars. Tokens are counted with
+    the vocabulary of the GGUF chat model if a tokenizer path is given, otherwise
+    they are estimated from the byte length. Exact counts are tagged with the
+    fingerprint of the vocabulary, so the chat service only trusts counts made
+    with its own tokenizer.
+    """
+
+    CLEAN_PATTERNS = [
+        # Remove HTML tags
+        (re.compile(r"<.*?>"), ""),
+        # Replace HTML entities with a space
+        (re.compile(r"&[a-zA-Z0-9#]+;"), " "),
+        # Remove markdown links
+        (re.compile(r"\[(.*?)\]\(.*?\)"), r"\1"),
+        # Remove URLs
+        (re.compile(r"http\S+|www\S+"), ""),
+    ]
+    SPECIAL_CHARACTERS = re.compile(r"[^a-z0-9\s]")
+
+    def __init__(self, max_chars=1000, tokenizer_path=None):
+        self.max_chars = max_chars
+        self.tokenizer = None
+        self.tokenizer_id = None
+        if tokenizer_path:
+            from llama_cpp import Llama
+
+            self.tokenizer = Llama(
+                model_path=tokenizer_path, vocab_only=True, verbose=False
+            )
+            self.tokenizer_id = vocab_fingerprint(self.tokenizer)
+
+    def clean_text(self, text):
+        for pattern, replacement in self.CLEAN_PATTERNS:
+            text = pattern.sub(replacement, text)
+        return self.SPECIAL_CHARACTERS.sub("", text.lower())
+
+    def truncate(self, text):
+        if len(text) <= self.max_chars:
+            return text
+        text = text[: self.max_chars]
+        return text[: text.rfind(" ")] if " " in text else text
+
+    def count_tokens(self, text):
+        if self.tokenizer is None:
+            return len(text.encode("utf-8")) // 4 + 1
+        # tokenized like the chat service tokenizes prompt fragments
+        tokens = self.tokenizer.tokenize(
+            text.encode("utf-8"), add_bos=False, special=True
+        )
+        return len(tokens)
+
+    def build(self, metadata):
+        """
+        Builds the context fragment of a product.
+
+        Args:
+            metadata (dict): The metadata of the product.
+
+        Returns:
+            tuple: The context fragment and its number of tokens.
+        """
+        description = self.clean_text(metadata["product_description"])
+        description = self.truncate(" ".join(description.split()))
+        context = (
+            f"Product Id {metadata['product_id']}. \n"
+            f"Title is {metadata['product_title']}. \n"
+            f"It's color is {metadata['product_color']}. "
+            f"It's Brand is {metadata['product_brand']}. "
+            f"It's description says...\n {description}.\n\n"
+        )
+        return context, self.count_tokens(context)
+
+
+class Stage_Stats:
+    """Counts the rows processed and the seconds spent in every pipeline stage."""
+
+    def __init__(self):
+        self.rows = defaultdict(int)
+        self.seconds = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, rows: int, seconds: float):
+        with self._lock:
+            self.rows[stage] += rows
+            self.seconds[stage] += seconds
+
+    def report(self):
+        """Prints the throughput of every stage."""
+        with self._lock:
+            for stage in self.rows:
+                seconds = self.seconds[stage]
+                rate = self.rows[stage] / seconds if seconds else 0.0
+                print(
+                    f"  {stage:>8}: {self.rows[stage]} rows in {seconds:.1f}s "
+                    f"({rate:.0f} rows/sec)"
+                )
+
+
+class Parallel_Encoder:
+    """
+    Encodes documents with large batches across a pool of worker processes.
+
+    Torch uses all cores in every process by default, so each worker is limited to
+    its share of the cores, otherwise the workers would run about cores² threads.
+    """
+
+    THREAD_ENV_VARS = ("OMP_NUM_THREADS", "MKL_NUM_THREADS")
+
+    def __init__(self, model, workers: int, batch_size: int):
+        self.model = model
+        self.batch_size = batch_size
+        self.pool = None
+        if workers > 1:
+            threads = max(1, (os.cpu_count() or 1) // workers)
+            # the workers are spawned with the environment of this process and
+            # their torch pools read the thread count from it
+            previous = {name: os.environ.get(name) for name in self.THREAD_ENV_VARS}
+            os.environ.update({name: str(threads) for name in self.THREAD_ENV_VARS})
+            try:
+                self.pool = model.start_multi_process_pool(
+                    target_devices=["cpu"] * workers
+                )
+            finally:
+                for name, value in previous.items():
+                    if value is None:
+                        os.environ.pop(name, None)
+                    else:
+                        os.environ[name] = value
+
+    def encode(self, texts):
+        if self.pool is None:
+            return self.model.encode(texts, batch_size=self.batch_size)
+        return self.model.encode_multi_process(
+            texts, self.pool, batch_size=self.batch_size
+        )
+
+    def close(self):
+        if self.pool is not None:
+            SentenceTransformer.stop_multi_process_pool(self.pool)
+
+
+class Collection_Writer:
+    """
+    Writes embedded documents to chroma on a background thread, so that writing a
+    batch overlaps with embedding the next one.
+    """
+
+    def __init__(self, client, collections, stats, max_pending=2):
+        self.client = client
+        self.collections = collections
+        self.stats = stats
+        self.error = None
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def put(
+        self,
+        locale,
+        method,
+        ids,
+        embeddings=None,
+        documents=None,
+        metadatas=None,
+        on_written=None,
+    ):
+        """
+        Queues a write, blocking while max_pending writes wait.
+
+        Args:
+            locale (str): The locale of the collection to write to.
+            method (str): The collection method, one of add, upsert, update or delete.
+            ids (list): The product IDs.
+            embeddings (list, optional): The embeddings. Defaults to None.
+            documents (list, optional): The documents. Defaults to None.
+            metadatas (list, optional): The metadatas. Defaults to None.
+            on_written (callable, optional): Called on the writer thread once the
+                write succeeded. Defaults to None.
+        """
+        if self.error is not None:
+            raise self.error
+        self.queue.put(
+            (locale, method, ids, embeddings, documents, metadatas, on_written)
+        )
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            if self.error is not None:
+                continue
+
+            locale, method, ids, embeddings, documents, metadatas, on_written = item
+            collection = self.collections[locale]
+            start = time.perf_counter()
+            try:
+                batches = create_batches(
+                    api=self.client,
+                    ids=ids,
+                    embeddings=embeddings,
+                    metadatas=metadatas,
+                    documents=documents,
+                )
+                for batch in batches:
+                    if method == "delete":
+                        collection.delete(ids=batch[0])
+                        continue
+                    getattr(collection, method)(
+                        ids=batch[0],
+                        embeddings=batch[1],
+                        metadatas=batch[2],
+                        documents=batch[3],
+                    )
+                if on_written is not None:
+                    on_written()
+            except Exception as e:
+                print(f"Error writing batch to collection {locale}: {e}")
+                self.error = e
+            self.stats.add("write", len(ids), time.perf_counter() - start)
+
+    def close(self):
+        """Waits for the queued batches to be written."""
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+
 def delete_directory(directory_uri):
     """
     Deletes a directory and all its contents.
@@ -64,93 +340,385 @@ def clone_repository(repo_url, clone_dir):
         repo.git.lfs("pull")
 
 
-def create_document(row):
+def read_batches(product_dataset_file, batch_size, stats):
     """
-    Create a vector document from the given row.
+    Streams the product dataset row-group by row-group, reading only the needed columns.
 
     Args:
-        row: A dictionary containing the row data.
+        product_dataset_file (str): The file path of the product dataset.
+        batch_size (int): The number of rows per batch.
+        stats (Stage_Stats): The pipeline statistics.
 
-    Returns:
-        tuple: A tuple containing the product ID, document, and metadata.
-
-    """
-    product_id = row["product_id"]
-    document = row["product_title"]
-    metadata = {
-        "product_title": row["product_title"],
-        "product_id": row["product_id"],
-        "product_brand": row["product_brand"],
-        "product_color": row["product_color"],
-        "product_description": row["product_description"],
-        "product_bullet_point": row["product_bullet_point"],
-    }
-    return product_id, document, metadata
+    Yields:
+        pyarrow.RecordBatch: The next batch of rows.
+    """
+    parquet_file = pq.ParquetFile(product_dataset_file)
+    batches = parquet_file.iter_batches(
+        batch_size=batch_size, columns=["product_locale"] + METADATA_COLUMNS
+    )
+    while True:
+        start = time.perf_counter()
+        batch = next(batches, None)
+        if batch is None:
+            return
+        stats.add("read", batch.num_rows, time.perf_counter() - start)
+        yield batch
 
 
-def insert_documents(df, collection_name, emb_fn):
+def create_documents(batch, context_builder=None):
     """
-    Inserts documents into a collection in the ChromaDB database in batches.
+    Create vector documents from a batch of rows using column operations.
 
     Args:
-        df (pandas.DataFrame): The DataFrame containing the documents to be inserted.
-        collection_name (str): The name of the collection to insert the documents into.
-        emb_fn : The instance of custom embedding function to use for the documents.
+        batch (pyarrow.RecordBatch): The batch of rows.
+        context_builder (Context_Builder, optional): Adds the precomputed
+            product_context, product_context_tokens and, for exact counts,
+            product_context_tokenizer to the metadatas.
+            Defaults to None.
 
     Returns:
-        None
+        dict: Mapping of locale to a tuple containing the product IDs, documents,
+        and metadatas of the rows of that locale.
     """
-    model_name = "multi-qa-mpnet-base-dot-v1"
-    client = chromadb.PersistentClient(path=database_dir)
-    ef = CustomEmbeddingFunction(model_name)
+    # Replace null values with empty strings
+    columns = {
+        name: pc.fill_null(batch.column(name), "") for name in METADATA_COLUMNS
+    }
+    locales = batch.column("product_locale")
+
+    documents = {}
+    for locale in COLLECTION_NAMES:
+        mask = pc.equal(locales, locale)
+        if not pc.any(mask).as_py():
+            continue
+        values = [
+            pc.filter(columns[name], mask).to_pylist() for name in METADATA_COLUMNS
+        ]
+        metadatas = [dict(zip(METADATA_COLUMNS, row)) for row in zip(*values)]
+        if context_builder is not None:
+            for metadata in metadatas:
+                context, tokens = context_builder.build(metadata)
+                metadata["product_context"] = context
+                metadata["product_context_tokens"] = tokens
+                if context_builder.tokenizer_id is not None:
+                    metadata["product_context_tokenizer"] = context_builder.tokenizer_id
+        product_ids = values[METADATA_COLUMNS.index("product_id")]
+        titles = values[METADATA_COLUMNS.index("product_title")]
+        documents[locale] = (product_ids, titles, metadatas)
+    return documents
+
+
+def sync_documents(
+    locale,
+    product_ids,
+    titles,
+    metadatas,
+    store,
+    encoder,
+    writer,
+    stats,
+    run_id,
+    counts,
+    incremental=False,
+    vectors=None,
+    products=None,
+):
+    """
+    Writes the new and changed documents of a batch to the collection of a locale.
 
-    collection = client.get_or_create_collection(
-        name=collection_name, embedding_function=emb_fn
-    )
-    results = df.apply(create_document, axis=1)
-    product_ids, documents, metadatas = zip(*results)
-
-    batches = create_batches(
-        api=client,
-        ids=list(product_ids),
-        documents=list(documents),
-        metadatas=list(metadatas),
-    )
+    Only documents whose embedded text changed are re-embedded. Documents whose
+    metadata alone changed are updated without embedding, and unchanged documents
+    are only marked as seen by the current run. With an embedding store, texts which
+    were embedded by any previous run are read from the store instead of encoded.
+    The metadata of every product is also written to the product key-value store.
+
+    Args:
+        locale (str): The locale of the documents.
+        product_ids (list): The product IDs.
+        titles (list): The embedded texts.
+        metadatas (list): The metadatas.
+        store (Fingerprint_Store): The fingerprints of the stored products.
+        encoder (Parallel_Encoder): The embedding encoder.
+        writer (Collection_Writer): The chroma writer.
+        stats (Stage_Stats): The pipeline statistics.
+        run_id (int): The ID of the current ingestion run.
+        counts (dict): Counters of new, changed, updated and unchanged products.
+        incremental (bool, optional): Whether the collection may already contain
+            products without fingerprints, so new products are upserted. Defaults
+            to False.
+        vectors (Embedding_Store, optional): The persistent embedding store.
+            Defaults to None.
+        products (Product_Store, optional): The product key-value store.
+            Defaults to None.
+
+    Returns:
+        None
+    """
+    if products is not None:
+        products.save(locale, product_ids, metadatas)
+
+    existing = store.lookup(locale, product_ids)
+    changes = {"new": [], "changed": [], "updated": []}
+    unchanged = []
+    for i, (product_id, title, metadata) in enumerate(
+        zip(product_ids, titles, metadatas)
+    ):
+        hashes = (fingerprint(title), fingerprint(metadata))
+        stored = existing.get(product_id)
+        if stored is None:
+            changes["new"].append((i, hashes))
+        elif stored[0] != hashes[0]:
+            changes["changed"].append((i, hashes))
+        elif stored[1] != hashes[1]:
+            changes["updated"].append((i, hashes))
+        else:
+            unchanged.append(product_id)
 
-    for batch in batches:
-        print(f"Adding batch of size {len(batch[0])} to collection {collection_name}.")
-        collection.add(ids=batch[0], documents=batch[3], metadatas=batch[2])
+    store.mark_seen(locale, unchanged, run_id)
+    counts["unchanged"] += len(unchanged)
 
+    methods = {
+        "new": "upsert" if incremental else "add",
+        "changed": "upsert",
+        "updated": "update",
+    }
+    for change, method in methods.items():
+        rows = changes[change]
+        if not rows:
+            continue
+        counts[change] += len(rows)
+        ids = [product_ids[i] for i, _ in rows]
+        fingerprints = [(product_ids[i], *hashes) for i, hashes in rows]
+        on_written = partial(store.save, locale, fingerprints, run_id)
+
+        if method == "update":
+            writer.put(
+                locale,
+                method,
+                ids,
+                metadatas=[metadatas[i] for i, _ in rows],
+                on_written=on_written,
+            )
+            continue
 
-def process_data(product_dataset_file):
+        texts = [titles[i] for i, _ in rows]
+        start = time.perf_counter()
+        if vectors is None:
+            embeddings = encoder.encode(texts)
+            encoded = len(texts)
+        else:
+            text_hashes = [hashes[0] for _, hashes in rows]
+            embeddings, encoded = vectors.get_or_encode(
+                ids, text_hashes, texts, encoder.encode
+            )
+            counts["reused"] += len(texts) - encoded
+        stats.add("embed", len(texts), time.perf_counter() - start)
+        embeddings = embeddings.tolist()
+        writer.put(
+            locale,
+            method,
+            ids,
+            embeddings=embeddings,
+            documents=texts,
+            metadatas=[metadatas[i] for i, _ in rows],
+            on_written=on_written,
+        )
+
+
+def process_data(
+    product_dataset_file,
+    database_dir,
+    workers,
+    read_batch_size,
+    embed_batch_size,
+    incremental=False,
+    embedding_store_dir=None,
+    embedding_store_dtype="float32",
+    context_max_chars=1000,
+    context_tokenizer=None,
+    lexical_index_dir=None,
+):
     """
-    Process the product dataset file and insert the documents into respective collections.
+    Process the product dataset file and sync the documents into respective collections.
+
+    The dataset is streamed through read, extract, embed and write stages. Embedding
+    runs across a pool of worker processes and writing runs on a background thread.
+    Products are fingerprinted, so running against an existing database only writes
+    new or changed products and deletes products removed from the dataset. Embeddings
+    are persisted in an embedding store outside the database directory, so a full
+    rebuild reads the vectors of known texts from it instead of re-encoding them.
 
     Args:
         product_dataset_file (str): The file path of the product dataset.
+        database_dir (str): The directory of the chroma database.
+        workers (int): The number of embedding worker processes.
+        read_batch_size (int): The number of rows read from the dataset at once.
+        embed_batch_size (int): The batch size of the embedding model.
+        incremental (bool, optional): Whether an existing database is synced.
+            Defaults to False.
+        embedding_store_dir (str, optional): The directory of the embedding store.
+            Defaults to None, which disables the store.
+        embedding_store_dtype (str, optional): The dtype of the stored vectors.
+            Defaults to float32.
+        context_max_chars (int, optional): The maximum length of the cleaned
+            description in the precomputed product context. Defaults to 1000.
+        context_tokenizer (str, optional): The GGUF model whose vocabulary counts
+            the context tokens. Defaults to None, which estimates the counts.
+        lexical_index_dir (str, optional): The directory of the BM25 indexes, one
+            per locale, rebuilt from the whole dataset on every run. Defaults to
+            None, which skips building them.
 
     Returns:
         None
     """
-    df = pd.read_parquet(product_dataset_file)
-    # Replace NaN values with None
-    df = df.fillna("")
-    df_us = df[df["product_locale"] == "us"]
-    df_es = df[df["product_locale"] == "es"]
-    df_jp = df[df["product_locale"] == "jp"]
-
-    emb_fn = CustomEmbeddingFunction("multi-qa-mpnet-base-dot-v1")
-
-    print("Inserting us documents into collections...")
-    insert_documents(df_us, "us_products", emb_fn)
-    print("Inserting es documents into collections...")
-    insert_documents(df_es, "es_products", emb_fn)
-    print("Inserting jp documents into collections...")
-    insert_documents(df_jp, "jp_products", emb_fn)
+    model = SentenceTransformer(MODEL_NAME)
+    emb_fn = CustomEmbeddingFunction(model)
+    client = chromadb.PersistentClient(path=database_dir)
+    collections = {
+        locale: client.get_or_create_collection(name=name, embedding_function=emb_fn)
+        for locale, name in COLLECTION_NAMES.items()
+    }
+    store = Fingerprint_Store(os.path.join(database_dir, "fingerprints.sqlite3"))
+    products = Product_Store(os.path.join(database_dir, "products.sqlite3"))
+    vectors = None
+    if embedding_store_dir:
+        vectors = Embedding_Store(
+            embedding_store_dir,
+            MODEL_NAME,
+            model.get_sentence_embedding_dimension(),
+            embedding_store_dtype,
+        )
+    context_builder = Context_Builder(context_max_chars, context_tokenizer)
+    lexical_indexes = {}
+    if lexical_index_dir:
+        lexical_indexes = {
+            locale: Lexical_Index_Builder(os.path.join(lexical_index_dir, locale))
+            for locale in COLLECTION_NAMES
+        }
+    run_id = time.time_ns()
+    counts = defaultdict(int)
+
+    stats = Stage_Stats()
+    encoder = Parallel_Encoder(model, workers, embed_batch_size)
+    writer = Collection_Writer(client, collections, stats)
+    try:
+        batches = read_batches(product_dataset_file, read_batch_size, stats)
+        for i, batch in enumerate(batches):
+            start = time.perf_counter()
+            documents = create_documents(batch, context_builder)
+            stats.add("extract", batch.num_rows, time.perf_counter() - start)
+
+            for locale, (product_ids, titles, metadatas) in documents.items():
+                if lexical_indexes:
+                    start = time.perf_counter()
+                    lexical_indexes[locale].add(
+                        product_ids, [lexical_text(metadata) for metadata in metadatas]
+                    )
+                    stats.add("lexical", len(product_ids), time.perf_counter() - start)
+                sync_documents(
+                    locale,
+                    product_ids,
+                    titles,
+                    metadatas,
+                    store,
+                    encoder,
+                    writer,
+                    stats,
+                    run_id,
+                    counts,
+                    incremental,
+                    vectors,
+                    products,
+                )
+
+            if (i + 1) % 10 == 0:
+                print(f"Processed {stats.rows['read']} rows.")
+                stats.report()
+        writer.close()
+        for locale, lexical_index in lexical_indexes.items():
+            lexical_index.write()
+            print(f"Lexical index of locale {locale} written.")
+
+        # products which were not seen in this run were removed from the dataset
+        for locale, collection in collections.items():
+            removed = store.stale(locale, run_id)
+            if not removed:
+                continue
+            for batch in create_batches(api=client, ids=removed):
+                collection.delete(ids=batch[0])
+            store.delete(locale, removed)
+            products.delete(locale, removed)
+            counts["deleted"] += len(removed)
+    finally:
+        encoder.close()
+        store.close()
+        products.close()
+        if vectors is not None:
+            vectors.close()
+
+    print(
+        "Synced products: "
+        + ", ".join(f"{count} {change}" for change, count in counts.items())
+    )
+    print("Pipeline throughput per stage:")
+    stats.report()
 
 
 def main():
     """main method to initialize the database"""
+    parser = argparse.ArgumentParser(description="Initialize the products database.")
+    parser.add_argument("--database-dir", default=database_dir)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Number of embedding worker processes.",
+    )
+    parser.add_argument(
+        "--read-batch-size",
+        type=int,
+        default=8192,
+        help="Number of dataset rows streamed per batch.",
+    )
+    parser.add_argument(
+        "--embed-batch-size",
+        type=int,
+        default=128,
+        help="Batch size of the embedding model.",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Sync the existing database instead of rebuilding it from scratch.",
+    )
+    parser.add_argument(
+        "--embedding-store-dir",
+        default="./embeddings",
+        help="Directory of the persistent embedding store, empty to disable it.",
+    )
+    parser.add_argument(
+        "--embedding-store-dtype",
+        choices=["float32", "float16"],
+        default="float32",
+        help="Dtype of the vectors in the embedding store.",
+    )
+    parser.add_argument(
+        "--context-max-chars",
+        type=int,
+        default=1000,
+        help="Maximum length of the cleaned description in the product context.",
+    )
+    parser.add_argument(
+        "--context-tokenizer",
+        help="GGUF chat model used to count the tokens of the product context.",
+    )
+    parser.add_argument(
+        "--lexical-index-dir",
+        help="Directory of the BM25 indexes, defaults to lexical/ in the database "
+        "directory. Empty to skip building them.",
+    )
+    args = parser.parse_args()
+
     start_time = time.time()
     repo_url = "https://github.com/jeancsil/amazon-esci-data.git"
     clone_dir = "amazon-esci-data"
@@ -158,12 +726,29 @@ def main():
     clone_repository(repo_url, clone_dir)
     product_dataset_file = f"./{clone_dir}/shopping_queries_dataset/shopping_queries_dataset_products.parquet"
 
-    # delete if exisiting database file exists
-    delete_directory(database_dir)
-    os.makedirs(database_dir, exist_ok=True)
-    print(f"Database directory created at {database_dir}")
+    # delete if exisiting database file exists, unless it is synced incrementally
+    if not args.incremental:
+        delete_directory(args.database_dir)
+    os.makedirs(args.database_dir, exist_ok=True)
+    print(f"Database directory created at {args.database_dir}")
     print("Processing dataset files...")
-    process_data(product_dataset_file)
+    process_data(
+        product_dataset_file,
+        args.database_dir,
+        args.workers,
+        args.read_batch_size,
+        args.embed_batch_size,
+        args.incremental,
+        args.embedding_store_dir,
+        args.embedding_store_dtype,
+        args.context_max_chars,
+        args.context_tokenizer,
+        (
+            os.path.join(args.database_dir, "lexical")
+            if args.lexical_index_dir is None
+            else args.lexical_index_dir
+        ),
+    )
     print("Dataset processing complete.")
     total_time = time.time() - start_time
     print("Database initialization complete.")
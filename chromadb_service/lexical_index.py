@@ -0,0 +1,140 @@
+import os
+import re
+import json
+import shutil
+import sqlite3
+from array import array
+from collections import Counter
+import numpy as np
+
+FORMAT_VERSION = 1
+
+WORD_PATTERN = re.compile(r"\w+")
+# kana, CJK ideographs and hangul, which are not separated by spaces
+CJK_CHARACTERS = r"\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af"
+CJK_PATTERN = re.compile(f"[{CJK_CHARACTERS}]")
+CJK_RUN_PATTERN = re.compile(f"[{CJK_CHARACTERS}]+|[^{CJK_CHARACTERS}]+")
+
+
+def tokenize(text: str):
+    """
+    Splits a text into lowercase word tokens. CJK runs are split into character
+    bigrams. Must match the tokenizer of llm_service's lexical_index module.
+
+    Args:
+        text (str): The text.
+
+    Returns:
+        list: The tokens.
+    """
+    tokens = []
+    for word in WORD_PATTERN.findall(text.lower()):
+        if not CJK_PATTERN.search(word):
+            tokens.append(word)
+            continue
+        for run in CJK_RUN_PATTERN.findall(word):
+            if not CJK_PATTERN.match(run) or len(run) == 1:
+                tokens.append(run)
+            else:
+                tokens.extend(run[i : i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def lexical_text(metadata):
+    """Returns the text of a product indexed for lexical search."""
+    return " ".join(
+        metadata[field]
+        for field in ("product_title", "product_brand", "product_color", "product_id")
+        if metadata[field]
+    )
+
+
+class Lexical_Index_Builder:
+    """
+    Builds the BM25 inverted index of one locale.
+
+    Postings are collected in flat arrays while the dataset streams through and
+    grouped by term when written. The index directory holds memory-mappable NumPy
+    arrays of the term offsets, the posting documents and term frequencies and the
+    document lengths, plus a SQLite table of the terms and the product IDs.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.terms = {}
+        self.product_ids = []
+        self.doc_lengths = array("I")
+        self.posting_terms = array("I")
+        self.posting_docs = array("I")
+        self.posting_tfs = array("H")
+
+    def add(self, product_ids, texts):
+        """
+        Adds products to the index.
+
+        Args:
+            product_ids (list): The product IDs.
+            texts (list): The texts of the products.
+        """
+        for product_id, text in zip(product_ids, texts):
+            doc = len(self.product_ids)
+            tokens = tokenize(text)
+            self.product_ids.append(product_id)
+            self.doc_lengths.append(len(tokens))
+            for term, tf in Counter(tokens).items():
+                term_id = self.terms.setdefault(term, len(self.terms))
+                self.posting_terms.append(term_id)
+                self.posting_docs.append(doc)
+                self.posting_tfs.append(min(tf, 65535))
+
+    def write(self):
+        """Writes the index, replacing the previous one atomically."""
+        tmp_directory = f"{self.directory}.tmp"
+        shutil.rmtree(tmp_directory, ignore_errors=True)
+        os.makedirs(tmp_directory)
+
+        terms = np.frombuffer(self.posting_terms, dtype=np.uint32)
+        order = np.argsort(terms, kind="stable")
+        dfs = np.bincount(terms, minlength=len(self.terms))
+        offsets = np.zeros(len(self.terms) + 1, dtype=np.int64)
+        np.cumsum(dfs, out=offsets[1:])
+        docs = np.frombuffer(self.posting_docs, dtype=np.uint32)[order]
+        tfs = np.frombuffer(self.posting_tfs, dtype=np.uint16)[order]
+        doc_lengths = np.frombuffer(self.doc_lengths, dtype=np.uint32)
+
+        np.save(os.path.join(tmp_directory, "offsets.npy"), offsets)
+        np.save(os.path.join(tmp_directory, "docs.npy"), docs.astype(np.int32))
+        np.save(os.path.join(tmp_directory, "tfs.npy"), tfs)
+        np.save(os.path.join(tmp_directory, "doc_lengths.npy"), doc_lengths)
+
+        connection = sqlite3.connect(os.path.join(tmp_directory, "terms.sqlite3"))
+        with connection:
+            connection.execute(
+                "CREATE TABLE terms (term TEXT PRIMARY KEY, id INTEGER NOT NULL) "
+                "WITHOUT ROWID"
+            )
+            connection.executemany(
+                "INSERT INTO terms VALUES (?, ?)", self.terms.items()
+            )
+            connection.execute(
+                "CREATE TABLE docs (doc INTEGER PRIMARY KEY, product_id TEXT NOT NULL)"
+            )
+            connection.executemany(
+                "INSERT INTO docs VALUES (?, ?)", enumerate(self.product_ids)
+            )
+        connection.close()
+
+        avg_doc_length = float(doc_lengths.mean()) if len(doc_lengths) else 0.0
+        with open(os.path.join(tmp_directory, "manifest.json"), "w") as file:
+            json.dump(
+                {
+                    "format_version": FORMAT_VERSION,
+                    "docs": len(self.product_ids),
+                    "terms": len(self.terms),
+                    "avg_doc_length": avg_doc_length,
+                },
+                file,
+            )
+
+        shutil.rmtree(self.directory, ignore_errors=True)
+        os.replace(tmp_directory, self.directory)
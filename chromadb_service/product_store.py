@@ -0,0 +1,51 @@
+import json
+import sqlite3
+
+
+class Product_Store:
+    """
+    Key-value table of product metadata by locale and product ID, kept in a SQLite
+    file next to the database so llm_service can fetch products by exact ID without
+    a vector search.
+    """
+
+    def __init__(self, path: str):
+        self.connection = sqlite3.connect(path)
+        with self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS products ("
+                "locale TEXT NOT NULL, "
+                "product_id TEXT NOT NULL, "
+                "metadata TEXT NOT NULL, "
+                "PRIMARY KEY (locale, product_id)) WITHOUT ROWID"
+            )
+
+    def save(self, locale: str, product_ids, metadatas):
+        """
+        Stores the metadata of products, replacing previous versions.
+
+        Args:
+            locale (str): The locale of the products.
+            product_ids (list): The product IDs.
+            metadatas (list): The metadatas of the products.
+        """
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO products VALUES (?, ?, ?)",
+                [
+                    (locale, product_id, json.dumps(metadata, ensure_ascii=False))
+                    for product_id, metadata in zip(product_ids, metadatas)
+                ],
+            )
+
+    def delete(self, locale: str, product_ids):
+        """Removes deleted products."""
+        with self.connection:
+            self.connection.executemany(
+                "DELETE FROM products WHERE locale = ? AND product_id = ?",
+                [(locale, product_id) for product_id in product_ids],
+            )
+
+    def close(self):
+        self.connection.close()
@@ -19,8 +19,13 @@ default_response = "Hello! I am a chatbot to assist you with inquiries related t
 if "user_session_id" not in st.session_state:
     st.session_state["user_session_id"] = uuid.uuid4().hex
 
-# initialize llm service interface
-llm_service = LLM_Service_Interface(st.session_state["user_session_id"])
+# initialize llm service interface, kept across reruns so the session keeps its
+# websocket connection
+if "llm_service" not in st.session_state:
+    st.session_state["llm_service"] = LLM_Service_Interface(
+        st.session_state["user_session_id"]
+    )
+llm_service = st.session_state["llm_service"]
 
 
 async def render_content():
@@ -1,9 +1,10 @@
 import os
 import streamlit as st
 import streamlit.components.v1 as components
-import requests
+import uuid
 import pandas as pd
 import time
+from services import LLM_Service_Interface
 
 # set page related configurations
 st.set_page_config(
@@ -12,9 +13,25 @@ st.set_page_config(
 )
 st.title("🔍 Semantic Product Search")
 
+# generate user session
+if "user_session_id" not in st.session_state:
+    st.session_state["user_session_id"] = uuid.uuid4().hex
 
-# llm_service search api endpoint
-API_URL = "http://127.0.0.1:8001/search"
+# the llm service interface is kept across reruns, it pools the HTTP connections
+if "llm_service" not in st.session_state:
+    st.session_state["llm_service"] = LLM_Service_Interface(
+        st.session_state["user_session_id"]
+    )
+llm_service = st.session_state["llm_service"]
+
+# product fields rendered by this page
+SEARCH_FIELDS = [
+    "product_id",
+    "product_title",
+    "product_bullet_point",
+    "product_brand",
+    "product_color",
+]
 query = st.text_input("Enter your search query:")
 
 locale = st.sidebar.selectbox("Select Locale", ["us", "es", "jp"])
@@ -23,7 +40,7 @@ if st.button("Search"):
     if query:
         # Make a request to the FastAPI endpoint
         start = time.time()
-        response = requests.post(API_URL, json={"text": query, "locale": locale})
+        response = llm_service.search(query, locale, k=10, fields=SEARCH_FIELDS)
         total_time = time.time() - start
 
         if response.status_code == 200:
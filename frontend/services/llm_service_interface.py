@@ -1,16 +1,202 @@
+import time
+import uuid
+import random
+import asyncio
+import threading
 import requests
 import websockets
 import json
+from requests.adapters import HTTPAdapter
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+_lock = threading.Lock()
+_loop = None
+_http_session = None
+
+
+def _background_loop():
+    """
+    Returns the event loop of the daemon thread owning the websocket connections.
+    Streamlit runs every script rerun in a new event loop, so connections which
+    outlive a rerun must live in a loop of their own.
+    """
+    global _loop
+    with _lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(
+                target=_loop.run_forever, name="llm-service-ws", daemon=True
+            ).start()
+        return _loop
+
+
+def _get_http_session(pool_size=16):
+    """Returns the HTTP session shared by all Streamlit sessions, which keeps its
+    connections to the llm_service alive between requests."""
+    global _http_session
+    with _lock:
+        if _http_session is None:
+            _http_session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            _http_session.mount("http://", adapter)
+            _http_session.mount("https://", adapter)
+        return _http_session
 
 
 class LLM_Service_Interface:
-    def __init__(self, session_id=0, chat_interface_url="ws://127.0.0.1:8001/ws"):
+    """
+    Client of the llm_service for one Streamlit session.
+
+    Chat requests share one long-lived websocket connection, opened on first use
+    and reopened with exponential backoff if it drops. Every request carries an ID
+    which the server echoes in its frames, so several requests can be in flight on
+    the connection at once. A request abandoned before its answer ends, e.g. when
+    the script run is stopped, is stopped on the server too, and the connection is
+    closed once it has been idle for idle_timeout seconds.
+    """
+
+    def __init__(
+        self,
+        session_id=0,
+        chat_interface_url="ws://127.0.0.1:8001/ws",
+        search_url="http://127.0.0.1:8001/search/",
+        max_retries=5,
+        max_backoff=10.0,
+        idle_timeout=300.0,
+    ):
         self.session_id = session_id
         self.chat_interface_url = chat_interface_url
+        self.search_url = search_url
+        self.max_retries = max_retries
+        self.max_backoff = max_backoff
+        self.idle_timeout = idle_timeout
+        self._last_request = time.monotonic()
+        self._loop = _background_loop()
+        self._websocket = None
+        self._connect_lock = None
+        # frame queues of the in-flight requests by request ID
+        self._pending = {}
+
+    def _call(self, coroutine):
+        """Runs a coroutine in the background loop and awaits it from the caller's."""
+        return asyncio.wrap_future(
+            asyncio.run_coroutine_threadsafe(coroutine, self._loop)
+        )
+
+    async def _connect(self):
+        """
+        Returns the open connection, connecting with exponential backoff and jitter
+        if there is none.
+
+        Returns:
+            The websocket connection.
+        """
+        if self._connect_lock is None:
+            self._connect_lock = asyncio.Lock()
+        async with self._connect_lock:
+            if self._websocket is not None:
+                return self._websocket
+            # binary msgpack frames are offered if msgpack is installed, the server
+            # falls back to JSON text frames by not accepting the subprotocol
+            subprotocols = ["msgpack"] if msgpack is not None else None
+            delay = 0.5
+            for attempt in range(self.max_retries + 1):
+                try:
+                    websocket = await websockets.connect(
+                        self.chat_interface_url, subprotocols=subprotocols
+                    )
+                    break
+                except (
+                    OSError,
+                    asyncio.TimeoutError,
+                    websockets.exceptions.WebSocketException,
+                ):
+                    if attempt == self.max_retries:
+                        raise
+                    await asyncio.sleep(random.uniform(0, delay))
+                    delay = min(delay * 2, self.max_backoff)
+            self._websocket = websocket
+            asyncio.create_task(self._read(websocket))
+            asyncio.create_task(self._close_when_idle(websocket))
+            return websocket
+
+    async def _close_when_idle(self, websocket):
+        """Closes a connection once no request was sent on it for idle_timeout
+        seconds and none is in flight."""
+        while self._websocket is websocket:
+            idle = time.monotonic() - self._last_request
+            if not self._pending and idle >= self.idle_timeout:
+                await websocket.close()
+                return
+            await asyncio.sleep(max(self.idle_timeout - idle, 1.0))
+
+    async def _read(self, websocket):
+        """Routes the frames of a connection to the queues of their requests."""
+        try:
+            async for data in websocket:
+                if isinstance(data, bytes):
+                    frame = msgpack.unpackb(data)
+                else:
+                    frame = json.loads(data)
+                queue = self._pending.get(frame.get("request_id"))
+                if queue is not None:
+                    queue.put_nowait(frame)
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        finally:
+            if self._websocket is websocket:
+                self._websocket = None
+            for queue in self._pending.values():
+                queue.put_nowait(
+                    {"type": "error", "output": "Lost connection to the chat server."}
+                )
+                queue.put_nowait({"type": "end", "output": ""})
+
+    async def _start(self, request_id, payload):
+        """
+        Sends a request, reconnecting once if the connection turns out to be stale.
+
+        Returns:
+            asyncio.Queue: The queue receiving the frames of the request.
+        """
+        self._last_request = time.monotonic()
+        try:
+            for attempt in range(2):
+                # a fresh queue, the one of a dropped connection got its error frames
+                queue = asyncio.Queue()
+                self._pending[request_id] = queue
+                websocket = await self._connect()
+                try:
+                    await websocket.send(f"start {json.dumps(payload)}")
+                    return queue
+                except websockets.exceptions.ConnectionClosed:
+                    if self._websocket is websocket:
+                        self._websocket = None
+                    if attempt == 1:
+                        raise
+        except BaseException:
+            # the caller never gets the queue, so nobody else would remove it
+            self._pending.pop(request_id, None)
+            raise
+
+    async def _stop(self, request_id):
+        """Asks the server to stop answering a request."""
+        websocket = self._websocket
+        if websocket is None:
+            return
+        try:
+            await websocket.send(f"stop {json.dumps({'request_id': request_id})}")
+        except websockets.exceptions.ConnectionClosed:
+            pass
 
     async def chat_ws(self, user_query, locale, st):
         """
-        Establishes a WebSocket connection to the chat interface and sends user queries.
+        Sends a user query over the session's websocket connection and renders the
+        streamed response.
 
         Args:
             user_query (str): The user's query.
@@ -20,25 +206,60 @@ class LLM_Service_Interface:
         Returns:
             str: The response received from the chat interface.
         """
-
-        url = f"{self.chat_interface_url}"
+        request_id = uuid.uuid4().hex
+        payload = {
+            "text": user_query,
+            "locale": locale,
+            "user_session_id": self.session_id,
+            "request_id": request_id,
+        }
         response = ""
-        async with websockets.connect(url) as websocket:
-            await websocket.send(
-                f"start {json.dumps({'text': user_query, 'locale': locale, 'user_session_id': self.session_id})}"
-            )
-            try:
-                while True:
-                    data = await websocket.recv()
-                    data = json.loads(data)
-                    if data["type"] == "end":
-                        break
-                    elif data["type"] == "chunk_response" and data["output"] != None:
-                        response += f"\n{data['output']}"
-                        st.markdown(data["output"])
-                    elif data["type"] == "error":
-                        st.error(data["output"])
-            except RuntimeError:
-                print("RuntimeError occurred.")
-                st.error("RuntimeError error occurred.")
-            return response
+        status = st.empty()
+        placeholder = st.empty()
+        queue = await self._call(self._start(request_id, payload))
+        finished = False
+        try:
+            while True:
+                data = await self._call(queue.get())
+                if data["type"] == "end":
+                    finished = True
+                    break
+                elif data["type"] == "queue":
+                    status.info(
+                        f"Waiting for the model: position {data['position']}, about {data['eta']} seconds."
+                    )
+                elif data["type"] in ("chunk_response", "context"):
+                    if not data["output"]:
+                        continue
+                    status.empty()
+                    response += data["output"]
+                    # keep the line breaks of the answer and the product context
+                    placeholder.markdown(response.replace("\n", "  \n"))
+                elif data["type"] == "error":
+                    st.error(data["output"])
+        except RuntimeError:
+            print("RuntimeError occurred.")
+            st.error("RuntimeError error occurred.")
+        finally:
+            self._loop.call_soon_threadsafe(self._pending.pop, request_id, None)
+            if not finished:
+                asyncio.run_coroutine_threadsafe(self._stop(request_id), self._loop)
+        return response
+
+    def search(self, text, locale, k=10, fields=None):
+        """
+        Searches products through the pooled HTTP session.
+
+        Args:
+            text (str): The search query.
+            locale (str): The locale to search in.
+            k (int, optional): The number of products. Defaults to 10.
+            fields (list, optional): The product fields to return. Defaults to None.
+
+        Returns:
+            requests.Response: The response of the /search endpoint.
+        """
+        body = {"text": text, "locale": locale, "k": k}
+        if fields is not None:
+            body["fields"] = fields
+        return _get_http_session().post(self.search_url, json=body, timeout=30)
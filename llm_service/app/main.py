@@ -2,10 +2,28 @@ from dotenv import load_dotenv, find_dotenv
 
 _ = load_dotenv(".env")
 from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect, HTTPException
+from fastapi.responses import Response
+from starlette.websockets import WebSocketState
 from pydantic import BaseModel
-from app.schemas import Search_Schema, ProductSchema
+import os
+from app.schemas import (
+    PRODUCT_FIELDS,
+    Search_Schema,
+    ProductSchema,
+    Batch_Search_Schema,
+    Batch_Search_Result,
+)
 import json
-from app.services import DB_Service, WebSocket_Service, LLM_Agent
+import asyncio
+from app.services import (
+    DB_Service,
+    WebSocket_Service,
+    LLM_Agent,
+    Scheduler_Overloaded,
+    metrics,
+    send_frame,
+    request_id_var,
+)
 
 app = FastAPI()
 
@@ -19,51 +37,149 @@ websocket_service = WebSocket_Service()
 llm_agent = LLM_Agent(db_service)
 
 
+@app.on_event("shutdown")
+async def shutdown():
+    llm_agent.close()
+    await db_service.aclose()
+
+
 @app.get("/")
 async def read_root():
     return {"message": "Welcome to the llm_service API!"}
 
 
+@app.get("/metrics")
+async def get_metrics():
+    """Returns the in-process counters of the service"""
+    snapshot = metrics.snapshot()
+    snapshot["embedding_executor"] = db_service.embedding_executor.stats()
+    snapshot["scheduler"] = llm_agent.llm_provider.scheduler.stats()
+    if llm_agent.answer_cache is not None:
+        snapshot["answer_cache"] = llm_agent.answer_cache.stats()
+    if llm_agent.llm_provider.prefix_cache is not None:
+        snapshot["prefix_cache"] = llm_agent.llm_provider.prefix_cache.stats()
+    if db_service.embedding_cache is not None:
+        snapshot["embedding_cache"] = db_service.embedding_cache.stats()
+    snapshot["websockets"] = websocket_service.stats()
+    return snapshot
+
+
 @app.post("/search/", response_model=list[ProductSchema])
 async def search(query: Search_Schema):
-    """Search for products using a query"""
+    """Search for products using a query.
+
+    The products come straight from the database and are serialized without being
+    re-validated, reduced to the requested fields."""
+    max_k = int(os.environ.get("search_max_k", 100))
+    if not 0 < query.k <= max_k or query.offset < 0:
+        raise HTTPException(
+            status_code=400, detail=f"k must be within 1 and {max_k}, offset >= 0."
+        )
+    fields = query.fields or PRODUCT_FIELDS
+    unknown = set(fields) - set(PRODUCT_FIELDS)
+    if unknown:
+        raise HTTPException(
+            status_code=400, detail=f"Unknown fields: {sorted(unknown)}"
+        )
     try:
-        text = query.text
-        locale = query.locale
-        retriever = db_service.get_retriever(locale, k=10)
-        documents = retriever.invoke(text)
-        docs = [doc.metadata for doc in documents]
-        return docs
+        products = await db_service.asearch(
+            query.text, query.locale, query.k, query.offset, fields
+        )
     except Exception as e:
         raise HTTPException(status_code=404, detail=str(e))
+    return Response(
+        content=json.dumps(products, ensure_ascii=False, separators=(",", ":")),
+        media_type="application/json",
+    )
+
+
+@app.post("/search/batch", response_model=list[Batch_Search_Result])
+async def search_batch(query: Batch_Search_Schema):
+    """Search for products using many queries and locales in one call. Like /search,
+    every query returns at most search_max_k products, queries asking for more fail
+    on their own."""
+    max_items = int(os.environ.get("search_batch_max_items", 256))
+    if len(query.items) > max_items:
+        raise HTTPException(
+            status_code=400, detail=f"Batch exceeds {max_items} queries."
+        )
+    items = [(item.text, item.locale, item.k) for item in query.items]
+    max_k = int(os.environ.get("search_max_k", 100))
+    results = await db_service.batch_search(items, max_k)
+    return [{"index": i, **result} for i, result in enumerate(results)]
+
+
+async def answer_query(websocket: WebSocket, query: dict):
+    """
+    Answers one chat request. Its frames carry the request ID sent by the client, so
+    several requests can be in flight on one connection.
+
+    Args:
+        websocket (WebSocket): The websocket of the client.
+        query (dict): The text, locale, user_session_id and optional request_id.
+    """
+    request_id_var.set(query.get("request_id"))
+    try:
+        await llm_agent.run(
+            query["text"], query["locale"], query["user_session_id"], websocket
+        )
+    except Scheduler_Overloaded as e:
+        metrics.increment("scheduler.rejected")
+        await send_frame(websocket, {"type": "error", "output": str(e)})
+        await send_frame(websocket, {"type": "end", "output": ""})
+    except asyncio.CancelledError:
+        # stopped by the client, or the client is gone and the frame is discarded
+        await send_frame(websocket, {"type": "end", "output": ""})
+        raise
+    except Exception as e:
+        print(f"Error answering query: {e}")
+        if websocket.client_state == WebSocketState.CONNECTED:
+            await send_frame(
+                websocket, {"type": "error", "output": "Error generating response."}
+            )
+            await send_frame(websocket, {"type": "end", "output": ""})
 
 
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
-    """WebSocket endpoint for LLM chat"""
-    await websocket_service.connect(websocket)
+    """WebSocket endpoint for LLM chat. Every request is answered in its own task,
+    so the connection can be kept open and shared by consecutive or concurrent
+    requests. A stop message, or the client disconnecting, cancels the requests
+    still being answered, freeing the model."""
+    if not await websocket_service.connect(websocket):
+        return
+    # request ID of every request still being answered, by task
+    tasks = {}
     try:
         while True:
             data = await websocket.receive_text()
-            if data.startswith("start"):
+            if data.startswith("stop"):
+                request_id = json.loads(data[5:] or "{}").get("request_id")
+                for task, task_request_id in list(tasks.items()):
+                    if request_id is None or task_request_id == request_id:
+                        if task.cancel():
+                            metrics.increment("chat.cancelled.stop")
+            elif data.startswith("start"):
                 query = json.loads(data[6:])
                 print(f"Received query: {query}")
                 if query:
-                    llm = llm_agent.llm_provider
-                    locale = query["locale"]
-                    text = query["text"]
-                    user_session_id = query["user_session_id"]
-                    response = await llm_agent.run(
-                        text, locale, user_session_id, websocket
-                    )
+                    task = asyncio.create_task(answer_query(websocket, query))
+                    tasks[task] = query.get("request_id")
+                    task.add_done_callback(tasks.pop)
                 else:
-                    await websocket.send_json(
+                    await send_frame(
+                        websocket,
                         {
                             "type": "error",
                             "output": "Error: not enough parameters provided.",
-                        }
+                        },
                     )
                     print("Error: not enough parameters provided.")
 
     except WebSocketDisconnect:
+        pass
+    finally:
+        cancelled = sum(task.cancel() for task in list(tasks))
+        if cancelled:
+            metrics.increment("chat.cancelled.disconnect", cancelled)
         await websocket_service.disconnect(websocket)
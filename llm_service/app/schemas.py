@@ -1,5 +1,14 @@
 from pydantic import BaseModel
 
+PRODUCT_FIELDS = [
+    "product_id",
+    "product_title",
+    "product_description",
+    "product_bullet_point",
+    "product_brand",
+    "product_color",
+]
+
 
 class UserQuery(BaseModel):
     """
@@ -19,10 +28,42 @@ class Search_Schema(BaseModel):
     Attributes:
         text (str): The text to search.
         locale (str): The locale for the search (default is "us").
+        k (int): The number of products to return (default is 10).
+        offset (int): The number of top products to skip, for pagination (default is 0).
+        fields (list[str], optional): The product fields to return (default is all fields).
     """
 
     text: str
     locale: str = "us"
+    k: int = 10
+    offset: int = 0
+    fields: list[str] = None
+
+
+class Batch_Search_Item(BaseModel):
+    """
+    Represents a single query of a batch search.
+
+    Attributes:
+        text (str): The text to search.
+        locale (str): The locale for the search (default is "us").
+        k (int): The number of products to return (default is 10).
+    """
+
+    text: str
+    locale: str = "us"
+    k: int = 10
+
+
+class Batch_Search_Schema(BaseModel):
+    """
+    Represents a batch search schema.
+
+    Attributes:
+        items (list[Batch_Search_Item]): The queries to search.
+    """
+
+    items: list[Batch_Search_Item]
 
 
 class ProductSchema(BaseModel):
@@ -44,3 +85,18 @@ class ProductSchema(BaseModel):
     product_bullet_point: str = None
     product_brand: str = None
     product_color: str = None
+
+
+class Batch_Search_Result(BaseModel):
+    """
+    Represents the result of a single query of a batch search.
+
+    Attributes:
+        index (int): The position of the query in the request.
+        products (list[ProductSchema]): The matching products.
+        error (str, optional): The error message if the query failed (default is None).
+    """
+
+    index: int
+    products: list[ProductSchema] = []
+    error: str = None
@@ -1,3 +1,6 @@
 from .database.chroma_db import DB_Service
 from .websocket.websocket import WebSocket_Service
 from .llm_agent.agent import LLM_Agent
+from .llm_agent.llm_provider.scheduler import Scheduler_Overloaded
+from .metrics import metrics
+from .websocket.framing import send_frame, request_id_var
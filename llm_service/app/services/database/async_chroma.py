@@ -0,0 +1,101 @@
+import random
+import asyncio
+import httpx
+
+RETRY_STATUS_CODES = {429, 502, 503, 504}
+
+
+class Async_Chroma_Client:
+    """
+    Asynchronous client of the chroma REST API with a keep-alive connection pool,
+    per-call timeouts and retries with exponential backoff and full jitter.
+
+    Attributes:
+        base_url (str): The URL of the chroma server.
+        retries (int): The number of retries of a failed call.
+        backoff (float): The base delay between retries in seconds.
+    """
+
+    def __init__(
+        self, host: str, port, pool_size=100, timeout=10.0, retries=3, backoff=0.1
+    ):
+        self.base_url = f"http://{host}:{port}"
+        self.retries = retries
+        self.backoff = backoff
+        self.client = httpx.AsyncClient(
+            base_url=self.base_url,
+            limits=httpx.Limits(
+                max_connections=pool_size, max_keepalive_connections=pool_size
+            ),
+            timeout=httpx.Timeout(timeout),
+        )
+
+    async def _post(self, path: str, body: dict):
+        """
+        Posts a request, retrying transport errors and overloaded responses.
+
+        Args:
+            path (str): The API path.
+            body (dict): The JSON body.
+
+        Returns:
+            dict: The JSON response.
+
+        Raises:
+            httpx.HTTPError: If the last attempt failed.
+        """
+        for attempt in range(self.retries + 1):
+            try:
+                response = await self.client.post(path, json=body)
+                if response.status_code not in RETRY_STATUS_CODES:
+                    response.raise_for_status()
+                    return response.json()
+                if attempt == self.retries:
+                    response.raise_for_status()
+            except httpx.TransportError:
+                if attempt == self.retries:
+                    raise
+            await asyncio.sleep(random.uniform(0, self.backoff * 2**attempt))
+
+    async def query(
+        self, collection_id, embeddings, k: int, where=None, include=("metadatas",)
+    ):
+        """
+        Finds the nearest records of every query embedding in a collection.
+
+        Args:
+            collection_id: The ID of the collection.
+            embeddings (list): The query embeddings.
+            k (int): The number of records per query.
+            where (dict, optional): Metadata filter. Defaults to None.
+            include (tuple, optional): The fields to return. Defaults to metadatas.
+
+        Returns:
+            dict: The chroma query response.
+        """
+        body = {
+            "query_embeddings": [list(map(float, e)) for e in embeddings],
+            "n_results": k,
+            "include": list(include),
+        }
+        if where:
+            body["where"] = where
+        return await self._post(f"/api/v1/collections/{collection_id}/query", body)
+
+    async def get(self, collection_id, ids, include=("metadatas",)):
+        """
+        Fetches records of a collection by ID.
+
+        Args:
+            collection_id: The ID of the collection.
+            ids (list): The record IDs.
+            include (tuple, optional): The fields to return. Defaults to metadatas.
+
+        Returns:
+            dict: The chroma get response.
+        """
+        body = {"ids": list(ids), "include": list(include)}
+        return await self._post(f"/api/v1/collections/{collection_id}/get", body)
+
+    async def aclose(self):
+        await self.client.aclose()
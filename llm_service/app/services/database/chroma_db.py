@@ -1,19 +1,93 @@
 import os
 import re
+import time
+import asyncio
+import threading
 import chromadb
-from langchain.vectorstores import Chroma
+from langchain_core.documents import Document
 from sentence_transformers import SentenceTransformer
 from chromadb import Documents, EmbeddingFunction, Embeddings
+from .embedding_cache import EmbeddingCache, DiskEmbeddingTier, normalize_text
+from .embedding_executor import EmbeddingExecutor
+from .vector_backend import Chroma_Backend, Backend_Retriever
+from .async_chroma import Async_Chroma_Client
+from .local_index import Local_Backend
+from .lexical_index import Hybrid_Backend
+from .onnx_embedding import load_onnx_model
+from .product_store import Product_Store
+
+CLEAN_PATTERNS = [
+    # Remove HTML tags
+    (re.compile(r"<.*?>"), ""),
+    # Replace HTML entities with a space
+    (re.compile(r"&[a-zA-Z0-9#]+;"), " "),
+    # Remove markdown links
+    (re.compile(r"\[(.*?)\]\(.*?\)"), r"\1"),
+    # Remove URLs
+    (re.compile(r"http\S+|www\S+"), ""),
+]
+SPECIAL_CHARACTERS = re.compile(r"[^a-z0-9\s]")
+
+DESCRIPTION_PREFIX = "It's description says...\n "
 
 
 class CustomEmbeddingFunction(EmbeddingFunction):
-    """Custom embedding function that uses SentenceTransformer to embed documents."""
+    """Custom embedding function that uses SentenceTransformer to embed documents.
+    If a cache is given, only texts missing from the cache are encoded. If an executor
+    is given, encodes are batched with concurrent requests on its worker threads."""
 
-    def __init__(self, model):
+    def __init__(self, model, cache=None, executor=None):
         self.model = model
+        self.cache = cache
+        self.executor = executor
+
+    def _encode(self, texts):
+        if self.executor is not None:
+            return self.executor.encode(texts)
+        return self.model.encode(texts)
+
+    async def _aencode(self, texts):
+        if self.executor is not None:
+            return await self.executor.aencode(texts)
+        return await asyncio.to_thread(self.model.encode, texts)
+
+    def _lookup(self, input):
+        """Returns the cached embeddings of the input and the indices of the misses,
+        grouped by normalized text so duplicates are only encoded once."""
+        embeddings = [self.cache.get(text) for text in input]
+        missing = {}
+        for i, embedding in enumerate(embeddings):
+            if embedding is None:
+                missing.setdefault(normalize_text(input[i]), []).append(i)
+        texts = [input[indices[0]] for indices in missing.values()]
+        return embeddings, texts, list(missing.values())
+
+    def _fill(self, embeddings, texts, missing, encoded):
+        for text, indices, vector in zip(texts, missing, encoded):
+            vector = vector.tolist()
+            self.cache.put(text, vector)
+            for i in indices:
+                embeddings[i] = vector
+        return embeddings
 
     def __call__(self, input: Documents) -> Embeddings:
-        return self.model.encode(input).tolist()
+        if self.cache is None:
+            return self._encode(input).tolist()
+
+        embeddings, texts, missing = self._lookup(input)
+        if missing:
+            self._fill(embeddings, texts, missing, self._encode(texts))
+        return embeddings
+
+    async def aembed(self, input: Documents) -> Embeddings:
+        """Embeds the input without blocking the event loop."""
+        if self.cache is None:
+            return (await self._aencode(input)).tolist()
+
+        embeddings, texts, missing = self._lookup(input)
+        if missing:
+            self._fill(embeddings, texts, missing, await self._aencode(texts))
+        return embeddings
 
 
 class DefChromaEF(Embeddings):
@@ -35,11 +109,17 @@ class DB_Service:
     """
 
     def __init__(self):
-        self.model = SentenceTransformer(self._get_embedding_mode_name())
-        self.emb_fn = CustomEmbeddingFunction(self.model)
-
-        self.client = chromadb.HttpClient(
-            host=os.environ["db_host"], port=os.environ["db_port"]
+        model_name = self._get_embedding_mode_name()
+        self.model, cache_name = self._load_embedding_model(model_name)
+        self.embedding_cache = self._create_embedding_cache(cache_name)
+        self.embedding_executor = EmbeddingExecutor(
+            self.model,
+            max_batch_size=int(os.environ.get("embedding_max_batch_size", 32)),
+            max_wait_ms=float(os.environ.get("embedding_max_wait_ms", 5)),
+            workers=int(os.environ.get("embedding_executor_workers", 1)),
+        )
+        self.emb_fn = CustomEmbeddingFunction(
+            self.model, self.embedding_cache, self.embedding_executor
         )
 
         self.collection_names = {}
@@ -47,11 +127,96 @@ class DB_Service:
         self.collection_names["es"] = "es_products"
         self.collection_names["jp"] = "jp_products"
 
-        self.collections = {}
-        for locale in self.collection_names:
-            self.collections[locale] = self.client.get_collection(
-                name=self.collection_names[locale], embedding_function=self.emb_fn
+        self.backend = self._create_backend()
+
+        # exact product-ID lookups are served by the key-value store written by
+        # init_db.py if it is available, otherwise by the vector backend.
+        self.product_store = None
+        product_store_path = os.environ.get("product_store_path")
+        if product_store_path:
+            self.product_store = Product_Store(product_store_path)
+
+        # retrievers are reused across requests and only rebuilt when the data of a
+        # locale is rebuilt.
+        self._retrievers = {}
+        self._refresh_listeners = []
+        self._registry_lock = threading.Lock()
+        self.collection_refresh_interval = float(
+            os.environ.get("collection_refresh_interval", 60)
+        )
+        self._last_refresh = time.monotonic()
+        self._refresh_task = None
+        self._build_retrievers()
+
+    def close(self):
+        """Stops the embedding executor, flushes the embedding cache and closes the
+        vector backend."""
+        self.embedding_executor.close()
+        if self.embedding_cache is not None:
+            self.embedding_cache.close()
+        self.backend.close()
+        if self.product_store is not None:
+            self.product_store.close()
+
+    async def aclose(self):
+        """Closes the pooled connections of the vector backend and then everything
+        closed by close."""
+        await self.backend.aclose()
+        self.close()
+
+    def _create_backend(self):
+        """
+        Creates the vector backend selected by the vector_backend environment variable.
+
+        The chroma backend queries the chroma server, the async paths through a
+        pooled keep-alive client sized by chroma_pool_size with chroma_timeout
+        seconds per call and chroma_retries retries. The local backend searches the
+        memory-mapped matrices in local_index_dir in-process. Unless retrieval_mode
+        is vector, the backend is combined with the BM25 indexes in lexical_index_dir.
+
+        Returns:
+            Vector_Backend: The vector backend.
+
+        Raises:
+            ValueError: If the backend is unknown.
+        """
+        backend = os.environ.get("vector_backend", "chroma")
+        if backend == "chroma":
+            client = chromadb.HttpClient(
+                host=os.environ["db_host"], port=os.environ["db_port"]
+            )
+            async_client = Async_Chroma_Client(
+                os.environ["db_host"],
+                os.environ["db_port"],
+                pool_size=int(os.environ.get("chroma_pool_size", 100)),
+                timeout=float(os.environ.get("chroma_timeout", 10)),
+                retries=int(os.environ.get("chroma_retries", 3)),
+                backoff=float(os.environ.get("chroma_retry_backoff", 0.1)),
+            )
+            vector_backend = Chroma_Backend(
+                client, self.collection_names, self.emb_fn, async_client
+            )
+        elif backend == "local":
+            vector_backend = Local_Backend(
+                os.environ.get("local_index_dir", "./local_index"),
+                self.collection_names,
+                index_type=os.environ.get("local_index_type", "exact"),
+                hnsw_ef=int(os.environ.get("local_index_hnsw_ef", 64)),
             )
+        else:
+            raise ValueError(f"Unknown vector backend: {backend}")
+
+        retrieval_mode = os.environ.get("retrieval_mode", "vector")
+        if retrieval_mode == "vector":
+            return vector_backend
+        return Hybrid_Backend(
+            vector_backend,
+            os.environ.get("lexical_index_dir", "./lexical_index"),
+            self.collection_names,
+            mode=retrieval_mode,
+            candidates=int(os.environ.get("lexical_candidates", 100)),
+            rrf_k=int(os.environ.get("rrf_k", 60)),
+        )
 
     def _get_embedding_mode_name(self):
         """
@@ -68,32 +233,267 @@ class DB_Service:
         except:
             raise Exception("Embedding model name not found in environment variables..")
 
-    def search(self, query: str, locale: str):
+    def _load_embedding_model(self, model_name: str):
+        """
+        Loads the query embedding model with the backend selected by the
+        embedding_backend environment variable.
+
+        The onnx backend runs an int8 quantized export of the model with onnxruntime,
+        exporting it on first use. It falls back to the torch backend if the export
+        fails or does not match the PyTorch embeddings closely enough.
+
+        Args:
+            model_name (str): The name of the embedding model.
+
+        Returns:
+            tuple: The model and the name its embeddings are cached under.
+        """
+        if os.environ.get("embedding_backend", "torch") == "onnx":
+            try:
+                model = load_onnx_model(
+                    model_name,
+                    os.environ.get("embedding_onnx_dir", "./onnx_model"),
+                    threads=int(os.environ.get("embedding_onnx_threads", 0)),
+                    min_parity=float(os.environ.get("embedding_onnx_min_parity", 0.99)),
+                )
+                return model, f"{model_name}-onnx-int8"
+            except ImportError as e:
+                print(
+                    f"Warning: embedding_backend=onnx needs the {e.name} package, see"
+                    " requirements-optional.txt. Using PyTorch."
+                )
+            except Exception as e:
+                print(f"Error loading ONNX embedding model, using PyTorch: {e}")
+        return SentenceTransformer(model_name), model_name
+
+    def _create_embedding_cache(self, model_name: str):
+        """
+        Creates the query embedding cache from environment variables.
+
+        The cache is disabled when embedding_cache_size is 0. The memory-mapped disk
+        tier is only enabled when embedding_cache_dir is set.
+
+        Args:
+            model_name (str): The name of the embedding model.
+
+        Returns:
+            EmbeddingCache: The embedding cache, or None if disabled.
+        """
+        maxsize = int(os.environ.get("embedding_cache_size", 10000))
+        if maxsize <= 0:
+            return None
+        ttl = int(os.environ.get("embedding_cache_ttl", 3600))
+
+        disk_tier = None
+        cache_dir = os.environ.get("embedding_cache_dir")
+        if cache_dir:
+            disk_tier = DiskEmbeddingTier(
+                cache_dir,
+                model_name,
+                self.model.get_sentence_embedding_dimension(),
+                capacity=int(os.environ.get("embedding_cache_disk_size", 100000)),
+            )
+        return EmbeddingCache(model_name, maxsize=maxsize, ttl=ttl, disk_tier=disk_tier)
+
+    def search(self, query: str, locale: str, k=10):
         """
         Searches the database for documents matching the query in the specified locale.
 
         Args:
             query (str): The search query.
             locale (str): The locale to search in.
+            k (int, optional): The number of documents to return. Defaults to 10.
 
         Returns:
             list: The list of matching documents.
 
         Raises:
-            Error: If no documents are found.
-            RuntimeError: If there is an error searching the database.
+            RuntimeError: If no documents are found or there is an error searching the database.
         """
         try:
-            collection = self.collections[locale]
-            response = collection.query(query_text=[query], top_k=10)
-            documents = results["metadatas"][0]
+            response = self.backend.query(
+                locale, self.emb_fn([query]), k, texts=[query]
+            )
+            documents = response["metadatas"][0]
             if documents:
                 return documents
-            raise Error("No documents found")
+            raise LookupError("No documents found")
         except Exception as e:
             print(f"Error searching database: {e}")
             raise RuntimeError("Error searching database...")
 
+    async def asearch(self, query: str, locale: str, k=10, offset=0, fields=None):
+        """
+        Searches the database without blocking the event loop, returning one page of
+        products reduced to the requested fields. Only the metadatas are fetched
+        from the vector backend.
+
+        Args:
+            query (str): The search query.
+            locale (str): The locale to search in.
+            k (int, optional): The number of products to return. Defaults to 10.
+            offset (int, optional): The number of top products to skip. Defaults to 0.
+            fields (list, optional): The metadata fields to return. Defaults to None,
+                which returns all fields.
+
+        Returns:
+            list: The matching products.
+        """
+        embeddings = await self.emb_fn.aembed([query])
+        response = await self._fresh_call(
+            locale,
+            lambda: self.backend.aquery(locale, embeddings, offset + k, texts=[query]),
+        )
+        products = response["metadatas"][0][offset:]
+        if fields is None:
+            return products
+        return [
+            {field: product.get(field) for field in fields} for product in products
+        ]
+
+    async def batch_search(self, items, max_k=None):
+        """
+        Searches the database for many queries at once. All query texts are embedded
+        in one batch and one multi-query request is issued per locale. Items with an
+        unknown locale or a k out of range fail on their own without being searched.
+
+        Args:
+            items (list): (text, locale, k) tuples.
+            max_k (int, optional): The largest k of an item. Defaults to None, which
+                does not limit k.
+
+        Returns:
+            list: One dict per item in input order, with the matching "products"
+            and an "error" message which is None if the item succeeded.
+        """
+        results = [{"products": [], "error": None} for _ in items]
+        by_locale = {}
+        for i, (_, locale, k) in enumerate(items):
+            if locale not in self.collection_names:
+                results[i]["error"] = f"Unknown locale: {locale}"
+            elif k < 1:
+                results[i]["error"] = "k must be at least 1."
+            elif max_k is not None and k > max_k:
+                results[i]["error"] = f"k must be at most {max_k}."
+            else:
+                by_locale.setdefault(locale, []).append(i)
+        valid = [i for indices in by_locale.values() for i in indices]
+        if not valid:
+            return results
+
+        try:
+            encoded = await self.emb_fn.aembed([items[i][0] for i in valid])
+        except Exception as e:
+            print(f"Error embedding batch queries: {e}")
+            for i in valid:
+                results[i]["error"] = "Error embedding queries"
+            return results
+        embeddings = dict(zip(valid, encoded))
+
+        async def query_locale(locale, indices):
+            try:
+                response = await self._fresh_call(
+                    locale,
+                    lambda: self.backend.aquery(
+                        locale,
+                        [embeddings[i] for i in indices],
+                        max(items[i][2] for i in indices),
+                        texts=[items[i][0] for i in indices],
+                    ),
+                )
+                for i, metadatas in zip(indices, response["metadatas"]):
+                    results[i]["products"] = metadatas[: items[i][2]]
+            except Exception as e:
+                print(f"Error searching database for locale {locale}: {e}")
+                for i in indices:
+                    results[i]["error"] = "Error searching database"
+
+        await asyncio.gather(
+            *(query_locale(locale, indices) for locale, indices in by_locale.items())
+        )
+        return results
+
+    def get_products(self, locale: str, product_ids):
+        """
+        Fetches products by exact product ID, without embedding or vector search.
+
+        Args:
+            locale (str): The locale of the products.
+            product_ids (list): The product IDs.
+
+        Returns:
+            list: The documents of the found products, in the order of the IDs.
+
+        Raises:
+            RuntimeError: If there is an error fetching the products.
+        """
+        product_ids = [product_id.strip() for product_id in product_ids]
+        if not product_ids:
+            return []
+        try:
+            if self.product_store is not None:
+                found = self.product_store.get(locale, product_ids)
+            else:
+                found = self.backend.get(locale, product_ids)
+        except Exception as e:
+            print(f"Error fetching products: {e}")
+            raise RuntimeError("Error fetching products...")
+        return self._to_documents(product_ids, found)
+
+    def _to_documents(self, product_ids, found):
+        """Builds the documents of the found products in the order of the IDs."""
+        documents = []
+        for product_id in dict.fromkeys(product_ids):
+            metadata = found.get(product_id)
+            if metadata is not None:
+                documents.append(
+                    Document(page_content=metadata["product_title"], metadata=metadata)
+                )
+        return documents
+
+    def get_product(self, locale: str, product_id: str):
+        """
+        Fetches a product by exact product ID.
+
+        Args:
+            locale (str): The locale of the product.
+            product_id (str): The product ID.
+
+        Returns:
+            Document: The document of the product, or None if it does not exist.
+        """
+        documents = self.get_products(locale, [product_id])
+        return documents[0] if documents else None
+
+    async def aget_products(self, locale: str, product_ids):
+        """
+        Fetches products by exact product ID without blocking the event loop. Lookups
+        in the local key-value store are fast enough to run inline.
+
+        Args:
+            locale (str): The locale of the products.
+            product_ids (list): The product IDs.
+
+        Returns:
+            list: The documents of the found products, in the order of the IDs.
+
+        Raises:
+            RuntimeError: If there is an error fetching the products.
+        """
+        if self.product_store is not None:
+            return self.get_products(locale, product_ids)
+        product_ids = [product_id.strip() for product_id in product_ids]
+        if not product_ids:
+            return []
+        try:
+            found = await self._fresh_call(
+                locale, lambda: self.backend.aget(locale, product_ids)
+            )
+        except Exception as e:
+            print(f"Error fetching products: {e}")
+            raise RuntimeError("Error fetching products...")
+        return self._to_documents(product_ids, found)
+
     def clean_text(self, text):
         """
         Cleans the text by removing HTML tags, entities, markdown links, and URLs.
@@ -104,20 +504,56 @@ class DB_Service:
         Returns:
             str: The cleaned text.
         """
-        # Remove HTML tags
-        text = re.sub(r"<.*?>", "", text)
-        # Replace HTML entities with a space
-        text = re.sub(r"&[a-zA-Z0-9#]+;", " ", text)
-        # Remove markdown links
-        text = re.sub(r"\[(.*?)\]\(.*?\)", r"\1", text)
-        # Remove URLs
-        text = re.sub(r"http\S+|www\S+", "", text)
+        for pattern, replacement in CLEAN_PATTERNS:
+            text = pattern.sub(replacement, text)
         # Convert to lowercase
         text = text.lower()
         # Remove special characters (keep only alphanumeric and whitespace)
-        text = re.sub(r"[^a-z0-9\s]", "", text)
+        text = SPECIAL_CHARACTERS.sub("", text)
         return text
 
+    def format_doc_parts(self, document):
+        """
+        Splits the context fragment of a product into its head, holding the ID,
+        title, color and brand, and its cleaned description.
+
+        Args:
+            document (dict): The metadata of the product.
+
+        Returns:
+            tuple: The head and the description of the product.
+        """
+        context = document.get("product_context")
+        if context is not None:
+            head, _, description = context.partition(DESCRIPTION_PREFIX)
+            return head, description.removesuffix(".\n\n")
+
+        head = ""
+        head += f"Product Id {document['product_id']}. \n"
+        head += f"Title is {document['product_title']}. \n"
+        head += f"It's color is {document['product_color']}. "
+        head += f"It's Brand is {document['product_brand']}. "
+        return head, self.clean_text(document["product_description"])
+
+    def format_doc(self, document):
+        """
+        Formats the context fragment of a product.
+
+        Products ingested by init_db.py carry the cleaned and truncated fragment in
+        their product_context metadata. It is only built here for older databases.
+
+        Args:
+            document (dict): The metadata of the product.
+
+        Returns:
+            str: The formatted product.
+        """
+        context = document.get("product_context")
+        if context is not None:
+            return context
+        head, description = self.format_doc_parts(document)
+        return f"{head}{DESCRIPTION_PREFIX}{description}.\n\n"
+
     def format_docs(self, documents):
         """
         Formats the retrieved documents into a readable string.
@@ -128,27 +564,123 @@ class DB_Service:
         Returns:
             str: The formatted documents.
         """
-        formatted_docs = "\nProduct catalogues:\n"
-        for doc in documents:
-            document = doc.metadata
-            docstr = ""
-            docstr += f"Product Id {document['product_id']}. \n"
-            docstr += f"Title is {document['product_title']}. \n"
-            docstr += f"It's color is {document['product_color']}. "
-            docstr += f"It's Brand is {document['product_brand']}. "
-            docstr += f"It's description says...\n {self.clean_text(document['product_description'])}.\n\n"
+        return "\nProduct catalogues:\n" + "".join(
+            self.format_doc(doc.metadata) for doc in documents
+        )
+
+    def _build_retrievers(self):
+        """Builds the retriever handles used by the search endpoint and the agent."""
+        for locale in self.collection_names:
+            self.get_retriever(locale, k=10)
+            self.get_retriever(locale, k=5)
+
+    def refresh_collections(self, force=False):
+        """
+        Drops the cached retrievers of every locale whose data was rebuilt since it
+        was last resolved, e.g. a collection recreated on the chroma server.
+
+        Args:
+            force (bool, optional): Drop the cached handles of all locales. Defaults to False.
+
+        Returns:
+            list: The locales whose handles were dropped.
+        """
+        refreshed = self.backend.refresh(force)
+        with self._registry_lock:
+            for key in [key for key in self._retrievers if key[0] in refreshed]:
+                del self._retrievers[key]
+        self._last_refresh = time.monotonic()
+        if refreshed:
+            print(f"Refreshed collection handles for locales: {refreshed}")
+            for listener in self._refresh_listeners:
+                listener(refreshed)
+        return refreshed
+
+    def add_refresh_listener(self, listener):
+        """
+        Registers a callback invoked with the list of locales whose data was
+        rebuilt, e.g. to invalidate caches derived from them.
+
+        Args:
+            listener (callable): The callback.
+        """
+        self._refresh_listeners.append(listener)
+
+    def _claim_refresh(self):
+        """Returns whether the refresh interval has elapsed, restarting the interval
+        so concurrent callers do not refresh too."""
+        if self.collection_refresh_interval <= 0:
+            return False
+        now = time.monotonic()
+        if now - self._last_refresh < self.collection_refresh_interval:
+            return False
+        self._last_refresh = now
+        return True
+
+    def _refresh_collections_safely(self):
+        try:
+            self.refresh_collections()
+        except Exception as e:
+            print(f"Error refreshing collections: {e}")
+
+    def _maybe_refresh_collections(self):
+        """
+        Refreshes the collections if the refresh interval has elapsed. The refresh
+        resolves the collections on the chroma server, so on the event loop it runs
+        in a worker thread in the background instead of blocking the loop.
+        """
+        if not self._claim_refresh():
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._refresh_collections_safely()
+            return
+        self._refresh_task = loop.create_task(
+            asyncio.to_thread(self._refresh_collections_safely)
+        )
 
-            formatted_docs += docstr
+    async def _fresh_call(self, locale: str, call):
+        """
+        Awaits an async backend call, first refreshing the collection handles in a
+        worker thread if the refresh interval has elapsed. If the call fails because
+        the data of the locale was rebuilt in the meantime, it is retried once with
+        the new handle.
 
-        return formatted_docs
+        Args:
+            locale (str): The locale the call reads.
+            call (callable): Returns the awaitable of the backend call.
 
-    def get_retriever(self, locale: str, filter=None, k=5):
+        Returns:
+            The result of the call.
+        """
+        if self._claim_refresh():
+            await asyncio.to_thread(self._refresh_collections_safely)
+        try:
+            return await call()
+        except Exception as e:
+            try:
+                refreshed = await asyncio.to_thread(self.refresh_collections)
+            except Exception:
+                raise e
+            if locale not in refreshed:
+                raise
+        return await call()
+
+    def get_retriever(self, locale: str, filter=None, k=5, search_type="similarity"):
         """
-        Creates a retriever object for the specified locale with an optional filter.
+        Returns a retriever object for the specified locale with an optional filter.
+
+        Retrievers are cached per (locale, search_type, k, filter keys) and reused
+        across requests. Filtered retrievers are cheap copies of the cached handle
+        with the filter values filled in.
 
         Args:
             locale (str): The locale to create the retriever for.
             filter (dict, optional): The filter to apply to the retriever. Defaults to None.
+            k (int, optional): The number of documents to retrieve. Defaults to 5.
+            search_type (str, optional): The search type, only "similarity" is
+                supported. Defaults to "similarity".
 
         Returns:
             Retriever: The retriever object.
@@ -157,14 +689,32 @@ class DB_Service:
             RuntimeError: If there is an error creating the retriever.
         """
         try:
-            db = Chroma(
-                client=self.client,
-                collection_name=self.collection_names[locale],
-                embedding_function=DefChromaEF(self.emb_fn),
-            )
+            if search_type != "similarity":
+                raise ValueError(f"Unsupported search type: {search_type}")
+            self._maybe_refresh_collections()
+            if filter:
+                k = 1
+            filter_shape = tuple(sorted(filter)) if filter else None
+            key = (locale, search_type, k, filter_shape)
+
+            retriever = self._retrievers.get(key)
+            if retriever is None:
+                with self._registry_lock:
+                    retriever = self._retrievers.get(key)
+                    if retriever is None:
+                        retriever = Backend_Retriever(
+                            backend=self.backend,
+                            locale=locale,
+                            emb_fn=self.emb_fn,
+                            search_kwargs={"k": k},
+                        )
+                        self._retrievers[key] = retriever
+
             if filter:
-                return db.as_retriever(search_kwargs={"k": 1, "filter": filter})
-            return db.as_retriever(search_type="similarity", search_kwargs={"k": k})
+                return retriever.copy(
+                    update={"search_kwargs": {"k": k, "filter": filter}}
+                )
+            return retriever
         except Exception as e:
             print(f"Error creating retriever: {e}")
             raise RuntimeError("Error creating retriever")
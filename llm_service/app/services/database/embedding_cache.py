@@ -0,0 +1,185 @@
+import os
+import re
+import json
+import threading
+import unicodedata
+import numpy as np
+from cachetools import TTLCache
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normalizes a query so that trivially different spellings share a cache entry.
+
+    Args:
+        text (str): The raw query text.
+
+    Returns:
+        str: The NFKC normalized text with collapsed whitespace.
+    """
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+class DiskEmbeddingTier:
+    """
+    Fixed capacity, memory-mapped ring buffer of embeddings which survives restarts.
+
+    Vectors are stored in a float32 matrix file and the text -> row mapping is kept
+    in an append-only keys file. The vector is always written before its key line,
+    so a crash can at worst lose the latest entry.
+    """
+
+    def __init__(self, directory: str, model_name: str, dim: int, capacity=100000):
+        os.makedirs(directory, exist_ok=True)
+        safe_name = re.sub(r"[^A-Za-z0-9_.-]", "_", model_name)
+        prefix = os.path.join(directory, f"{safe_name}.{dim}.{capacity}")
+        self.matrix_path = f"{prefix}.f32"
+        self.keys_path = f"{prefix}.keys"
+        self.capacity = capacity
+
+        mode = "r+" if os.path.exists(self.matrix_path) else "w+"
+        self.matrix = np.memmap(
+            self.matrix_path, dtype=np.float32, mode=mode, shape=(capacity, dim)
+        )
+        self.rows = {}
+        self.row_keys = {}
+        self.next_row = 0
+        self._load_keys()
+        self._keys_file = open(self.keys_path, "a", encoding="utf-8", buffering=1)
+
+    def _load_keys(self):
+        """Rebuilds the in-memory index from the keys file, compacting it if needed."""
+        if not os.path.exists(self.keys_path):
+            return
+
+        lines = 0
+        with open(self.keys_path, "r", encoding="utf-8") as file:
+            for line in file:
+                try:
+                    row, key = json.loads(line)
+                except ValueError:
+                    continue
+                lines += 1
+                self._assign(row, key)
+                self.next_row = (row + 1) % self.capacity
+
+        if lines > 2 * self.capacity:
+            self._compact()
+
+    def _assign(self, row: int, key: str):
+        previous = self.row_keys.get(row)
+        if previous is not None:
+            self.rows.pop(previous, None)
+        self.rows[key] = row
+        self.row_keys[row] = key
+
+    def _compact(self):
+        """Rewrites the keys file so it only contains live entries, in write order."""
+        tmp_path = f"{self.keys_path}.tmp"
+        ordered = sorted(
+            self.row_keys.items(),
+            key=lambda item: (item[0] - self.next_row) % self.capacity,
+        )
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            for row, key in ordered:
+                file.write(json.dumps([row, key]) + "\n")
+        os.replace(tmp_path, self.keys_path)
+
+    def get(self, key: str):
+        row = self.rows.get(key)
+        if row is None:
+            return None
+        return self.matrix[row].tolist()
+
+    def put(self, key: str, embedding):
+        if key in self.rows:
+            return
+        row = self.next_row
+        self.matrix[row] = np.asarray(embedding, dtype=np.float32)
+        self._keys_file.write(json.dumps([row, key]) + "\n")
+        self._assign(row, key)
+        self.next_row = (row + 1) % self.capacity
+
+    def close(self):
+        self.matrix.flush()
+        self._keys_file.close()
+
+
+class EmbeddingCache:
+    """
+    Bounded LRU/TTL cache for query embeddings with an optional on-disk tier.
+
+    Attributes:
+        model_name (str): The embedding model the cached vectors belong to.
+        memory (TTLCache): In-memory tier keyed by (model name, normalized text).
+        disk (DiskEmbeddingTier): Optional memory-mapped tier, None if disabled.
+        hits (int): Lookups served from memory.
+        disk_hits (int): Lookups served from the disk tier.
+        misses (int): Lookups which required encoding.
+    """
+
+    def __init__(self, model_name: str, maxsize=10000, ttl=3600, disk_tier=None):
+        self.model_name = model_name
+        self.memory = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.disk = disk_tier
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, text: str):
+        """
+        Looks up the embedding of a text.
+
+        Args:
+            text (str): The query text.
+
+        Returns:
+            list: The cached embedding, or None on a miss.
+        """
+        normalized = normalize_text(text)
+        with self._lock:
+            embedding = self.memory.get((self.model_name, normalized))
+            if embedding is not None:
+                self.hits += 1
+                return embedding
+
+            if self.disk is not None:
+                embedding = self.disk.get(normalized)
+                if embedding is not None:
+                    self.disk_hits += 1
+                    self.memory[(self.model_name, normalized)] = embedding
+                    return embedding
+
+            self.misses += 1
+            return None
+
+    def put(self, text: str, embedding):
+        """
+        Stores the embedding of a text in every enabled tier.
+
+        Args:
+            text (str): The query text.
+            embedding (list): The embedding vector.
+        """
+        normalized = normalize_text(text)
+        with self._lock:
+            self.memory[(self.model_name, normalized)] = embedding
+            if self.disk is not None:
+                self.disk.put(normalized, embedding)
+
+    def stats(self):
+        """Returns the hit/miss counters and current sizes of the cache."""
+        with self._lock:
+            return {
+                "model_name": self.model_name,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "memory_size": len(self.memory),
+                "disk_size": len(self.disk.rows) if self.disk is not None else 0,
+            }
+
+    def close(self):
+        if self.disk is not None:
+            self.disk.close()
@@ -0,0 +1,127 @@
+import time
+import queue
+import asyncio
+import threading
+from concurrent.futures import Future
+
+
+class EmbeddingExecutor:
+    """
+    Runs SentenceTransformer encodes on background threads and coalesces requests
+    which arrive within max_wait_ms of each other into one batched encode call.
+
+    Attributes:
+        model (SentenceTransformer): The model used for encoding.
+        max_batch_size (int): The maximum number of texts encoded in one call.
+        max_wait (float): Seconds a batch waits for more requests before encoding.
+        batches (int): Number of encode calls made.
+        encoded (int): Number of texts encoded.
+    """
+
+    def __init__(self, model, max_batch_size=32, max_wait_ms=5, workers=1):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.batches = 0
+        self.encoded = 0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._workers = [
+            threading.Thread(
+                target=self._worker, name=f"embedding-executor-{i}", daemon=True
+            )
+            for i in range(workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, texts):
+        """
+        Queues texts for encoding.
+
+        Args:
+            texts (list): The texts to encode.
+
+        Returns:
+            Future: Resolves to the embeddings of the texts, in input order.
+        """
+        future = Future()
+        self._queue.put((list(texts), future))
+        return future
+
+    def encode(self, texts):
+        """Encodes texts, blocking the calling thread until the batch has run."""
+        return self.submit(texts).result()
+
+    async def aencode(self, texts):
+        """Encodes texts without blocking the event loop."""
+        return await asyncio.wrap_future(self.submit(texts))
+
+    def _worker(self):
+        carry = None
+        stopping = False
+        while not stopping:
+            item = carry if carry is not None else self._queue.get()
+            carry = None
+            if item is None:
+                break
+
+            batch = [item]
+            size = len(item[0])
+            deadline = time.monotonic() + self.max_wait
+            while size < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                if size + len(item[0]) > self.max_batch_size:
+                    carry = item
+                    break
+                batch.append(item)
+                size += len(item[0])
+
+            self._run_batch(batch)
+
+    def _run_batch(self, batch):
+        batch = [item for item in batch if item[1].set_running_or_notify_cancel()]
+        if not batch:
+            return
+
+        texts = [text for item_texts, _ in batch for text in item_texts]
+        try:
+            embeddings = self.model.encode(texts, batch_size=self.max_batch_size)
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        offset = 0
+        for item_texts, future in batch:
+            future.set_result(embeddings[offset : offset + len(item_texts)])
+            offset += len(item_texts)
+
+        with self._lock:
+            self.batches += 1
+            self.encoded += len(texts)
+
+    def stats(self):
+        """Returns the batching counters of the executor."""
+        with self._lock:
+            return {
+                "batches": self.batches,
+                "encoded": self.encoded,
+                "queued": self._queue.qsize(),
+            }
+
+    def close(self):
+        """Stops the worker threads once the queued requests are encoded."""
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join()
@@ -0,0 +1,326 @@
+import os
+import re
+import json
+import math
+import asyncio
+import sqlite3
+import threading
+import numpy as np
+from .vector_backend import Vector_Backend
+
+WORD_PATTERN = re.compile(r"\w+")
+# kana, CJK ideographs and hangul, which are not separated by spaces
+CJK_CHARACTERS = r"\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af"
+CJK_PATTERN = re.compile(f"[{CJK_CHARACTERS}]")
+CJK_RUN_PATTERN = re.compile(f"[{CJK_CHARACTERS}]+|[^{CJK_CHARACTERS}]+")
+
+
+def tokenize(text: str):
+    """
+    Splits a text into lowercase word tokens. CJK runs are split into character
+    bigrams. Must match the tokenizer of chromadb_service/lexical_index.py.
+
+    Args:
+        text (str): The text.
+
+    Returns:
+        list: The tokens.
+    """
+    tokens = []
+    for word in WORD_PATTERN.findall(text.lower()):
+        if not CJK_PATTERN.search(word):
+            tokens.append(word)
+            continue
+        for run in CJK_RUN_PATTERN.findall(word):
+            if not CJK_PATTERN.match(run) or len(run) == 1:
+                tokens.append(run)
+            else:
+                tokens.extend(run[i : i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+class Lexical_Index:
+    """
+    Memory-mapped BM25 inverted index of one locale, as built by init_db.py.
+
+    Attributes:
+        directory (str): The directory of the index.
+        version (float): The modification time of the manifest when loaded.
+        k1 (float): The BM25 term frequency saturation.
+        b (float): The BM25 document length normalization.
+    """
+
+    def __init__(self, directory: str, k1=1.2, b=0.75):
+        self.directory = directory
+        manifest_path = os.path.join(directory, "manifest.json")
+        self.version = os.path.getmtime(manifest_path)
+        with open(manifest_path, "r") as file:
+            manifest = json.load(file)
+        self.n_docs = manifest["docs"]
+        self.avg_doc_length = max(manifest["avg_doc_length"], 1.0)
+        self.k1 = k1
+        self.b = b
+
+        def load(name):
+            return np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r")
+
+        self.offsets = load("offsets")
+        self.docs = load("docs")
+        self.tfs = load("tfs")
+        self.doc_lengths = load("doc_lengths")
+        self.terms = sqlite3.connect(
+            f"file:{os.path.join(directory, 'terms.sqlite3')}?mode=ro",
+            uri=True,
+            check_same_thread=False,
+        )
+        self._lock = threading.Lock()
+
+    def search(self, text: str, k: int):
+        """
+        Ranks the products of the locale for a text with BM25.
+
+        Args:
+            text (str): The query text.
+            k (int): The number of products to return.
+
+        Returns:
+            list: The product IDs of the best matches, best first.
+        """
+        tokens = set(tokenize(text))
+        if not tokens or k <= 0:
+            return []
+        placeholders = ",".join("?" * len(tokens))
+        with self._lock:
+            term_ids = [
+                term_id
+                for (term_id,) in self.terms.execute(
+                    f"SELECT id FROM terms WHERE term IN ({placeholders})", list(tokens)
+                )
+            ]
+        if not term_ids:
+            return []
+
+        docs, scores = [], []
+        for term_id in term_ids:
+            start, end = int(self.offsets[term_id]), int(self.offsets[term_id + 1])
+            df = end - start
+            idf = math.log(1.0 + (self.n_docs - df + 0.5) / (df + 0.5))
+            term_docs = np.asarray(self.docs[start:end])
+            tfs = np.asarray(self.tfs[start:end], dtype=np.float32)
+            lengths = np.asarray(self.doc_lengths[term_docs], dtype=np.float32)
+            norm = self.k1 * (1.0 - self.b + self.b * lengths / self.avg_doc_length)
+            docs.append(term_docs)
+            scores.append(idf * tfs * (self.k1 + 1.0) / (tfs + norm))
+
+        unique_docs, inverse = np.unique(np.concatenate(docs), return_inverse=True)
+        totals = np.bincount(inverse, weights=np.concatenate(scores))
+        k = min(k, len(unique_docs))
+        best = np.argpartition(-totals, k - 1)[:k]
+        best = best[np.argsort(-totals[best])]
+        rows = [int(doc) for doc in unique_docs[best]]
+
+        placeholders = ",".join("?" * len(rows))
+        with self._lock:
+            product_ids = dict(
+                self.terms.execute(
+                    f"SELECT doc, product_id FROM docs WHERE doc IN ({placeholders})",
+                    rows,
+                )
+            )
+        return [product_ids[row] for row in rows]
+
+    def close(self):
+        self.terms.close()
+
+
+class Hybrid_Backend(Vector_Backend):
+    """
+    Vector backend which combines the BM25 indexes of the locales with another
+    vector backend, serving brand names, model numbers and product IDs which the
+    title embeddings capture poorly.
+
+    In hybrid mode the lexical and vector candidates are fused with reciprocal rank
+    fusion. In prefilter mode the lexical candidates narrow the vector search, which
+    only ranks them, falling back to a plain vector search without lexical matches.
+
+    Attributes:
+        backend (Vector_Backend): The vector backend.
+        directory (str): The directory holding one BM25 index per locale.
+        mode (str): hybrid or prefilter.
+        candidates (int): The number of lexical candidates per query.
+        rrf_k (int): The rank constant of reciprocal rank fusion.
+    """
+
+    def __init__(
+        self, backend, directory: str, locales, mode="hybrid", candidates=100, rrf_k=60
+    ):
+        if mode not in ("hybrid", "prefilter"):
+            raise ValueError(f"Unknown retrieval mode: {mode}")
+        self.backend = backend
+        self.directory = directory
+        self.locales = list(locales)
+        self.mode = mode
+        self.candidates = candidates
+        self.rrf_k = rrf_k
+        self.indexes = {}
+        self._lock = threading.Lock()
+
+    def _get_index(self, locale: str):
+        index = self.indexes.get(locale)
+        if index is None:
+            if locale not in self.locales:
+                raise LookupError(f"Unknown locale: {locale}")
+            with self._lock:
+                index = self.indexes.get(locale)
+                if index is None:
+                    index = Lexical_Index(os.path.join(self.directory, locale))
+                    self.indexes[locale] = index
+        return index
+
+    def _rank(self, lexical, response, k, include_documents):
+        """Fuses the lexical ranking with a vector query response."""
+        metadatas = {m["product_id"]: m for m in response["metadatas"][0]}
+        documents = {}
+        if include_documents:
+            documents = dict(zip(metadatas, response["documents"][0]))
+
+        scores = {}
+        for ranking in (lexical, list(metadatas)):
+            for rank, product_id in enumerate(ranking):
+                scores[product_id] = scores.get(product_id, 0.0) + 1.0 / (
+                    self.rrf_k + rank + 1
+                )
+        best = sorted(scores, key=scores.get, reverse=True)[:k]
+        missing = [product_id for product_id in best if product_id not in metadatas]
+        return best, metadatas, documents, missing
+
+    def _select(self, best, metadatas, documents):
+        best = [product_id for product_id in best if product_id in metadatas]
+        return (
+            [metadatas[product_id] for product_id in best],
+            [
+                documents.get(product_id, metadatas[product_id]["product_title"])
+                for product_id in best
+            ],
+        )
+
+    def _fuse(self, locale, embedding, text, k, include_documents):
+        lexical = self._get_index(locale).search(text, self.candidates)
+        response = self.backend.query(
+            locale, [embedding], max(k, self.candidates), None, include_documents
+        )
+        best, metadatas, documents, missing = self._rank(
+            lexical, response, k, include_documents
+        )
+        if missing:
+            metadatas.update(self.backend.get(locale, missing))
+        return self._select(best, metadatas, documents)
+
+    async def _afuse(self, locale, embedding, text, k, include_documents):
+        lexical = await asyncio.to_thread(
+            self._get_index(locale).search, text, self.candidates
+        )
+        response = await self.backend.aquery(
+            locale, [embedding], max(k, self.candidates), None, include_documents
+        )
+        best, metadatas, documents, missing = self._rank(
+            lexical, response, k, include_documents
+        )
+        if missing:
+            metadatas.update(await self.backend.aget(locale, missing))
+        return self._select(best, metadatas, documents)
+
+    def _prefilter(self, locale, embedding, text, k, include_documents):
+        lexical = self._get_index(locale).search(text, self.candidates)
+        where = {"product_id": {"$in": lexical}} if lexical else None
+        response = self.backend.query(locale, [embedding], k, where, include_documents)
+        documents = response.get("documents")
+        return response["metadatas"][0], documents[0] if documents else []
+
+    async def _aprefilter(self, locale, embedding, text, k, include_documents):
+        lexical = await asyncio.to_thread(
+            self._get_index(locale).search, text, self.candidates
+        )
+        where = {"product_id": {"$in": lexical}} if lexical else None
+        response = await self.backend.aquery(
+            locale, [embedding], k, where, include_documents
+        )
+        documents = response.get("documents")
+        return response["metadatas"][0], documents[0] if documents else []
+
+    def query(
+        self,
+        locale: str,
+        embeddings,
+        k: int,
+        where=None,
+        include_documents=False,
+        texts=None,
+    ):
+        if where or texts is None:
+            return self.backend.query(locale, embeddings, k, where, include_documents)
+
+        search = self._fuse if self.mode == "hybrid" else self._prefilter
+        response = {"metadatas": [], "documents": [] if include_documents else None}
+        for embedding, text in zip(embeddings, texts):
+            metadatas, documents = search(locale, embedding, text, k, include_documents)
+            response["metadatas"].append(metadatas)
+            if include_documents:
+                response["documents"].append(documents)
+        return response
+
+    async def aquery(
+        self,
+        locale: str,
+        embeddings,
+        k: int,
+        where=None,
+        include_documents=False,
+        texts=None,
+    ):
+        if where or texts is None:
+            return await self.backend.aquery(
+                locale, embeddings, k, where, include_documents
+            )
+
+        search = self._afuse if self.mode == "hybrid" else self._aprefilter
+        results = await asyncio.gather(
+            *(
+                search(locale, embedding, text, k, include_documents)
+                for embedding, text in zip(embeddings, texts)
+            )
+        )
+        response = {"metadatas": [], "documents": [] if include_documents else None}
+        for metadatas, documents in results:
+            response["metadatas"].append(metadatas)
+            if include_documents:
+                response["documents"].append(documents)
+        return response
+
+    def get(self, locale: str, product_ids):
+        return self.backend.get(locale, product_ids)
+
+    async def aget(self, locale: str, product_ids):
+        return await self.backend.aget(locale, product_ids)
+
+    def refresh(self, force=False):
+        refreshed = set(self.backend.refresh(force))
+        with self._lock:
+            for locale, index in list(self.indexes.items()):
+                manifest_path = os.path.join(index.directory, "manifest.json")
+                if force or os.path.getmtime(manifest_path) != index.version:
+                    # in-flight queries may still hold the index, it is closed
+                    # once garbage collected
+                    del self.indexes[locale]
+                    refreshed.add(locale)
+        return sorted(refreshed)
+
+    def close(self):
+        self.backend.close()
+        with self._lock:
+            for index in self.indexes.values():
+                index.close()
+            self.indexes.clear()
+
+    async def aclose(self):
+        await self.backend.aclose()
@@ -0,0 +1,283 @@
+import os
+import json
+import sqlite3
+import threading
+import numpy as np
+from .vector_backend import Vector_Backend
+
+
+class Local_Index:
+    """
+    Memory-mapped embeddings and metadata of one locale, as exported by
+    chromadb_service/export_local_index.py.
+
+    Attributes:
+        directory (str): The directory of the locale.
+        matrix (numpy.memmap): The embedding matrix, one row per product.
+        metric (str): The distance metric of the collection, l2, ip or cosine.
+        version (float): The modification time of the manifest when loaded.
+    """
+
+    def __init__(self, directory: str, index_type="exact", hnsw_ef=64):
+        self.directory = directory
+        manifest_path = os.path.join(directory, "manifest.json")
+        self.version = os.path.getmtime(manifest_path)
+        with open(manifest_path, "r") as file:
+            manifest = json.load(file)
+        self.metric = manifest.get("metric", "l2")
+        self.matrix = np.load(os.path.join(directory, "vectors.npy"), mmap_mode="r")
+        self.rows = sqlite3.connect(
+            f"file:{os.path.join(directory, 'rows.sqlite3')}?mode=ro",
+            uri=True,
+            check_same_thread=False,
+        )
+        self._lock = threading.Lock()
+        self._norms = self._compute_norms()
+        self.hnsw = None
+        if index_type == "hnsw":
+            self.hnsw = self._load_hnsw(hnsw_ef)
+
+    def _compute_norms(self, chunk_size=65536):
+        """Squared row norms for l2, row norms for cosine, one pass over the matrix."""
+        if self.metric == "ip":
+            return None
+        norms = np.empty(len(self.matrix), dtype=np.float32)
+        for start in range(0, len(self.matrix), chunk_size):
+            block = np.asarray(self.matrix[start : start + chunk_size], np.float32)
+            norms[start : start + len(block)] = np.einsum("ij,ij->i", block, block)
+        if self.metric == "cosine":
+            norms = np.sqrt(np.maximum(norms, 1e-24))
+        return norms
+
+    def _load_hnsw(self, ef):
+        """Loads the saved HNSW graph of the locale, building it on first use."""
+        try:
+            import hnswlib
+        except ImportError:
+            raise RuntimeError("local_index_type=hnsw requires the hnswlib package.")
+
+        index = hnswlib.Index(space=self.metric, dim=self.matrix.shape[1])
+        path = os.path.join(self.directory, "hnsw.bin")
+        if os.path.exists(path) and os.path.getmtime(path) >= self.version:
+            index.load_index(path, max_elements=len(self.matrix))
+        else:
+            print(f"Building HNSW index for {self.directory}...")
+            index.init_index(max_elements=len(self.matrix), ef_construction=200, M=16)
+            for start in range(0, len(self.matrix), 65536):
+                block = np.asarray(self.matrix[start : start + 65536], np.float32)
+                index.add_items(block, np.arange(start, start + len(block)))
+            index.save_index(path)
+        index.set_ef(ef)
+        return index
+
+    def _distances(self, queries, block, norms):
+        products = queries @ block.T
+        if self.metric == "ip":
+            return 1.0 - products
+        if self.metric == "cosine":
+            query_norms = np.linalg.norm(queries, axis=1, keepdims=True)
+            return 1.0 - products / np.maximum(query_norms * norms, 1e-12)
+        return norms - 2.0 * products
+
+    def _block(self, rows):
+        block = np.asarray(self.matrix[rows], dtype=np.float32)
+        return block, None if self._norms is None else self._norms[rows]
+
+    def _exact_top_k(self, queries, k, chunk_size=65536):
+        """Scans the matrix in chunks, keeping the k nearest rows of every query."""
+        best_rows = np.empty((len(queries), 0), dtype=np.int64)
+        best_distances = np.empty((len(queries), 0), dtype=np.float32)
+        for start in range(0, len(self.matrix), chunk_size):
+            end = min(start + chunk_size, len(self.matrix))
+            block, norms = self._block(slice(start, end))
+            distances = np.concatenate(
+                [best_distances, self._distances(queries, block, norms)], axis=1
+            )
+            rows = np.broadcast_to(np.arange(start, end), (len(queries), end - start))
+            rows = np.concatenate([best_rows, rows], axis=1)
+            if distances.shape[1] > k:
+                keep = np.argpartition(distances, k - 1, axis=1)[:, :k]
+                distances = np.take_along_axis(distances, keep, axis=1)
+                rows = np.take_along_axis(rows, keep, axis=1)
+            best_distances, best_rows = distances, rows
+        order = np.argsort(best_distances, axis=1)
+        return np.take_along_axis(best_rows, order, axis=1)
+
+    def _filtered_top_k(self, queries, k, where):
+        """Ranks only the rows matching an equality or $in filter."""
+        conditions, params = [], []
+        for key, value in where.items():
+            if key == "product_id":
+                column = "product_id"
+            else:
+                column = "json_extract(metadata, ?)"
+                params.append(f"$.{key}")
+            if isinstance(value, dict):
+                values = list(value["$in"])
+                if not values:
+                    return [[] for _ in queries]
+                conditions.append(f"{column} IN ({','.join('?' * len(values))})")
+                params.extend(values)
+            else:
+                conditions.append(f"{column} = ?")
+                params.append(value)
+        with self._lock:
+            candidates = [
+                row
+                for (row,) in self.rows.execute(
+                    f"SELECT row FROM rows WHERE {' AND '.join(conditions)}", params
+                )
+            ]
+        if not candidates:
+            return [[] for _ in queries]
+        block, norms = self._block(candidates)
+        order = np.argsort(self._distances(queries, block, norms), axis=1)[:, :k]
+        return np.asarray(candidates)[order].tolist()
+
+    def top_k(self, queries, k: int, where=None):
+        """
+        Finds the k nearest rows of every query.
+
+        Args:
+            queries (numpy.ndarray): The float32 query embeddings.
+            k (int): The number of rows per query.
+            where (dict, optional): Metadata equality filter. Defaults to None.
+
+        Returns:
+            list: The rows of every query, nearest first.
+        """
+        if where:
+            return self._filtered_top_k(queries, k, where)
+        k = min(k, len(self.matrix))
+        if k <= 0:
+            return [[] for _ in queries]
+        if self.hnsw is not None:
+            rows, _ = self.hnsw.knn_query(queries, k=k)
+            return rows.tolist()
+        return self._exact_top_k(queries, k).tolist()
+
+    def fetch(self, rows, include_documents=False):
+        """
+        Reads the metadata and documents of rows.
+
+        Args:
+            rows (list): The rows to read.
+            include_documents (bool, optional): Whether the documents are read.
+                Defaults to False.
+
+        Returns:
+            tuple: The metadatas and documents of the rows, in the given order.
+        """
+        if not rows:
+            return [], []
+        placeholders = ",".join("?" * len(rows))
+        with self._lock:
+            found = {
+                row: (document, metadata)
+                for row, document, metadata in self.rows.execute(
+                    "SELECT row, document, metadata FROM rows "
+                    f"WHERE row IN ({placeholders})",
+                    [int(row) for row in rows],
+                )
+            }
+        metadatas = [json.loads(found[row][1]) for row in rows]
+        documents = [found[row][0] for row in rows] if include_documents else []
+        return metadatas, documents
+
+    def get(self, product_ids):
+        """Fetches the metadata of products by ID."""
+        placeholders = ",".join("?" * len(product_ids))
+        with self._lock:
+            rows = self.rows.execute(
+                "SELECT product_id, metadata FROM rows "
+                f"WHERE product_id IN ({placeholders})",
+                list(product_ids),
+            ).fetchall()
+        return {product_id: json.loads(metadata) for product_id, metadata in rows}
+
+    def close(self):
+        self.rows.close()
+
+
+class Local_Backend(Vector_Backend):
+    """
+    In-process vector backend which searches memory-mapped embedding matrices, so
+    single-node deployments need no chroma server.
+
+    Every locale is loaded lazily on its first query. The exact mode scans the whole
+    matrix with vectorized NumPy, the hnsw mode uses an approximate hnswlib graph.
+
+    Attributes:
+        directory (str): The directory holding one subdirectory per locale.
+        index_type (str): The search mode, exact or hnsw.
+        hnsw_ef (int): The ef search parameter of the hnsw mode.
+    """
+
+    def __init__(self, directory: str, locales, index_type="exact", hnsw_ef=64):
+        if index_type not in ("exact", "hnsw"):
+            raise ValueError(f"Unknown local index type: {index_type}")
+        self.directory = directory
+        self.locales = list(locales)
+        self.index_type = index_type
+        self.hnsw_ef = hnsw_ef
+        self.indexes = {}
+        self._lock = threading.Lock()
+
+    def _locale_directory(self, locale):
+        return os.path.join(self.directory, locale)
+
+    def _get_index(self, locale: str):
+        index = self.indexes.get(locale)
+        if index is None:
+            if locale not in self.locales:
+                raise LookupError(f"Unknown locale: {locale}")
+            with self._lock:
+                index = self.indexes.get(locale)
+                if index is None:
+                    index = Local_Index(
+                        self._locale_directory(locale), self.index_type, self.hnsw_ef
+                    )
+                    self.indexes[locale] = index
+        return index
+
+    def query(
+        self,
+        locale: str,
+        embeddings,
+        k: int,
+        where=None,
+        include_documents=False,
+        texts=None,
+    ):
+        index = self._get_index(locale)
+        queries = np.asarray(embeddings, dtype=np.float32)
+        response = {"metadatas": [], "documents": [] if include_documents else None}
+        for rows in index.top_k(queries, k, where):
+            metadatas, documents = index.fetch(rows, include_documents)
+            response["metadatas"].append(metadatas)
+            if include_documents:
+                response["documents"].append(documents)
+        return response
+
+    def get(self, locale: str, product_ids):
+        if not product_ids:
+            return {}
+        return self._get_index(locale).get(product_ids)
+
+    def refresh(self, force=False):
+        refreshed = []
+        with self._lock:
+            for locale, index in list(self.indexes.items()):
+                manifest_path = os.path.join(index.directory, "manifest.json")
+                if force or os.path.getmtime(manifest_path) != index.version:
+                    # in-flight queries may still hold the index, it is closed
+                    # once garbage collected
+                    del self.indexes[locale]
+                    refreshed.append(locale)
+        return refreshed
+
+    def close(self):
+        with self._lock:
+            for index in self.indexes.values():
+                index.close()
+            self.indexes.clear()
@@ -0,0 +1,228 @@
+import os
+import re
+import json
+import numpy as np
+
+PARITY_TEXTS = [
+    "Do you have LED lamps?",
+    "wireless noise cancelling headphones",
+    "What is the brand of product B07XJ8C8F5?",
+    "auriculares inalámbricos con cancelación de ruido",
+    "ワイヤレス ノイズキャンセリング ヘッドホン",
+    "27 inch 4k monitor with usb-c",
+]
+
+
+def _model_directory(root: str, model_name: str):
+    return os.path.join(root, re.sub(r"[^A-Za-z0-9_.-]", "_", model_name))
+
+
+def parity(reference, candidate):
+    """
+    Compares the embeddings of two models.
+
+    Args:
+        reference (numpy.ndarray): The embeddings of the reference model.
+        candidate (numpy.ndarray): The embeddings of the candidate model.
+
+    Returns:
+        float: The minimum cosine similarity of the embeddings of the same text.
+    """
+    reference = reference / np.linalg.norm(reference, axis=1, keepdims=True)
+    candidate = candidate / np.linalg.norm(candidate, axis=1, keepdims=True)
+    return float(np.min(np.sum(reference * candidate, axis=1)))
+
+
+def export_onnx_model(model_name: str, root: str, min_parity=0.99):
+    """
+    Exports a SentenceTransformer model to ONNX with dynamic int8 quantization and
+    checks the quantized embeddings against the PyTorch ones.
+
+    Args:
+        model_name (str): The SentenceTransformer model name.
+        root (str): The directory holding the exported models.
+        min_parity (float, optional): The minimum cosine similarity between the
+            quantized and the PyTorch embeddings of the parity texts. Defaults to 0.99.
+
+    Returns:
+        str: The directory of the exported model.
+
+    Raises:
+        RuntimeError: If the quantized model fails the parity check.
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+    from sentence_transformers.models import Normalize
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+
+    directory = _model_directory(root, model_name)
+    os.makedirs(directory, exist_ok=True)
+    model = SentenceTransformer(model_name, device="cpu")
+    transformer = model[0].auto_model.eval()
+    model.tokenizer.save_pretrained(directory)
+
+    class Encoder(torch.nn.Module):
+        def __init__(self, transformer):
+            super().__init__()
+            self.transformer = transformer
+
+        def forward(self, input_ids, attention_mask):
+            outputs = self.transformer(
+                input_ids=input_ids, attention_mask=attention_mask
+            )
+            return outputs[0]
+
+    inputs = model.tokenizer(PARITY_TEXTS[:2], padding=True, return_tensors="pt")
+    fp32_path = os.path.join(directory, "model.fp32.onnx")
+    with torch.no_grad():
+        torch.onnx.export(
+            Encoder(transformer),
+            (inputs["input_ids"], inputs["attention_mask"]),
+            fp32_path,
+            input_names=["input_ids", "attention_mask"],
+            output_names=["last_hidden_state"],
+            dynamic_axes={
+                "input_ids": {0: "batch", 1: "sequence"},
+                "attention_mask": {0: "batch", 1: "sequence"},
+                "last_hidden_state": {0: "batch", 1: "sequence"},
+            },
+            opset_version=14,
+        )
+    quantize_dynamic(
+        fp32_path,
+        os.path.join(directory, "model.int8.onnx"),
+        weight_type=QuantType.QInt8,
+    )
+    os.remove(fp32_path)
+
+    config = {
+        "model_name": model_name,
+        "pooling": model[1].get_pooling_mode_str(),
+        "normalize": any(isinstance(module, Normalize) for module in model),
+        "max_seq_length": model.max_seq_length,
+        "dimension": model.get_sentence_embedding_dimension(),
+    }
+    with open(os.path.join(directory, "config.json"), "w") as file:
+        json.dump(config, file)
+
+    onnx_model = Onnx_Embedding_Model(directory)
+    similarity = parity(model.encode(PARITY_TEXTS), onnx_model.encode(PARITY_TEXTS))
+    print(f"ONNX int8 parity with PyTorch for {model_name}: {similarity:.4f}")
+    if similarity < min_parity:
+        raise RuntimeError(
+            f"Quantized {model_name} failed the parity check ({similarity:.4f})."
+        )
+    config["parity"] = similarity
+    with open(os.path.join(directory, "config.json"), "w") as file:
+        json.dump(config, file)
+    return directory
+
+
+def load_onnx_model(model_name: str, root: str, threads=0, min_parity=0.99):
+    """
+    Loads the quantized ONNX model, exporting it first if needed.
+
+    Args:
+        model_name (str): The SentenceTransformer model name.
+        root (str): The directory holding the exported models.
+        threads (int, optional): The intra-op thread count of onnxruntime, 0 for its
+            default. Defaults to 0.
+        min_parity (float, optional): The minimum parity of an export. Defaults to 0.99.
+
+    Returns:
+        Onnx_Embedding_Model: The quantized model.
+    """
+    directory = _model_directory(root, model_name)
+    config_path = os.path.join(directory, "config.json")
+    exported = False
+    if os.path.exists(config_path):
+        with open(config_path, "r") as file:
+            exported = "parity" in json.load(file)
+    if not exported:
+        export_onnx_model(model_name, root, min_parity)
+    return Onnx_Embedding_Model(directory, threads)
+
+
+class Onnx_Embedding_Model:
+    """
+    Int8 quantized embedding model run by onnxruntime, a drop-in replacement for the
+    encode method of SentenceTransformer on CPU-only nodes.
+
+    Attributes:
+        directory (str): The directory of the exported model.
+        pooling (str): The pooling mode of the model, cls, mean or max.
+        normalize (bool): Whether the embeddings are normalized.
+        max_seq_length (int): The maximum number of tokens per text.
+    """
+
+    def __init__(self, directory: str, threads=0):
+        import onnxruntime
+        from transformers import AutoTokenizer
+
+        self.directory = directory
+        with open(os.path.join(directory, "config.json"), "r") as file:
+            config = json.load(file)
+        self.pooling = config["pooling"]
+        self.normalize = config["normalize"]
+        self.max_seq_length = config["max_seq_length"]
+        self.dimension = config["dimension"]
+        self.tokenizer = AutoTokenizer.from_pretrained(directory)
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.graph_optimization_level = (
+            onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        )
+        self.session = onnxruntime.InferenceSession(
+            os.path.join(directory, "model.int8.onnx"),
+            options,
+            providers=["CPUExecutionProvider"],
+        )
+
+    def get_sentence_embedding_dimension(self):
+        return self.dimension
+
+    def _pool(self, hidden, mask):
+        if self.pooling == "cls":
+            return hidden[:, 0]
+        mask = mask[:, :, None].astype(np.float32)
+        if self.pooling == "max":
+            return np.where(mask > 0, hidden, -1e9).max(axis=1)
+        return (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+
+    def encode(self, sentences, batch_size=32, **kwargs):
+        """
+        Embeds texts. Texts are sorted by length so batches need little padding.
+
+        Args:
+            sentences (list): The texts to embed.
+            batch_size (int, optional): The number of texts per run. Defaults to 32.
+
+        Returns:
+            numpy.ndarray: The float32 embeddings, one row per text.
+        """
+        if isinstance(sentences, str):
+            return self.encode([sentences], batch_size)[0]
+        embeddings = np.empty((len(sentences), self.dimension), dtype=np.float32)
+        order = sorted(range(len(sentences)), key=lambda i: len(sentences[i]))
+        for start in range(0, len(order), batch_size):
+            indices = order[start : start + batch_size]
+            inputs = self.tokenizer(
+                [sentences[i] for i in indices],
+                padding=True,
+                truncation=True,
+                max_length=self.max_seq_length,
+                return_tensors="np",
+            )
+            mask = inputs["attention_mask"].astype(np.int64)
+            feed = {
+                "input_ids": inputs["input_ids"].astype(np.int64),
+                "attention_mask": mask,
+            }
+            hidden = self.session.run(None, feed)[0]
+            embeddings[indices] = self._pool(hidden, mask)
+        if self.normalize:
+            embeddings /= np.maximum(
+                np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12
+            )
+        return embeddings
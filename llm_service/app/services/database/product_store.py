@@ -0,0 +1,46 @@
+import json
+import sqlite3
+import threading
+
+
+class Product_Store:
+    """
+    Read-only exact lookup of product metadata by locale and product ID, backed by
+    the products.sqlite3 file which chromadb_service/init_db.py writes next to the
+    database.
+    """
+
+    def __init__(self, path: str):
+        self.connection = sqlite3.connect(
+            f"file:{path}?mode=ro", uri=True, check_same_thread=False
+        )
+        self._lock = threading.Lock()
+
+    def get(self, locale: str, product_ids):
+        """
+        Fetches products by ID.
+
+        Args:
+            locale (str): The locale of the products.
+            product_ids (list): The product IDs.
+
+        Returns:
+            dict: Mapping of the found product IDs to their metadata.
+        """
+        found = {}
+        with self._lock:
+            # stay well below the SQLite limit of host parameters
+            for i in range(0, len(product_ids), 900):
+                chunk = list(product_ids[i : i + 900])
+                placeholders = ",".join("?" * len(chunk))
+                rows = self.connection.execute(
+                    "SELECT product_id, metadata FROM products "
+                    f"WHERE locale = ? AND product_id IN ({placeholders})",
+                    [locale, *chunk],
+                )
+                for product_id, metadata in rows:
+                    found[product_id] = json.loads(metadata)
+        return found
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,229 @@
+import asyncio
+from typing import Any, List
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForRetrieverRun,
+    CallbackManagerForRetrieverRun,
+)
+
+
+class Vector_Backend:
+    """
+    Interface of the vector stores searched by DB_Service.
+
+    Results mirror the shape of chroma query responses: a dict with one list of
+    "metadatas" per query embedding, and "documents" if requested. Filters follow
+    the chroma where syntax, limited to equality and $in on metadata fields.
+    """
+
+    def query(
+        self,
+        locale: str,
+        embeddings,
+        k: int,
+        where=None,
+        include_documents=False,
+        texts=None,
+    ):
+        """
+        Finds the nearest products of every query embedding.
+
+        Args:
+            locale (str): The locale to search in.
+            embeddings (list): The query embeddings.
+            k (int): The number of products per query.
+            where (dict, optional): Metadata equality filter. Defaults to None.
+            include_documents (bool, optional): Whether the embedded documents are
+                returned. Defaults to False.
+            texts (list, optional): The query texts, used by lexical backends.
+                Defaults to None.
+
+        Returns:
+            dict: The "metadatas" and optionally "documents" of every query.
+        """
+        raise NotImplementedError
+
+    async def aquery(
+        self,
+        locale: str,
+        embeddings,
+        k: int,
+        where=None,
+        include_documents=False,
+        texts=None,
+    ):
+        """Async variant of query. Runs query on a worker thread unless overridden."""
+        return await asyncio.to_thread(
+            self.query, locale, embeddings, k, where, include_documents, texts
+        )
+
+    def get(self, locale: str, product_ids):
+        """
+        Fetches products by ID without a vector search.
+
+        Args:
+            locale (str): The locale of the products.
+            product_ids (list): The product IDs.
+
+        Returns:
+            dict: Mapping of the found product IDs to their metadata.
+        """
+        raise NotImplementedError
+
+    async def aget(self, locale: str, product_ids):
+        """Async variant of get. Runs get on a worker thread unless overridden."""
+        return await asyncio.to_thread(self.get, locale, product_ids)
+
+    def refresh(self, force=False):
+        """
+        Drops the handles of locales whose data was rebuilt since they were loaded.
+
+        Args:
+            force (bool, optional): Drop the handles of all locales. Defaults to False.
+
+        Returns:
+            list: The locales whose handles were dropped.
+        """
+        return []
+
+    def close(self):
+        pass
+
+    async def aclose(self):
+        """Closes the resources bound to the event loop."""
+        pass
+
+
+class Chroma_Backend(Vector_Backend):
+    """
+    Vector backend served by the chroma HTTP server.
+
+    Collections are resolved with the synchronous chroma client. If an async client
+    is given, the async queries go through its pooled connections instead of
+    worker threads.
+    """
+
+    def __init__(self, client, collection_names, emb_fn, async_client=None):
+        self.client = client
+        self.async_client = async_client
+        self.collection_names = collection_names
+        self.emb_fn = emb_fn
+        self.collections = {}
+        for locale, name in collection_names.items():
+            self.collections[locale] = client.get_collection(
+                name=name, embedding_function=emb_fn
+            )
+
+    def query(
+        self,
+        locale: str,
+        embeddings,
+        k: int,
+        where=None,
+        include_documents=False,
+        texts=None,
+    ):
+        include = ["metadatas", "documents"] if include_documents else ["metadatas"]
+        return self.collections[locale].query(
+            query_embeddings=embeddings, n_results=k, where=where, include=include
+        )
+
+    def get(self, locale: str, product_ids):
+        response = self.collections[locale].get(
+            ids=list(product_ids), include=["metadatas"]
+        )
+        return dict(zip(response["ids"], response["metadatas"]))
+
+    async def aquery(
+        self,
+        locale: str,
+        embeddings,
+        k: int,
+        where=None,
+        include_documents=False,
+        texts=None,
+    ):
+        if self.async_client is None:
+            return await super().aquery(
+                locale, embeddings, k, where, include_documents, texts
+            )
+        include = ["metadatas", "documents"] if include_documents else ["metadatas"]
+        return await self.async_client.query(
+            self.collections[locale].id, embeddings, k, where, include
+        )
+
+    async def aget(self, locale: str, product_ids):
+        if self.async_client is None:
+            return await super().aget(locale, product_ids)
+        response = await self.async_client.get(
+            self.collections[locale].id, product_ids
+        )
+        return dict(zip(response["ids"], response["metadatas"]))
+
+    def refresh(self, force=False):
+        refreshed = []
+        for locale, name in self.collection_names.items():
+            collection = self.client.get_collection(
+                name=name, embedding_function=self.emb_fn
+            )
+            if force or collection.id != self.collections[locale].id:
+                self.collections[locale] = collection
+                refreshed.append(locale)
+        return refreshed
+
+    async def aclose(self):
+        if self.async_client is not None:
+            await self.async_client.aclose()
+
+
+class Backend_Retriever(BaseRetriever):
+    """
+    Langchain retriever over a vector backend.
+
+    Attributes:
+        backend (Vector_Backend): The backend to search.
+        locale (str): The locale to search in.
+        emb_fn (CustomEmbeddingFunction): The query embedding function.
+        search_kwargs (dict): "k" and an optional metadata "filter".
+    """
+
+    backend: Any
+    locale: str
+    emb_fn: Any
+    search_kwargs: dict = {}
+
+    def _to_documents(self, response):
+        metadatas = response["metadatas"][0]
+        documents = (response.get("documents") or [None])[0] or [""] * len(metadatas)
+        return [
+            Document(page_content=document or "", metadata=metadata)
+            for document, metadata in zip(documents, metadatas)
+        ]
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        response = self.backend.query(
+            self.locale,
+            self.emb_fn([query]),
+            self.search_kwargs.get("k", 5),
+            where=self.search_kwargs.get("filter"),
+            include_documents=True,
+            texts=[query],
+        )
+        return self._to_documents(response)
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        embeddings = await self.emb_fn.aembed([query])
+        response = await self.backend.aquery(
+            self.locale,
+            embeddings,
+            self.search_kwargs.get("k", 5),
+            where=self.search_kwargs.get("filter"),
+            include_documents=True,
+            texts=[query],
+        )
+        return self._to_documents(response)
@@ -1,6 +1,11 @@
+import os
+import asyncio
 from .llm_provider.llamacpp import LlamaCpp_Provider
-from langchain.memory import ConversationBufferMemory
-from cachetools import TTLCache
+from .router import Query_Router
+from .answer_cache import Answer_Cache
+from .context_packer import Context_Packer
+from .memory import Memory_Store
+from ..metrics import metrics
 import textwrap
 
 
@@ -10,20 +15,61 @@ class LLM_Agent:
 
     Attributes:
         llm_provider (LlamaCpp_Provider): An instance of the LlamaCpp_Provider class.
-        cache (TTLCache): Cache for LLM memory per user session.
+        memory_store (Memory_Store): Token-bounded conversation memory per user
+            session.
         db_service: The database service used for retrieving data.
+        router (Query_Router): Pre-router tried before the LLM prompts, None if disabled.
+        speculative_retrieval (bool): Whether similarity retrieval runs concurrently
+            with the query classification.
+        answer_cache (Answer_Cache): Semantic cache of RAG answers, None if disabled.
+        context_packer (Context_Packer): Fits the retrieved products into the token
+            budget of the RAG prompt.
     """
 
-    def __init__(self, db_service):
+    def __init__(self, db_service, router=None):
         """
         Initializes a new instance of the LLM_Agent class.
 
         Args:
             db_service: The database service used for retrieving data.
+            router (optional): The pre-router used for query classification and
+                product-ID extraction. Defaults to a Query_Router unless disabled by
+                the query_router_enabled environment variable.
         """
         self.llm_provider = LlamaCpp_Provider()
-        self.cache = TTLCache(maxsize=100000, ttl=3600 * 3)
+        self.memory_store = Memory_Store(
+            self.llm_provider,
+            max_turns=int(os.environ.get("memory_max_turns", 6)),
+            max_tokens=int(os.environ.get("memory_max_tokens", 1024)),
+            summary_chars=int(os.environ.get("memory_summary_chars", 400)),
+            ttl=float(os.environ.get("memory_ttl", 3600 * 3)),
+            spill_after=float(os.environ.get("memory_spill_after", 600)),
+            path=os.environ.get("memory_spill_path", "./memory.sqlite3"),
+        )
         self.db_service = db_service
+        self.context_packer = Context_Packer(db_service, self.llm_provider)
+        if router is None and os.environ.get("query_router_enabled", "true") == "true":
+            router = Query_Router(
+                db_service.emb_fn,
+                min_similarity=float(
+                    os.environ.get("query_router_min_similarity", 0.35)
+                ),
+                min_margin=float(os.environ.get("query_router_min_margin", 0.08)),
+            )
+        self.router = router
+        self.speculative_retrieval = (
+            os.environ.get("speculative_retrieval", "true") == "true"
+        )
+
+        self.answer_cache = None
+        answer_cache_size = int(os.environ.get("answer_cache_size", 1000))
+        if answer_cache_size > 0:
+            self.answer_cache = Answer_Cache(
+                maxsize=answer_cache_size,
+                ttl=float(os.environ.get("answer_cache_ttl", 3600)),
+                threshold=float(os.environ.get("answer_cache_threshold", 0.92)),
+            )
+            db_service.add_refresh_listener(self.answer_cache.invalidate)
 
     def get_memory(self, user_session_id):
         """
@@ -33,26 +79,30 @@ class LLM_Agent:
             user_session_id: The ID of the user session.
 
         Returns:
-            ConversationBufferMemory: The LLM memory for the user session.
+            Conversation_Memory: The LLM memory for the user session.
         """
-        try:
-            return self.cache[user_session_id]
-        except KeyError:
-            self.cache[user_session_id] = ConversationBufferMemory(return_messages=True)
-            return self.cache[user_session_id]
+        return self.memory_store.get(user_session_id)
 
-    async def user_query_classifier(self, user_query):
+    def close(self):
+        """Spills the conversation memories to disk."""
+        self.memory_store.close()
+
+    async def user_query_classifier(
+        self, user_query, user_session_id=None, websocket=None
+    ):
         """
         Classifies a user query into one of the predefined categories.
 
         Args:
             user_query: The user query to be classified.
+            user_session_id: (optional) The ID of the user session.
+            websocket: (optional) The websocket for queue position updates.
 
         Returns:
             str: The label of the classification.
         """
-        prompt = (
-            "<s>[INST]<<SYS>>\n"
+        prefix = (
+            "[INST]<<SYS>>\n"
             "You are a AI Classifier for determining a user query either 'product-inquiry', 'product-followup' or 'general-question'. You answer only the label of the classification.\n"
             "Examples:\n"
             "query:What is its color?\n"
@@ -73,25 +123,30 @@ class LLM_Agent:
             "general-question\n"
             "<</SYS>>\n"
             "Determine below query. Answer in only provided format.\n"
-            f"{user_query}\n"
-            "[/INST]\n"
         )
+        prompt = prefix + f"{user_query}\n[/INST]\n"
 
-        response = await self.llm_provider.model.ainvoke(prompt)
+        response = await self.llm_provider.complete(
+            prompt, user_session_id, websocket, prefix
+        )
         return response.strip().lower()
 
-    async def user_query_product_id_analyzer(self, user_query):
+    async def user_query_product_id_analyzer(
+        self, user_query, user_session_id=None, websocket=None
+    ):
         """
         Analyzes a user query and returns the product identification number if found.
 
         Args:
             user_query: The user query to be analyzed.
+            user_session_id: (optional) The ID of the user session.
+            websocket: (optional) The websocket for queue position updates.
 
         Returns:
             str: The product identification number if found, otherwise "false".
         """
-        prompt = (
-            "<s>[INST]<<SYS>>\n"
+        prefix = (
+            "[INST]<<SYS>>\n"
             "You are an AI query analyzer who returns the product identification number in the query. If no identification number is found you return false.\n"
             "Learn from the examples below:\n"
             "query:I want to purchase 50 inches TV\n"
@@ -114,11 +169,12 @@ class LLM_Agent:
             "false\n\n"
             "<</SYS>>\n"
             "Analyze the query below and answer in one word. Return false if no identification number is found. \n"
-            f"{user_query}\n"
-            "[/INST]\n"
         )
+        prompt = prefix + f"{user_query}\n[/INST]\n"
 
-        response = await self.llm_provider.model.ainvoke(prompt)
+        response = await self.llm_provider.complete(
+            prompt, user_session_id, websocket, prefix
+        )
         response_lower = response.strip().lower()
 
         if response_lower != "false":
@@ -129,6 +185,66 @@ class LLM_Agent:
 
         return "false"
 
+    async def classify(self, user_query, user_session_id=None, websocket=None):
+        """
+        Classifies a user query with the pre-router, falling back to the LLM
+        classifier when the pre-router is not confident.
+
+        Args:
+            user_query: The user query to be classified.
+            user_session_id: (optional) The ID of the user session.
+            websocket: (optional) The websocket for queue position updates.
+
+        Returns:
+            str: The label of the classification.
+        """
+        route = None
+        if self.router is not None:
+            route = await self.router.classify(user_query)
+
+        if route is None:
+            label = await self.user_query_classifier(
+                user_query, user_session_id, websocket
+            )
+            source = "llm"
+        else:
+            label, source = route.value, route.source
+
+        metrics.increment(f"router.classifier.{source}")
+        print(f"user query classified as {label} by {source}")
+        return label
+
+    async def extract_product_id(
+        self, user_query, user_session_id=None, websocket=None
+    ):
+        """
+        Extracts the product identification number with the pre-router, falling back
+        to the LLM analyzer when the pre-router is not confident.
+
+        Args:
+            user_query: The user query to be analyzed.
+            user_session_id: (optional) The ID of the user session.
+            websocket: (optional) The websocket for queue position updates.
+
+        Returns:
+            str: The product identification number if found, otherwise "false".
+        """
+        route = None
+        if self.router is not None:
+            route = self.router.extract_product_id(user_query)
+
+        if route is None:
+            product_id = await self.user_query_product_id_analyzer(
+                user_query, user_session_id, websocket
+            )
+            source = "llm"
+        else:
+            product_id, source = route.value, route.source
+
+        metrics.increment(f"router.product_id.{source}")
+        print(f"user query identification analyzed as {product_id} by {source}")
+        return product_id
+
     async def run(self, user_query, locale, user_session_id, websocket):
         """
         Runs the LLM agent to process a user query.
@@ -143,34 +259,154 @@ class LLM_Agent:
             str: The response generated by the LLM agent.
         """
         memory = self.get_memory(user_session_id)
-        label = await self.user_query_classifier(user_query)
-        print(f"llm classified user query: {label}")
+
+        # Start the similarity retrieval for the raw query while the query is being
+        # classified. It is only used if the query turns out to be a product inquiry.
+        speculative = None
+        if self.speculative_retrieval:
+            speculative = asyncio.create_task(
+                self.db_service.get_retriever(locale).ainvoke(user_query)
+            )
+
+        try:
+            response = await self._respond(
+                user_query, locale, user_session_id, memory, websocket, speculative
+            )
+        finally:
+            # also consumes the outcome of a retrieval which failed before _respond
+            # raised, so it is not reported as never retrieved
+            self._release_speculative(speculative)
+
+        memory.save_context({"input": user_query}, {"output": response})
+        return response
+
+    def _release_speculative(self, speculative):
+        """
+        Cancels a speculative retrieval, or consumes its outcome if it has already
+        finished so a failed retrieval is not reported as unhandled.
+
+        Args:
+            speculative (asyncio.Task): The speculative retrieval task, or None.
+        """
+        if speculative is None:
+            return
+        if not speculative.done():
+            speculative.cancel()
+        elif not speculative.cancelled():
+            speculative.exception()
+
+    def _discard_speculative(self, speculative):
+        """
+        Releases an unused speculative retrieval and counts it as discarded.
+
+        Args:
+            speculative (asyncio.Task): The speculative retrieval task, or None.
+        """
+        if speculative is None:
+            return
+        self._release_speculative(speculative)
+        metrics.increment("retrieval.speculative.discarded")
+
+    async def _respond(
+        self, user_query, locale, user_session_id, memory, websocket, speculative=None
+    ):
+        """
+        Classifies the user query and generates the response with the matching chain.
+
+        Args:
+            user_query: The user query to be processed.
+            locale: The locale for retrieving data.
+            user_session_id: The ID of the user session.
+            memory: The LLM memory of the user session.
+            websocket: The websocket for communication.
+            speculative (asyncio.Task, optional): The similarity retrieval started
+                before the classification. Defaults to None.
+
+        Returns:
+            str: The response generated by the LLM agent.
+        """
+        label = await self.classify(user_query, user_session_id, websocket)
 
         if label == "product-followup" or label == "general-question":
-            response = await self.llm_provider.chat(user_query, memory, websocket)
+            self._discard_speculative(speculative)
+            response = await self.llm_provider.chat(
+                user_query, memory, websocket, user_session_id
+            )
         else:
-            product_id = await self.user_query_product_id_analyzer(user_query)
-            filter = {"product_id": product_id}
-            retriever = self.db_service.get_retriever(locale, filter)
-
-            print(f"llm analyzed user query identification as: {product_id}")
-            filter = None
+            product_id = await self.extract_product_id(
+                user_query, user_session_id, websocket
+            )
             documents = []
 
-            if product_id != "open-ended":
-                filter = {"product_id": product_id}
-                retriever = self.db_service.get_retriever(locale, filter)
-                documents = await retriever.ainvoke("")
+            if product_id not in ("open-ended", "false"):
+                documents = await self.db_service.aget_products(locale, [product_id])
+                metrics.increment(
+                    "retrieval.product_id." + ("found" if documents else "missing")
+                )
 
-            if len(documents) == 0:
+            if len(documents) > 0:
+                self._discard_speculative(speculative)
+            elif speculative is not None:
+                documents = await speculative
+                metrics.increment("retrieval.speculative.used")
+            else:
                 retriever = self.db_service.get_retriever(locale)
                 documents = await retriever.ainvoke(user_query)
 
-            context = self.db_service.format_docs(documents)
+            budget = self.llm_provider.rag_context_budget(user_query)
+            context, tokens, packed = self.context_packer.pack(documents, budget)
+            metrics.observe("rag.context_tokens", tokens)
+            metrics.increment("rag.products_dropped", len(documents) - len(packed))
+            documents = packed
+            response = await self._rag_chat(
+                user_query,
+                locale,
+                user_session_id,
+                documents,
+                context,
+                memory,
+                websocket,
+            )
 
-            response = await self.llm_provider.rag_chat(
-                user_query, context, memory, websocket
+        return response
+
+    async def _rag_chat(
+        self, user_query, locale, user_session_id, documents, context, memory, websocket
+    ):
+        """
+        Answers a product question from the answer cache, or generates and caches the
+        answer with the RAG chain.
+
+        Args:
+            user_query: The user query to be processed.
+            locale: The locale of the retrieved documents.
+            user_session_id: The ID of the user session.
+            documents (list): The retrieved documents.
+            context (str): The formatted documents.
+            memory: The LLM memory of the user session.
+            websocket: The websocket for communication.
+
+        Returns:
+            str: The response generated by the LLM agent.
+        """
+        if self.answer_cache is None:
+            return await self.llm_provider.rag_chat(
+                user_query, context, memory, websocket, user_session_id
             )
 
-        memory.save_context({"input": user_query}, {"output": response})
+        product_ids = [document.metadata["product_id"] for document in documents]
+        embedding = (await self.db_service.emb_fn.aembed([user_query]))[0]
+        answer = self.answer_cache.get(locale, embedding, product_ids)
+        if answer is not None:
+            metrics.increment("answer_cache.hit")
+            return await self.llm_provider.send_response(answer, context, websocket)
+
+        metrics.increment("answer_cache.miss")
+        response = await self.llm_provider.rag_chat(
+            user_query, context, memory, websocket, user_session_id
+        )
+        answer = response
+        if websocket is not None and context and response.endswith(context):
+            answer = response[: -len(context)]
+        self.answer_cache.put(locale, embedding, product_ids, answer)
         return response
@@ -0,0 +1,123 @@
+import time
+import threading
+import itertools
+from collections import OrderedDict
+import numpy as np
+
+
+class Answer_Cache:
+    """
+    Semantic cache of RAG answers.
+
+    Answers are bucketed by locale and the set of retrieved product IDs. Within a
+    bucket, a cached answer is reused when the cosine similarity of its question to
+    the new question reaches the threshold.
+
+    Attributes:
+        maxsize (int): Maximum number of cached answers, evicted least recently used.
+        ttl (float): Seconds a cached answer stays valid.
+        threshold (float): Minimum cosine similarity of two questions for a hit.
+        hits (int): Lookups served from the cache.
+        misses (int): Lookups which required a generation.
+    """
+
+    def __init__(self, maxsize=1000, ttl=3600, threshold=0.92):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.threshold = threshold
+        self.hits = 0
+        self.misses = 0
+        # entry id -> (bucket key, normalized embedding, answer, expiry)
+        self._entries = OrderedDict()
+        # bucket key -> set of entry ids
+        self._buckets = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+
+    def _normalize(self, embedding):
+        embedding = np.asarray(embedding, dtype=np.float32)
+        return embedding / max(float(np.linalg.norm(embedding)), 1e-12)
+
+    def _bucket_key(self, locale, product_ids):
+        return locale, frozenset(product_ids)
+
+    def _remove(self, entry_id):
+        bucket_key = self._entries.pop(entry_id)[0]
+        bucket = self._buckets[bucket_key]
+        bucket.discard(entry_id)
+        if not bucket:
+            del self._buckets[bucket_key]
+
+    def get(self, locale: str, embedding, product_ids):
+        """
+        Looks up a cached answer for a question.
+
+        Args:
+            locale (str): The locale of the question.
+            embedding (list): The embedding of the question.
+            product_ids (list): The IDs of the products retrieved for the question.
+
+        Returns:
+            str: The cached answer, or None on a miss.
+        """
+        embedding = self._normalize(embedding)
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(self._bucket_key(locale, product_ids), ())
+            best_id, best_similarity = None, self.threshold
+            for entry_id in list(bucket):
+                _, cached, _, expiry = self._entries[entry_id]
+                if expiry <= now:
+                    self._remove(entry_id)
+                    continue
+                similarity = float(cached @ embedding)
+                if similarity >= best_similarity:
+                    best_id, best_similarity = entry_id, similarity
+
+            if best_id is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(best_id)
+            return self._entries[best_id][2]
+
+    def put(self, locale: str, embedding, product_ids, answer: str):
+        """
+        Caches the answer to a question.
+
+        Args:
+            locale (str): The locale of the question.
+            embedding (list): The embedding of the question.
+            product_ids (list): The IDs of the products retrieved for the question.
+            answer (str): The generated answer.
+        """
+        bucket_key = self._bucket_key(locale, product_ids)
+        expiry = time.monotonic() + self.ttl
+        entry = (bucket_key, self._normalize(embedding), answer, expiry)
+        with self._lock:
+            entry_id = next(self._ids)
+            self._entries[entry_id] = entry
+            self._buckets.setdefault(bucket_key, set()).add(entry_id)
+            while len(self._entries) > self.maxsize:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, locales=None):
+        """
+        Drops the cached answers of the given locales.
+
+        Args:
+            locales (list, optional): The locales to drop. Defaults to all locales.
+        """
+        with self._lock:
+            for entry_id, entry in list(self._entries.items()):
+                if locales is None or entry[0][0] in locales:
+                    self._remove(entry_id)
+
+    def stats(self):
+        """Returns the hit/miss counters and the number of cached answers."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._entries),
+            }
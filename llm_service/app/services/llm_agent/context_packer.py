@@ -0,0 +1,85 @@
+from ..database.chroma_db import DESCRIPTION_PREFIX
+
+CONTEXT_HEADER = "\nProduct catalogues:\n"
+
+
+class Context_Packer:
+    """
+    Packs retrieved products into the token budget of the RAG prompt.
+
+    The heads of the products, holding their ID, title, color and brand, are packed
+    first in retrieval order, so as many products as possible are mentioned. The
+    remaining budget is then filled with their descriptions in the same order, and
+    the first description which does not fit is truncated.
+
+    Products ingested by init_db.py carry the token count of their context fragment
+    in product_context_tokens. Counts are only trusted if product_context_tokenizer
+    matches the vocabulary of the chat model, estimated counts or counts made with
+    another tokenizer are ignored. If the trusted fragments of all products fit,
+    they are packed whole without tokenizing anything. Otherwise only the short
+    heads are tokenized and the description counts are derived from the trusted
+    counts, so descriptions are only tokenized for the one being truncated and for
+    rows without a trusted count.
+
+    Attributes:
+        db_service: The database service which formats the products.
+        tokenizer: Provides count_tokens, truncate_tokens and the tokenizer_id of
+            the chat model.
+    """
+
+    def __init__(self, db_service, tokenizer):
+        self.db_service = db_service
+        self.tokenizer = tokenizer
+
+    def _stored_tokens(self, metadata):
+        """Returns the stored token count of a fragment if it was counted with the
+        tokenizer of the chat model, None otherwise."""
+        if metadata.get("product_context_tokenizer") != self.tokenizer.tokenizer_id:
+            return None
+        return metadata.get("product_context_tokens")
+
+    def pack(self, documents, budget: int):
+        """
+        Formats as many documents as fit into the budget.
+
+        Args:
+            documents (list): The retrieved documents, most relevant first.
+            budget (int): The number of tokens available for the context.
+
+        Returns:
+            tuple: The context, its number of tokens and the packed documents.
+        """
+        used = self.tokenizer.count_tokens(CONTEXT_HEADER)
+        stored = [self._stored_tokens(d.metadata) for d in documents]
+        if None not in stored and used + sum(stored) <= budget:
+            fragments = [self.db_service.format_doc(d.metadata) for d in documents]
+            context = CONTEXT_HEADER + "".join(fragments)
+            return context, used + sum(stored), list(documents)
+
+        packed = []
+        for document, total in zip(documents, stored):
+            head, description = self.db_service.format_doc_parts(document.metadata)
+            tokens = self.tokenizer.count_tokens(f"{head}{DESCRIPTION_PREFIX}.\n\n")
+            if used + tokens > budget:
+                break
+            # the stored count covers the whole fragment, the rest is the description
+            description_tokens = None if total is None else max(total - tokens, 0)
+            packed.append((document, head, description, description_tokens))
+            used += tokens
+
+        fragments = []
+        for _, head, description, tokens in packed:
+            remaining = budget - used
+            if remaining > 0 and description:
+                if tokens is None:
+                    tokens = self.tokenizer.count_tokens(description)
+                if tokens > remaining:
+                    description = self.tokenizer.truncate_tokens(description, remaining)
+                    tokens = remaining
+                used += tokens
+            else:
+                description = ""
+            fragments.append(f"{head}{DESCRIPTION_PREFIX}{description}.\n\n")
+
+        context = CONTEXT_HEADER + "".join(fragments)
+        return context, used, [document for document, _, _, _ in packed]
@@ -1,5 +1,8 @@
 import os
 import re
+import asyncio
+import hashlib
+import threading
 from operator import itemgetter
 from langchain.callbacks.manager import CallbackManager
 from langchain.callbacks.streaming_stdout import StreamingStdOutCallbackHandler
@@ -7,6 +10,27 @@ from langchain_community.llms import LlamaCpp
 from langchain_core.prompts import PromptTemplate
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.runnables import RunnableLambda, RunnablePassthrough
+from .scheduler import Inference_Scheduler, PRIORITY_SHORT, PRIORITY_GENERATION
+from .prefix_cache import Prefix_State_Cache
+from ...metrics import metrics
+from ...websocket.framing import Frame_Coalescer, send_frame
+
+
+def vocab_fingerprint(llama):
+    """
+    Returns a fingerprint of the vocabulary of a llama_cpp model, computed like
+    chromadb_service's init_db.py tags the token counts of the product context.
+
+    Args:
+        llama (Llama): The llama_cpp model.
+
+    Returns:
+        str: The hex fingerprint.
+    """
+    digest = hashlib.sha1()
+    for token in range(llama.n_vocab()):
+        digest.update(llama.detokenize([token]) + b"\0")
+    return digest.hexdigest()[:16]
 
 
 class LlamaCpp_Provider:
@@ -14,6 +38,12 @@ class LlamaCpp_Provider:
     This class orchestrates the RAG and prompt templates for the chat interaction."""
 
     def __init__(self):
+        self.n_ctx = int(os.environ.get("llm_n_ctx", 4096))
+        self.max_tokens = int(os.environ.get("llm_max_tokens", 256))
+        # tokens of the prompt, the rest of the context window is left for the answer
+        self.prompt_token_budget = int(
+            os.environ.get("llm_prompt_token_budget", self.n_ctx - self.max_tokens)
+        )
         try:
             self.model = None
             self._load_model()
@@ -21,6 +51,36 @@ class LlamaCpp_Provider:
             print(f"Error loading model: {e}")
             raise RuntimeError("Error loading llamacpp model..")
 
+        # All sessions share the single model, so every call goes through the scheduler.
+        # The Llama instance is not thread-safe and the prefix state restore and the
+        # stop flag of a generation assume a single holder, so the scheduler admits
+        # one call at a time until there is one model instance per slot.
+        if os.environ.get("llm_concurrency", "1") != "1":
+            print("Ignoring llm_concurrency, the shared model runs one call at a time")
+        self.scheduler = Inference_Scheduler(
+            concurrency=1,
+            max_queue_depth=int(os.environ.get("llm_max_queue_depth", 32)),
+            max_wait=float(os.environ.get("llm_max_queue_wait", 120)),
+            update_interval=float(os.environ.get("llm_queue_update_interval", 1)),
+        )
+
+        # Model states after the static prefixes of the prompts, restored before each
+        # call so only the dynamic part of the prompt has to be prefilled.
+        self.prefix_cache = None
+        prefix_cache_size = int(os.environ.get("llm_prefix_cache_size", 4))
+        if prefix_cache_size > 0:
+            self.prefix_cache = Prefix_State_Cache(
+                self.model.client, maxsize=prefix_cache_size
+            )
+        # streamed tokens are coalesced into frames by count, size or age
+        self.ws_flush_tokens = int(os.environ.get("ws_flush_tokens", 16))
+        self.ws_flush_bytes = int(os.environ.get("ws_flush_bytes", 1024))
+        self.ws_flush_ms = float(os.environ.get("ws_flush_ms", 100))
+        # token counts stored at ingestion are only exact for this vocabulary
+        self.tokenizer_id = vocab_fingerprint(self.model.client)
+        self.rag_prefix = self._get_prompt_rag_template().template.split("{")[0]
+        self.chat_prefix = self._get_prompt_chat_template().template.split("{")[0]
+
     def _get_model_path(self):
         try:
             return os.environ["model_path"]
@@ -35,7 +95,8 @@ class LlamaCpp_Provider:
         - model_path (str): The path to the model.
         - n_gpu_layers (int): The number of GPU layers.
         - n_batch (int): The batch size.
-        - n_ctx (int): The context size.
+        - n_ctx (int): The context size, from the llm_n_ctx environment variable.
+        - max_tokens (int): The maximum number of generated tokens.
         - temperature (float): The temperature for sampling.
         - f16_kv (bool): Whether to use float16 for key-value tensors.
         - callback_manager (CallbackManager): The callback manager.
@@ -48,17 +109,84 @@ class LlamaCpp_Provider:
             model_path=self._get_model_path(),
             n_gpu_layers=1,
             n_batch=512,
-            n_ctx=0,
+            n_ctx=self.n_ctx,
+            max_tokens=self.max_tokens,
             temperature=0.0,
             f16_kv=True,
             callback_manager=CallbackManager([StreamingStdOutCallbackHandler()]),
             verbose=False,
         )
 
+    def _strip_indentation(self, template_str):
+        """Removes the indentation of the template lines, which would be prefilled
+        as tokens on every call."""
+        return re.sub(r"\n[ \t]+", "\n", template_str)
+
+    def _tokenize(self, text: str, add_bos=False):
+        """Tokenizes a text like llama_cpp tokenizes a prompt, parsing special tokens,
+        so counts of prompt fragments add up to the count of the prompt."""
+        return self.model.client.tokenize(
+            text.encode("utf-8"), add_bos=add_bos, special=True
+        )
+
+    def count_tokens(self, text: str):
+        """
+        Counts the tokens of a prompt fragment with the tokenizer of the loaded model.
+
+        Args:
+            text (str): The text.
+
+        Returns:
+            int: The number of tokens.
+        """
+        return len(self._tokenize(text))
+
+    def count_prompt_tokens(self, prompt: str):
+        """Counts the tokens of a complete prompt, including the BOS token."""
+        return len(self._tokenize(prompt, add_bos=True))
+
+    def truncate_tokens(self, text: str, max_tokens: int):
+        """
+        Truncates a text to a number of tokens of the loaded model.
+
+        Args:
+            text (str): The text.
+            max_tokens (int): The maximum number of tokens.
+
+        Returns:
+            str: The truncated text.
+        """
+        tokens = self._tokenize(text)
+        if len(tokens) <= max_tokens:
+            return text
+        truncated = self.model.client.detokenize(tokens[: max(max_tokens, 0)])
+        return truncated.decode("utf-8", errors="ignore")
+
+    def rag_context_budget(self, user_question: str):
+        """
+        Returns the number of tokens left for the context of a RAG prompt.
+
+        Args:
+            user_question (str): The user's question.
+
+        Returns:
+            int: The context token budget.
+        """
+        prompt = self._get_prompt_rag_template().format(
+            user_question=user_question, context=""
+        )
+        return self.prompt_token_budget - self.count_prompt_tokens(prompt)
+
+    def _report_prompt_tokens(self, chain: str, prompt: str):
+        """Records the number of prompt tokens of a request in the metrics."""
+        tokens = self.count_prompt_tokens(prompt)
+        metrics.observe(f"llm.prompt_tokens.{chain}", tokens)
+        print(f"{chain} prompt has {tokens} tokens")
+
     def _get_prompt_rag_template(self):
         """Returns the prompt template for the RAG specifc chain."""
 
-        template_str = """<s>[INST] <<SYS>>
+        template_str = """[INST] <<SYS>>
         You are an AI assistant chatbot for a online store customer service. You answer professional user questions about products and services.
         You will be provided available products as context. Answer the user question appropriately based on this context.
         You must strive to write complete and accurate answers. If you don't know the answer, just say that you don't know. 
@@ -72,7 +200,7 @@ class LlamaCpp_Provider:
 
         prompt = PromptTemplate(
             input_variables=["user_question", "context"],
-            template=template_str,
+            template=self._strip_indentation(template_str),
         )
 
         return prompt
@@ -80,7 +208,7 @@ class LlamaCpp_Provider:
     def _get_prompt_chat_template(self):
         """Returns the prompt template for the regular chat specific chain."""
 
-        template_str = """<s>[INST] <<SYS>>
+        template_str = """[INST] <<SYS>>
         You are an AI assistant chatbot for a online store customer service. You answer professional user questions about products and services.
         You will be provided chat history. You may use the chat history whenever necessary to answer the user questions.
         If you don't know the answer, just say that you don't know.
@@ -95,12 +223,137 @@ class LlamaCpp_Provider:
 
         prompt = PromptTemplate(
             input_variables=["user_question", "history"],
-            template=template_str,
+            template=self._strip_indentation(template_str),
         )
 
         return prompt
 
-    async def chat(self, user_question: str, memory, websocket=None):
+    async def _restore_prefix(self, prefix, prompt=None):
+        """
+        Restores the saved model state of a static prompt prefix. Must be called while
+        holding a scheduler slot since the model state is shared.
+
+        If the prompt is given, the number of its tokens covered by the restored state
+        is recorded, and a prompt which does not start with all prefix tokens is
+        reported since llama.cpp then prefills it again.
+
+        Args:
+            prefix (str): The static prefix of the upcoming prompt.
+            prompt (str, optional): The complete upcoming prompt.
+        """
+        if self.prefix_cache is None or not prefix:
+            return
+        try:
+            match = await self._run_model(self.prefix_cache.restore, prefix, prompt)
+        except Exception as e:
+            print(f"Error restoring prompt prefix state: {e}")
+            self.model.client.reset()
+            return
+        if match is not None:
+            prefix_tokens, matched = match
+            metrics.observe("llm.prefix_cache.matched_tokens", matched)
+            if matched < prefix_tokens:
+                metrics.increment("llm.prefix_cache.mismatches")
+                print(
+                    f"Prompt matches only {matched} of {prefix_tokens} cached prefix"
+                    " tokens"
+                )
+
+    async def _run_model(self, func, *args):
+        """
+        Runs a blocking call on the model in a worker thread. Must be called while
+        holding a scheduler slot. If the caller is cancelled, the call is still
+        awaited before the cancellation propagates, so the slot is not handed over
+        while the model is busy.
+
+        Args:
+            func (callable): The blocking call.
+            *args: The arguments of the call.
+
+        Returns:
+            The result of the call.
+        """
+        worker = asyncio.ensure_future(asyncio.to_thread(func, *args))
+        try:
+            return await asyncio.shield(worker)
+        except asyncio.CancelledError:
+            await asyncio.wait([worker])
+            raise
+
+    async def _run_stream(self, runnable, input, on_chunk=None):
+        """
+        Runs a streaming call on the model, generating tokens in a worker thread.
+        Must be called while holding a scheduler slot.
+
+        The token loop checks a stop flag between tokens, so cancelling the caller,
+        e.g. when the client disconnects or stops the answer, aborts the generation
+        within one token. The worker is awaited before the cancellation propagates.
+
+        Args:
+            runnable: The model or the chat or rag pipeline.
+            input: The input of the runnable.
+            on_chunk (callable, optional): Coroutine function awaited with every
+                generated chunk. Defaults to None.
+
+        Returns:
+            str: The generated text.
+        """
+        loop = asyncio.get_running_loop()
+        chunks = asyncio.Queue()
+        stop = threading.Event()
+
+        def generate():
+            error = None
+            try:
+                for chunk in runnable.stream(input):
+                    if stop.is_set():
+                        break
+                    if chunk:
+                        loop.call_soon_threadsafe(chunks.put_nowait, (chunk, None))
+            except Exception as e:
+                error = e
+            finally:
+                loop.call_soon_threadsafe(chunks.put_nowait, (None, error))
+
+        worker = asyncio.ensure_future(asyncio.to_thread(generate))
+        response = ""
+        try:
+            while True:
+                chunk, error = await chunks.get()
+                if chunk is None:
+                    if error is not None:
+                        raise error
+                    return response
+                response += chunk
+                if on_chunk is not None:
+                    await on_chunk(chunk)
+        except asyncio.CancelledError:
+            metrics.increment("llm.generations.cancelled")
+            raise
+        finally:
+            stop.set()
+            await asyncio.wait([worker])
+
+    async def complete(
+        self, prompt: str, session_id=None, websocket=None, prefix=None
+    ):
+        """
+        Runs a short completion such as a classifier prompt through the scheduler.
+
+        Args:
+            prompt (str): The complete prompt.
+            session_id: (optional) The ID of the user session making the request.
+            websocket: (optional) The WebSocket connection for queue position updates.
+            prefix: (optional) The static prefix of the prompt whose state is cached.
+
+        Returns:
+            str: The completion of the LLM.
+        """
+        async with self.scheduler.slot(session_id, PRIORITY_SHORT, websocket):
+            await self._restore_prefix(prefix, prompt)
+            return await self._run_stream(self.model, prompt)
+
+    async def chat(self, user_question: str, memory, websocket=None, session_id=None):
         """
         Perform a chat interaction LLM.
 
@@ -109,6 +362,7 @@ class LlamaCpp_Provider:
             context: The context information for the conversation.
             memory: The memory information for the conversation.
             websocket: (optional) The WebSocket connection for streaming responses.
+            session_id: (optional) The ID of the user session used for scheduling.
 
         Returns:
             The response from the LLM.
@@ -118,11 +372,24 @@ class LlamaCpp_Provider:
         """
 
         chat_pipeline = self._get_chat_pipeline(memory)
+        prompt = self._get_prompt_chat_template().format(
+            user_question=user_question,
+            history=memory.load_memory_variables({})["history"],
+        )
+        self._report_prompt_tokens("chat", prompt)
         if websocket is None:
-            return await self.chat_pipeline.ainvoke(user_question)
+            async with self.scheduler.slot(session_id, PRIORITY_GENERATION):
+                await self._restore_prefix(self.chat_prefix, prompt)
+                return await self._run_stream(chat_pipeline, user_question)
         else:
             return await self._stream_response(
-                chat_pipeline, user_question, None, websocket
+                chat_pipeline,
+                user_question,
+                None,
+                websocket,
+                session_id,
+                self.chat_prefix,
+                prompt,
             )
 
     async def rag_chat(
@@ -131,6 +398,7 @@ class LlamaCpp_Provider:
         context,
         memory,
         websocket=None,
+        session_id=None,
     ):
         """
         Perform a chat interaction LLM using RAG pipeline.
@@ -140,6 +408,7 @@ class LlamaCpp_Provider:
             context: The context information for the conversation.
             memory: The memory information for the conversation.
             websocket: (optional) The WebSocket connection for streaming responses.
+            session_id: (optional) The ID of the user session used for scheduling.
 
         Returns:
             The response from the LLM.
@@ -148,14 +417,28 @@ class LlamaCpp_Provider:
             Any exceptions that occur during the chat interaction.
         """
         rag_pipeline = self._get_rag_pipeline(context, memory)
+        prompt = self._get_prompt_rag_template().format(
+            user_question=user_question, context=context
+        )
+        self._report_prompt_tokens("rag", prompt)
         if websocket is None:
-            return await rag_pipeline.ainvoke(user_question)
+            async with self.scheduler.slot(session_id, PRIORITY_GENERATION):
+                await self._restore_prefix(self.rag_prefix, prompt)
+                return await self._run_stream(rag_pipeline, user_question)
         else:
             return await self._stream_response(
-                rag_pipeline, user_question, context, websocket
+                rag_pipeline,
+                user_question,
+                context,
+                websocket,
+                session_id,
+                self.rag_prefix,
+                prompt,
             )
 
-    async def _stream_response(self, llm, query, context, websocket):
+    async def _stream_response(
+        self, llm, query, context, websocket, session_id=None, prefix=None, prompt=None
+    ):
         """
         Stream the response from the llm to the websocket.
 
@@ -164,38 +447,67 @@ class LlamaCpp_Provider:
             query (str): The query to be sent to the llm.
             context (str): The context to be included in the response.
             websocket (WebSocket): The websocket to send the response to.
+            session_id: (optional) The ID of the user session used for scheduling.
+            prefix (str): (optional) The static prompt prefix whose state is cached.
+            prompt (str): (optional) The complete prompt, used to check the prefix.
 
         Returns:
             str: The complete response from the LLM.
         """
-        chunk_response = ""
-        response = ""
+        writer = Frame_Coalescer(
+            websocket, self.ws_flush_tokens, self.ws_flush_bytes, self.ws_flush_ms
+        )
 
-        # Streaming the response using the chain astream method from langchain
-        async for chunk in llm.astream(query):
-            content = chunk
-            if content is not None:
-                response += content
-                chunk_response += content
-                if "\n" in chunk_response:
-                    await websocket.send_json(
-                        {"type": "chunk_response", "output": chunk_response}
-                    )
-                    chunk_response = ""
-
-        if chunk_response:
-            await websocket.send_json(
-                {"type": "chunk_response", "output": chunk_response}
-            )
+        # Streaming the response token by token from the chain
+        try:
+            async with self.scheduler.slot(session_id, PRIORITY_GENERATION, websocket):
+                await self._restore_prefix(prefix, prompt)
+                response = await self._run_stream(llm, query, writer.write)
+        except BaseException:
+            # a failed or cancelled response sends no chunks after its end frame
+            writer.close()
+            raise
+        await writer.flush()
+
+        return await self._send_context(response, context, websocket)
+
+    async def _send_context(self, response, context, websocket):
+        """
+        Sends the context after the response in one frame and ends the websocket
+        message.
 
+        Args:
+            response (str): The response already sent to the websocket.
+            context (str): The context to be included in the response.
+            websocket (WebSocket): The websocket to send the context to.
+
+        Returns:
+            str: The response including the context.
+        """
         if context:
             response += context
-            chunks = context.split("\n")
-            for chunk in chunks:
-                await websocket.send_json({"type": "chunk_response", "output": chunk})
-        await websocket.send_json({"type": "end", "output": ""})
+            await send_frame(websocket, {"type": "context", "output": context})
+        await send_frame(websocket, {"type": "end", "output": ""})
         return response
 
+    async def send_response(self, response: str, context, websocket=None):
+        """
+        Sends an already generated response, e.g. from the answer cache, using the
+        same websocket protocol as a streamed response.
+
+        Args:
+            response (str): The generated response.
+            context (str): The context to be included in the response.
+            websocket: (optional) The WebSocket connection for streaming responses.
+
+        Returns:
+            str: The response including the context.
+        """
+        if websocket is None:
+            return response
+        await send_frame(websocket, {"type": "chunk_response", "output": response})
+        return await self._send_context(response, context, websocket)
+
     def _get_rag_pipeline(self, context, memory):
         """
         Returns a pipeline for generating a response using the RAG (Retrieval-Augmented Generation) model.
@@ -0,0 +1,81 @@
+import threading
+from collections import OrderedDict
+
+
+class Prefix_State_Cache:
+    """
+    LRU of llama.cpp model states saved right after evaluating static prompt prefixes.
+
+    Restoring a prefix state before a call lets llama.cpp's prefix matching skip the
+    prefill of the static system prompt and few-shot examples, so only the dynamic
+    suffix of the prompt is evaluated. The model state is shared, so restores must
+    happen while holding the inference scheduler slot.
+
+    Prefixes are tokenized exactly like llama_cpp tokenizes a completion prompt, with
+    the BOS token added and special tokens parsed, otherwise the saved tokens would
+    diverge from the prompt tokens and llama.cpp could reuse none of them.
+
+    Attributes:
+        llama (Llama): The llama_cpp model instance.
+        maxsize (int): Maximum number of saved prefix states.
+        hits (int): Restores served from a saved state or the current model state.
+        misses (int): Restores which had to evaluate the prefix.
+    """
+
+    def __init__(self, llama, maxsize=4):
+        self.llama = llama
+        self.maxsize = maxsize
+        self.states = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def tokenize(self, text: str):
+        """Tokenizes a text the way llama_cpp's create_completion tokenizes a prompt."""
+        return self.llama.tokenize(text.encode("utf-8"), add_bos=True, special=True)
+
+    def _is_loaded(self, tokens):
+        n_tokens = self.llama.n_tokens
+        if n_tokens < len(tokens):
+            return False
+        return list(self.llama.input_ids[: len(tokens)]) == tokens
+
+    def restore(self, prefix: str, prompt=None):
+        """
+        Brings the model into the state right after evaluating the prefix.
+
+        Args:
+            prefix (str): The static prefix of the upcoming prompt.
+            prompt (str, optional): The complete upcoming prompt. If given, the number
+                of its leading tokens covered by the restored state is returned.
+
+        Returns:
+            tuple: The number of prefix tokens and the number of leading prompt
+                tokens matching them, or None if no prompt was given.
+        """
+        with self._lock:
+            entry = self.states.get(prefix)
+            if entry is not None:
+                tokens, state = entry
+                self.states.move_to_end(prefix)
+                self.hits += 1
+                if not self._is_loaded(tokens):
+                    self.llama.load_state(state)
+            else:
+                self.misses += 1
+                tokens = self.tokenize(prefix)
+                self.llama.reset()
+                self.llama.eval(tokens)
+                self.states[prefix] = (tokens, self.llama.save_state())
+                if len(self.states) > self.maxsize:
+                    self.states.popitem(last=False)
+
+        if prompt is None:
+            return None
+        matched = self.llama.longest_token_prefix(tokens, self.tokenize(prompt))
+        return len(tokens), matched
+
+    def stats(self):
+        """Returns the hit/miss counters and the number of saved states."""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self.states)}
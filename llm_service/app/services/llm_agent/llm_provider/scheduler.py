@@ -0,0 +1,201 @@
+import time
+import asyncio
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from ...websocket.framing import send_frame
+
+# Short prompts such as the classifier are served ahead of long generations.
+PRIORITY_SHORT = 0
+PRIORITY_GENERATION = 1
+
+
+class Scheduler_Overloaded(RuntimeError):
+    """Raised when a request is rejected because the inference queue is full or
+    the request waited longer than the configured maximum."""
+
+
+class _Waiter:
+    def __init__(self, session_id, priority, future):
+        self.session_id = session_id
+        self.priority = priority
+        self.future = future
+
+
+class Inference_Scheduler:
+    """
+    Admission control and fair scheduling for a shared model.
+
+    Requests wait in a bounded queue per priority class. Within a class, sessions are
+    served round-robin so one chatty session cannot starve the others. Requests are
+    rejected when the queue is full or when they waited longer than max_wait.
+
+    Attributes:
+        concurrency (int): Number of requests allowed to use the model at once.
+        max_queue_depth (int): Maximum number of waiting requests.
+        max_wait (float): Maximum seconds a request may wait for the model.
+        update_interval (float): Seconds between queue position updates to the client.
+    """
+
+    def __init__(
+        self, concurrency=1, max_queue_depth=32, max_wait=120.0, update_interval=1.0
+    ):
+        self.concurrency = concurrency
+        self.max_queue_depth = max_queue_depth
+        self.max_wait = max_wait
+        self.update_interval = update_interval
+        self.active = 0
+        # priority -> OrderedDict(session_id -> deque of waiters)
+        self._queues = {
+            PRIORITY_SHORT: OrderedDict(),
+            PRIORITY_GENERATION: OrderedDict(),
+        }
+        self._waiting = 0
+        # moving average of the seconds a request holds the model, per priority
+        self._durations = {PRIORITY_SHORT: 2.0, PRIORITY_GENERATION: 20.0}
+
+    def _enqueue(self, session_id, priority):
+        if self._waiting >= self.max_queue_depth:
+            raise Scheduler_Overloaded("The model is overloaded, please retry later.")
+        future = asyncio.get_running_loop().create_future()
+        waiter = _Waiter(session_id, priority, future)
+        self._queues[priority].setdefault(session_id, deque()).append(waiter)
+        self._waiting += 1
+        self._dispatch()
+        return waiter
+
+    def _remove(self, waiter):
+        sessions = self._queues[waiter.priority]
+        waiters = sessions.get(waiter.session_id)
+        if waiters is not None and waiter in waiters:
+            waiters.remove(waiter)
+            self._waiting -= 1
+            if not waiters:
+                del sessions[waiter.session_id]
+
+    def _dispatch(self):
+        """Grants free slots to the next waiters in priority and round-robin order."""
+        while self.active < self.concurrency and self._waiting:
+            for priority in sorted(self._queues):
+                sessions = self._queues[priority]
+                if sessions:
+                    session_id, waiters = sessions.popitem(last=False)
+                    waiter = waiters.popleft()
+                    if waiters:
+                        sessions[session_id] = waiters
+                    break
+            self._waiting -= 1
+            if not waiter.future.done():
+                self.active += 1
+                waiter.future.set_result(True)
+
+    def _dispatch_order(self):
+        """Returns the waiters in the order they would be granted the model."""
+        order = []
+        for priority in sorted(self._queues):
+            rounds = [list(waiters) for waiters in self._queues[priority].values()]
+            depth = max((len(waiters) for waiters in rounds), default=0)
+            for i in range(depth):
+                order.extend(waiters[i] for waiters in rounds if i < len(waiters))
+        return order
+
+    def position(self, waiter):
+        """
+        Estimates the queue position of a waiting request.
+
+        Args:
+            waiter (_Waiter): The waiting request.
+
+        Returns:
+            tuple: The 1-based queue position and the estimated wait in seconds.
+        """
+        order = self._dispatch_order()
+        ahead = order[: order.index(waiter)] if waiter in order else order
+        eta = sum(self._durations[w.priority] for w in ahead)
+        if self.active >= self.concurrency:
+            eta += self._durations[PRIORITY_GENERATION] / 2
+        return len(ahead) + 1, round(eta / self.concurrency, 1)
+
+    async def acquire(self, session_id, priority, websocket=None):
+        """
+        Waits for a slot on the model, pushing queue position frames to the websocket.
+
+        Args:
+            session_id: The ID of the user session making the request.
+            priority (int): PRIORITY_SHORT or PRIORITY_GENERATION.
+            websocket (WebSocket, optional): The websocket to notify. Defaults to None.
+
+        Raises:
+            Scheduler_Overloaded: If the queue is full or the wait exceeds max_wait.
+        """
+        waiter = self._enqueue(session_id, priority)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_wait
+        last_position = None
+        try:
+            while not waiter.future.done():
+                if websocket is not None:
+                    position, eta = self.position(waiter)
+                    if position != last_position:
+                        await send_frame(
+                            websocket,
+                            {
+                                "type": "queue",
+                                "output": "",
+                                "position": position,
+                                "eta": eta,
+                            },
+                        )
+                        last_position = position
+
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    raise Scheduler_Overloaded(
+                        "Timed out waiting for the model, please retry later."
+                    )
+                try:
+                    await asyncio.wait_for(
+                        asyncio.shield(waiter.future),
+                        timeout=min(remaining, self.update_interval),
+                    )
+                except asyncio.TimeoutError:
+                    pass
+        except BaseException:
+            if waiter.future.done() and not waiter.future.cancelled():
+                self.release(priority)
+            else:
+                waiter.future.cancel()
+                self._remove(waiter)
+            raise
+
+    def release(self, priority, duration=None):
+        """
+        Releases a slot on the model and grants it to the next waiter.
+
+        Args:
+            priority (int): The priority the slot was acquired with.
+            duration (float, optional): Seconds the slot was held. Defaults to None.
+        """
+        self.active -= 1
+        if duration is not None:
+            average = self._durations[priority]
+            self._durations[priority] = 0.8 * average + 0.2 * duration
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, session_id, priority, websocket=None):
+        """Holds a slot on the model for the duration of the context."""
+        await self.acquire(session_id, priority, websocket)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(priority, time.monotonic() - start)
+
+    def stats(self):
+        """Returns the queue depth and average slot durations."""
+        return {
+            "active": self.active,
+            "waiting": self._waiting,
+            "avg_short_seconds": round(self._durations[PRIORITY_SHORT], 3),
+            "avg_generation_seconds": round(self._durations[PRIORITY_GENERATION], 3),
+        }
@@ -0,0 +1,244 @@
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+from ..metrics import metrics
+
+SUMMARY_QUESTION_CHARS = 120
+
+
+class Conversation_Memory:
+    """
+    Memory of one user session. The last turns are kept verbatim as plain
+    (question, answer, tokens) lists, bounded by the turn and token limits of the
+    store. Turns falling out of the window are folded into a short rolling summary
+    of the earlier questions if the store keeps summaries.
+
+    Implements the load_memory_variables and save_context methods of the langchain
+    memories used by the chat pipeline.
+
+    Attributes:
+        session_id: The ID of the user session.
+        turns (list): The [question, answer, tokens] of the last turns, oldest first.
+        summary (str): The summary of the earlier turns.
+        last_used (float): The time the memory was last used.
+    """
+
+    __slots__ = ("store", "session_id", "turns", "summary", "last_used")
+
+    def __init__(self, store, session_id, turns=None, summary=""):
+        self.store = store
+        self.session_id = session_id
+        self.turns = turns or []
+        self.summary = summary
+        self.last_used = time.time()
+
+    def history(self):
+        """Returns the conversation history as prompt text."""
+        lines = []
+        if self.summary:
+            lines.append(f"Earlier the user asked: {self.summary}")
+        for question, answer, _ in list(self.turns):
+            lines.append(f"User: {question}")
+            lines.append(f"Assistant: {answer}")
+        return "\n".join(lines)
+
+    def load_memory_variables(self, inputs=None):
+        return {"history": self.history()}
+
+    def save_context(self, inputs: dict, outputs: dict):
+        """
+        Adds a turn and trims the memory to the limits of the store.
+
+        Args:
+            inputs (dict): The "input" question of the user.
+            outputs (dict): The "output" answer of the assistant.
+        """
+        self.store.add_turn(self, inputs["input"], outputs["output"])
+
+    def to_json(self):
+        return json.dumps({"turns": self.turns, "summary": self.summary})
+
+
+class Memory_Store:
+    """
+    Conversation memories of all user sessions.
+
+    Memories are kept in memory in least recently used order. Sessions idle for
+    more than spill_after seconds are written to a SQLite file and loaded again when
+    the user returns. Sessions idle for more than ttl seconds are dropped.
+
+    Attributes:
+        tokenizer: Object with the count_tokens and truncate_tokens methods of the
+            LLM provider.
+        max_turns (int): The number of turns kept verbatim.
+        max_tokens (int): The number of tokens of the turns kept verbatim.
+        summary_chars (int): The length of the rolling summary, 0 disables it.
+        ttl (float): Seconds an idle session is kept.
+        spill_after (float): Seconds after which an idle session is spilled to disk.
+    """
+
+    def __init__(
+        self,
+        tokenizer,
+        max_turns=6,
+        max_tokens=1024,
+        summary_chars=400,
+        ttl=3600 * 3,
+        spill_after=600,
+        path=None,
+    ):
+        self.tokenizer = tokenizer
+        self.max_turns = max_turns
+        self.max_tokens = max_tokens
+        self.summary_chars = summary_chars
+        self.ttl = ttl
+        self.spill_after = spill_after
+        self.sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self._last_purge = time.time()
+        self.connection = None
+        if path:
+            self.connection = sqlite3.connect(path, check_same_thread=False)
+            with self.connection:
+                self.connection.execute(
+                    "CREATE TABLE IF NOT EXISTS memories (session_id TEXT PRIMARY KEY,"
+                    " last_used REAL NOT NULL, data TEXT NOT NULL) WITHOUT ROWID"
+                )
+
+    def get(self, session_id):
+        """
+        Returns the memory of a session, loading it from disk if it was spilled.
+
+        Args:
+            session_id: The ID of the user session.
+
+        Returns:
+            Conversation_Memory: The memory of the session.
+        """
+        with self._lock:
+            self._spill_idle()
+            memory = self.sessions.get(session_id)
+            if memory is None:
+                memory = self._load(session_id)
+                self.sessions[session_id] = memory
+            self.sessions.move_to_end(session_id)
+            memory.last_used = time.time()
+            return memory
+
+    def add_turn(self, memory, question: str, answer: str):
+        """
+        Adds a turn to a memory, evicting the oldest turns beyond the turn and token
+        limits. The newest turn is truncated if it alone exceeds the token limit, the
+        question to at most half of the limit and the answer to the rest.
+
+        Args:
+            memory (Conversation_Memory): The memory of the session.
+            question (str): The question of the user.
+            answer (str): The answer of the assistant.
+        """
+        question_tokens = self.tokenizer.count_tokens(question)
+        answer_tokens = self.tokenizer.count_tokens(answer)
+        if question_tokens + answer_tokens > self.max_tokens:
+            if question_tokens > self.max_tokens // 2:
+                question = self.tokenizer.truncate_tokens(
+                    question, self.max_tokens // 2
+                )
+                question_tokens = self.tokenizer.count_tokens(question)
+            answer = self.tokenizer.truncate_tokens(
+                answer, self.max_tokens - question_tokens
+            )
+            answer_tokens = self.tokenizer.count_tokens(answer)
+        tokens = question_tokens + answer_tokens
+
+        with self._lock:
+            turns = memory.turns + [[question, answer, tokens]]
+            total = sum(turn[2] for turn in turns)
+            evicted = []
+            while len(turns) > 1 and (
+                len(turns) > self.max_turns or total > self.max_tokens
+            ):
+                evicted.append(turns.pop(0))
+                total -= evicted[-1][2]
+            memory.turns = turns
+            if evicted and self.summary_chars > 0:
+                memory.summary = self._summarize(memory.summary, evicted)
+            metrics.increment("memory.turns_evicted", len(evicted))
+
+            # the session may have been spilled while its answer was generated
+            memory.last_used = time.time()
+            self.sessions[memory.session_id] = memory
+            self.sessions.move_to_end(memory.session_id)
+
+    def _summarize(self, summary, turns):
+        """Folds the questions of evicted turns into the summary, keeping its most
+        recent summary_chars characters."""
+        questions = [
+            " ".join(turn[0].split())[:SUMMARY_QUESTION_CHARS] for turn in turns
+        ]
+        summary = "; ".join(part for part in [summary, *questions] if part)
+        if len(summary) > self.summary_chars:
+            summary = summary[-self.summary_chars :]
+            summary = summary.partition("; ")[2] or summary
+        return summary
+
+    def _load(self, session_id):
+        if self.connection is not None:
+            row = self.connection.execute(
+                "SELECT last_used, data FROM memories WHERE session_id = ?",
+                (session_id,),
+            ).fetchone()
+            if row is not None:
+                with self.connection:
+                    self.connection.execute(
+                        "DELETE FROM memories WHERE session_id = ?", (session_id,)
+                    )
+                if time.time() - row[0] <= self.ttl:
+                    data = json.loads(row[1])
+                    metrics.increment("memory.restored")
+                    return Conversation_Memory(
+                        self, session_id, data["turns"], data["summary"]
+                    )
+        return Conversation_Memory(self, session_id)
+
+    def _spill_idle(self):
+        """Moves the sessions idle for longer than spill_after to disk, least
+        recently used first, and purges expired sessions."""
+        now = time.time()
+        # without a spill file idle sessions stay in memory until they expire
+        max_idle = self.spill_after if self.connection is not None else self.ttl
+        spilled = []
+        while self.sessions:
+            session_id, memory = next(iter(self.sessions.items()))
+            if now - memory.last_used <= max_idle:
+                break
+            del self.sessions[session_id]
+            if memory.turns and now - memory.last_used <= self.ttl:
+                spilled.append(memory)
+        self._write(spilled)
+
+        if self.connection is not None and now - self._last_purge > self.spill_after:
+            with self.connection:
+                self.connection.execute(
+                    "DELETE FROM memories WHERE last_used < ?", (now - self.ttl,)
+                )
+            self._last_purge = now
+
+    def _write(self, memories):
+        if self.connection is None or not memories:
+            return
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO memories VALUES (?, ?, ?)",
+                [(m.session_id, m.last_used, m.to_json()) for m in memories],
+            )
+        metrics.increment("memory.spilled", len(memories))
+
+    def close(self):
+        """Spills all sessions to disk so conversations survive a restart."""
+        with self._lock:
+            self._write([memory for memory in self.sessions.values() if memory.turns])
+            self.sessions.clear()
+            if self.connection is not None:
+                self.connection.close()
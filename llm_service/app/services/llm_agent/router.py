@@ -0,0 +1,168 @@
+import re
+import numpy as np
+
+
+# Example queries used to build the label centroids of the classifier.
+CLASSIFIER_EXAMPLES = {
+    "product-inquiry": [
+        "What type of television do you have?",
+        "Do you have LED lamps?",
+        "I want to purchase 50 inches TV",
+        "Can you tell me about television products?",
+        "Show me running shoes for women",
+        "Do you sell wireless headphones?",
+        "I am looking for a stainless steel water bottle",
+        "Which laptops do you have under 500 dollars?",
+        "Can you recommend a coffee maker?",
+        "Tell me about product B07XJ8C8F5",
+        "Do you have a product with Id 12746?",
+        "I need a phone case for iphone 12",
+    ],
+    "product-followup": [
+        "What is its color?",
+        "What are its features?",
+        "What is its brand?",
+        "How much does it weigh?",
+        "Is it waterproof?",
+        "What is the size of that one?",
+        "Does it come with a warranty?",
+        "Tell me more about the second one",
+        "What material is it made of?",
+        "Is this available in other colors?",
+    ],
+    "general-question": [
+        "Hello how are you?",
+        "Are you open today?",
+        "How can you help me?",
+        "What are your opening hours?",
+        "Thank you for your help",
+        "How do I return an order?",
+        "Who are you?",
+        "What is your shipping policy?",
+        "Good morning",
+        "Can I talk to a human agent?",
+    ],
+}
+
+_ASIN_PATTERN = re.compile(r"\b(B0[0-9A-Z]{8})\b")
+_KEYWORD_ID_PATTERN = re.compile(
+    r"\b(?:product\s*id|id|asin|sku|item|product|model)\s*(?:number|no\.?|#)?\s*[:#]?\s*([A-Za-z0-9-]*\d[A-Za-z0-9-]*)\b",
+    re.IGNORECASE,
+)
+_CODE_PATTERN = re.compile(r"\b(?=[A-Z0-9-]*\d)(?=[A-Z0-9-]*[A-Z])[A-Z0-9-]{5,}\b")
+_MEASUREMENT_PATTERN = re.compile(
+    r"\$\s*\d+(?:[.,]\d+)?|\b\d+(?:[.,]\d+)?\s*(?:\"|''|inch(?:es)?|in|cm|mm|m|ft|feet|gb|tb|mb|k|p|hz|w|v|mah|oz|lbs?|kg|g|ml|l|pack|pcs|pieces|dollars?|usd|years?|months?)(?![A-Za-z])",
+    re.IGNORECASE,
+)
+_DIGIT_PATTERN = re.compile(r"\d")
+
+
+class Route:
+    """
+    Represents a routing decision of the pre-router.
+
+    Attributes:
+        value (str): The label or product id decided.
+        source (str): The stage which made the decision, e.g. "regex" or "centroid".
+        confidence (float): The confidence of the decision between 0 and 1.
+    """
+
+    def __init__(self, value: str, source: str, confidence: float):
+        self.value = value
+        self.source = source
+        self.confidence = confidence
+
+
+class Query_Router:
+    """
+    Cheap, non-LLM pre-router for query classification and product-ID extraction.
+
+    Product IDs are detected with regular expressions and queries are classified by
+    their nearest label centroid using the already loaded embedding model. Both
+    methods return None when they are not confident, in which case the caller
+    falls back to the LLM prompts.
+
+    Attributes:
+        emb_fn (CustomEmbeddingFunction): The embedding function of the database service.
+        min_similarity (float): Minimum cosine similarity to the best centroid.
+        min_margin (float): Minimum similarity margin between the best two centroids.
+    """
+
+    def __init__(self, emb_fn, examples=None, min_similarity=0.35, min_margin=0.08):
+        self.emb_fn = emb_fn
+        self.min_similarity = min_similarity
+        self.min_margin = min_margin
+        self.labels, self.centroids = self._build_centroids(
+            examples or CLASSIFIER_EXAMPLES
+        )
+
+    def _normalize(self, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    def _build_centroids(self, examples):
+        """
+        Computes the normalized mean embedding of the examples of every label.
+
+        Args:
+            examples (dict): Mapping of label to example queries.
+
+        Returns:
+            tuple: The labels and a matrix with one centroid row per label.
+        """
+        labels = list(examples)
+        centroids = []
+        for label in labels:
+            vectors = self._normalize(self.emb_fn(examples[label]))
+            centroids.append(vectors.mean(axis=0))
+        return labels, self._normalize(centroids)
+
+    async def classify(self, user_query: str):
+        """
+        Classifies a user query by its nearest label centroid.
+
+        Args:
+            user_query (str): The user query to be classified.
+
+        Returns:
+            Route: The label decision, or None if the classifier is not confident.
+        """
+        embedding = self._normalize(await self.emb_fn.aembed([user_query]))[0]
+        similarities = self.centroids @ embedding
+        order = np.argsort(similarities)[::-1]
+        best, second = similarities[order[0]], similarities[order[1]]
+        margin = float(best - second)
+
+        if best < self.min_similarity or margin < self.min_margin:
+            return None
+        return Route(self.labels[order[0]], "centroid", min(1.0, margin / 0.5))
+
+    def extract_product_id(self, user_query: str):
+        """
+        Extracts a product identification number from the user query with regular
+        expressions.
+
+        Args:
+            user_query (str): The user query to be analyzed.
+
+        Returns:
+            Route: The product id, or "false" if the query contains no id-like
+            token at all. None if the query is ambiguous.
+        """
+        match = _ASIN_PATTERN.search(user_query)
+        if match:
+            return Route(match.group(1), "regex", 1.0)
+
+        match = _KEYWORD_ID_PATTERN.search(user_query)
+        if match and len(match.group(1)) >= 4:
+            return Route(match.group(1), "regex", 0.9)
+
+        match = _CODE_PATTERN.search(user_query)
+        if match:
+            return Route(match.group(0), "regex", 0.8)
+
+        if not _DIGIT_PATTERN.search(_MEASUREMENT_PATTERN.sub(" ", user_query)):
+            return Route("false", "regex", 0.9)
+
+        return None
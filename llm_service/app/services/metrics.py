@@ -0,0 +1,55 @@
+import threading
+from collections import defaultdict
+
+
+class Metrics:
+    """Thread-safe in-process counters and value summaries exposed by the /metrics
+    endpoint."""
+
+    def __init__(self):
+        self._counters = defaultdict(int)
+        self._summaries = {}
+        self._lock = threading.Lock()
+
+    def increment(self, name: str, value=1):
+        """
+        Increments a counter.
+
+        Args:
+            name (str): The dotted name of the counter.
+            value (int, optional): The amount to add. Defaults to 1.
+        """
+        with self._lock:
+            self._counters[name] += value
+
+    def observe(self, name: str, value):
+        """
+        Records a value, e.g. the token count of a request, in a summary of the
+        count, sum, maximum and last value.
+
+        Args:
+            name (str): The dotted name of the summary.
+            value (float): The observed value.
+        """
+        with self._lock:
+            summary = self._summaries.get(name)
+            if summary is None:
+                summary = {"count": 0, "sum": 0, "max": value, "last": value}
+                self._summaries[name] = summary
+            summary["count"] += 1
+            summary["sum"] += value
+            summary["max"] = max(summary["max"], value)
+            summary["last"] = value
+
+    def snapshot(self):
+        """Returns a copy of all counters and summaries."""
+        with self._lock:
+            return {
+                "counters": dict(self._counters),
+                "summaries": {
+                    name: dict(summary) for name, summary in self._summaries.items()
+                },
+            }
+
+
+metrics = Metrics()
@@ -0,0 +1,136 @@
+import json
+import asyncio
+import contextvars
+from fastapi import WebSocket
+
+SUBPROTOCOL_MSGPACK = "msgpack"
+
+# ID of the client request whose frames the current task sends. Frames are tagged
+# with it so several requests can be multiplexed on one connection.
+request_id_var = contextvars.ContextVar("request_id", default=None)
+
+
+def negotiate_framing(websocket: WebSocket):
+    """
+    Picks the framing of a connection from the subprotocols offered by the client.
+    Binary msgpack frames are used if the client offers the msgpack subprotocol and
+    the msgpack package is installed, JSON text frames otherwise.
+
+    Args:
+        websocket (WebSocket): The connecting websocket.
+
+    Returns:
+        str: The accepted subprotocol, or None for JSON framing.
+    """
+    websocket.state.packer = None
+    if SUBPROTOCOL_MSGPACK in websocket.scope.get("subprotocols", []):
+        try:
+            import msgpack
+
+            websocket.state.packer = msgpack.Packer()
+            return SUBPROTOCOL_MSGPACK
+        except ImportError:
+            pass
+    return None
+
+
+async def write_frame(websocket: WebSocket, frame: dict):
+    """
+    Writes a frame to the websocket with the framing negotiated by the connection.
+
+    Args:
+        websocket (WebSocket): The websocket.
+        frame (dict): The frame.
+    """
+    packer = getattr(websocket.state, "packer", None)
+    if packer is not None:
+        await websocket.send_bytes(packer.pack(frame))
+    else:
+        await websocket.send_text(json.dumps(frame, separators=(",", ":")))
+
+
+async def send_frame(websocket: WebSocket, frame: dict):
+    """
+    Sends a frame, tagged with the request ID of the current task if the client
+    sent one. Frames of connections managed by WebSocket_Service are queued for
+    their sender task instead of being written directly, so a slow client does not
+    hold up the caller.
+
+    Args:
+        websocket (WebSocket): The websocket.
+        frame (dict): The frame.
+    """
+    request_id = request_id_var.get()
+    if request_id is not None:
+        frame = {**frame, "request_id": request_id}
+    connection = getattr(websocket.state, "connection", None)
+    if connection is not None:
+        connection.put(frame)
+    else:
+        await write_frame(websocket, frame)
+
+
+class Frame_Coalescer:
+    """
+    Coalesces the chunks of a streamed response into chunk_response frames. The
+    buffer is flushed once it holds flush_tokens chunks, flush_bytes bytes or its
+    first chunk is flush_ms milliseconds old, whichever comes first. The age is
+    enforced by a timer, so buffered text is also sent while generation stalls.
+
+    Attributes:
+        websocket (WebSocket): The websocket to send the frames to.
+        flush_tokens (int): The maximum number of chunks per frame.
+        flush_bytes (int): The maximum number of buffered bytes.
+        flush_ms (float): The maximum age of the buffer in milliseconds.
+    """
+
+    def __init__(
+        self, websocket: WebSocket, flush_tokens=16, flush_bytes=1024, flush_ms=100.0
+    ):
+        self.websocket = websocket
+        self.flush_tokens = flush_tokens
+        self.flush_bytes = flush_bytes
+        self.flush_ms = flush_ms
+        self._chunks = []
+        self._bytes = 0
+        self._timer = None
+        self._timer_flush = None
+
+    async def write(self, chunk: str):
+        """Buffers a chunk, flushing the buffer if the policy says so."""
+        if not chunk:
+            return
+        if not self._chunks:
+            self._timer = asyncio.get_running_loop().call_later(
+                self.flush_ms / 1000, self._on_timer
+            )
+        self._chunks.append(chunk)
+        self._bytes += len(chunk.encode("utf-8"))
+        if len(self._chunks) >= self.flush_tokens or self._bytes >= self.flush_bytes:
+            await self.flush()
+
+    def _on_timer(self):
+        self._timer = None
+        self._timer_flush = asyncio.ensure_future(self.flush())
+
+    def _cancel_timer(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    async def flush(self):
+        """Sends the buffered chunks as one frame."""
+        self._cancel_timer()
+        if not self._chunks:
+            return
+        output = "".join(self._chunks)
+        self._chunks = []
+        self._bytes = 0
+        await send_frame(self.websocket, {"type": "chunk_response", "output": output})
+
+    def close(self):
+        """Drops the buffered chunks and stops the timer, e.g. when the response was
+        cancelled, so no chunk is sent after the end of the response."""
+        self._cancel_timer()
+        self._chunks = []
+        self._bytes = 0
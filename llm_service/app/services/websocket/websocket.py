@@ -1,51 +1,196 @@
+import os
 import asyncio
-import datetime
-from typing import List, Dict
+from collections import deque
+from typing import Dict
 from fastapi import WebSocket
+from .framing import negotiate_framing, write_frame
+from ..metrics import metrics
+
+SLOW_CONSUMER_POLICIES = ("coalesce", "drop", "disconnect")
+# frames which may be merged or dropped when a client falls behind, the others
+# (context, end, error) are always delivered
+DROPPABLE_FRAMES = ("chunk_response", "queue")
+
+
+class Client_Connection:
+    """
+    Outbound state of one websocket. Frames are put on a bounded queue drained by a
+    sender task, so a slow client never blocks the tasks producing the frames.
+    Dead connections are detected by the protocol-level pings of the server, see
+    the --ws-ping-interval and --ws-ping-timeout options of uvicorn.
+
+    When max_queue_size frames are waiting, the slow-consumer policy applies to
+    chunk_response and queue frames: coalesce merges a chunk into the last queued
+    chunk of its request, drop discards it, disconnect closes the connection. A
+    chunk which coalesce cannot merge, and every context, end or error frame, takes
+    the place of the oldest queued position update. Without one the chunk is
+    dropped, while the connection is closed for the other frames, since they must
+    not be lost.
+
+    Attributes:
+        websocket (WebSocket): The websocket.
+        max_queue_size (int): The number of queued frames before the policy applies.
+        policy (str): coalesce, drop or disconnect.
+    """
+
+    def __init__(self, websocket: WebSocket, max_queue_size, policy):
+        self.websocket = websocket
+        self.max_queue_size = max_queue_size
+        self.policy = policy
+        self.closed = False
+        self.frames = deque()
+        self._ready = asyncio.Event()
+        self.sender = asyncio.create_task(self._send_loop())
+
+    def put(self, frame: dict):
+        """
+        Queues a frame, applying the slow-consumer policy if the queue is full. The
+        queue never holds more than max_queue_size frames.
+
+        Args:
+            frame (dict): The frame.
+        """
+        if self.closed:
+            return
+        if len(self.frames) >= self.max_queue_size:
+            if frame["type"] not in DROPPABLE_FRAMES:
+                # frames which are always delivered take the place of a queued
+                # position update, or end a connection which cannot take them
+                if not self._evict_queue_update():
+                    self._disconnect_slow_consumer()
+                    return
+            elif self.policy == "disconnect":
+                self._disconnect_slow_consumer()
+                return
+            elif self.policy == "coalesce" and frame["type"] == "chunk_response":
+                if self._merge(frame):
+                    metrics.increment("ws.slow_consumer.coalesced")
+                    return
+                # nothing to merge into, the chunk only gets a position update's
+                # place and is dropped otherwise
+                if not self._evict_queue_update():
+                    metrics.increment("ws.slow_consumer.dropped")
+                    return
+            else:
+                metrics.increment("ws.slow_consumer.dropped")
+                return
+        self.frames.append(frame)
+        self._ready.set()
+
+    def _evict_queue_update(self):
+        """Removes the oldest queued position update. Returns whether there was one."""
+        for queued in self.frames:
+            if queued["type"] == "queue":
+                self.frames.remove(queued)
+                metrics.increment("ws.slow_consumer.dropped")
+                return True
+        return False
+
+    def _disconnect_slow_consumer(self):
+        metrics.increment("ws.slow_consumer.disconnected")
+        self.close(1008, "Client too slow")
+
+    def _merge(self, frame: dict):
+        """Appends a chunk to the last queued frame of its request if that is a
+        chunk too. Returns whether it was merged."""
+        request_id = frame.get("request_id")
+        for queued in reversed(self.frames):
+            if queued.get("request_id") == request_id:
+                if queued["type"] != "chunk_response":
+                    return False
+                queued["output"] += frame["output"]
+                return True
+        return False
+
+    async def _send_loop(self):
+        try:
+            while True:
+                while not self.frames:
+                    self._ready.clear()
+                    await self._ready.wait()
+                await write_frame(self.websocket, self.frames.popleft())
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # the client is gone, the receive loop of the endpoint notices it
+            self.closed = True
+            self.frames.clear()
+
+    def close(self, code=None, reason=""):
+        """
+        Stops the sender task, dropping the queued frames.
+
+        Args:
+            code (int, optional): The close code sent to the client. Defaults to
+                None, which only stops the task of an already closed websocket.
+            reason (str, optional): The close reason. Defaults to "".
+        """
+        was_closed = self.closed
+        self.closed = True
+        self.frames.clear()
+        self.sender.cancel()
+        if code is not None and not was_closed:
+            asyncio.create_task(self._close(code, reason))
+
+    async def _close(self, code, reason):
+        try:
+            await self.websocket.close(code=code, reason=reason)
+        except Exception:
+            pass
 
 
 class WebSocket_Service:
-    """Manage websockets"""
+    """
+    Manage websockets.
+
+    Every connection gets a bounded outbound queue with its own sender task, see
+    Client_Connection. Connections beyond ws_max_connections are rejected.
+    """
 
     def __init__(self):
         """Initialize the WebSocketManager class."""
-        self.active_connections: List[WebSocket] = []
-        self.sender_tasks: Dict[WebSocket, asyncio.Task] = {}
-        self.message_queues: Dict[WebSocket, asyncio.Queue] = {}
-
-    async def start_sender(self, websocket: WebSocket):
-        """Start the sender task."""
-        queue = self.message_queues.get(websocket)
-        if not queue:
-            return
-
-        while True:
-            message = await queue.get()
-            if websocket in self.active_connections:
-                try:
-                    await websocket.send_text(message)
-                except:
-                    break
-            else:
-                break
+        self.connections: Dict[WebSocket, Client_Connection] = {}
+        self.max_connections = int(os.environ.get("ws_max_connections", 1000))
+        self.max_queue_size = int(os.environ.get("ws_max_queue_size", 256))
+        self.slow_consumer_policy = os.environ.get(
+            "ws_slow_consumer_policy", "coalesce"
+        )
+        if self.slow_consumer_policy not in SLOW_CONSUMER_POLICIES:
+            raise ValueError(
+                f"Unknown slow consumer policy: {self.slow_consumer_policy}"
+            )
 
     async def connect(self, websocket: WebSocket):
-        """Connect a websocket."""
-        await websocket.accept()
-        self.active_connections.append(websocket)
-        self.message_queues[websocket] = asyncio.Queue()
-        self.sender_tasks[websocket] = asyncio.create_task(self.start_sender(websocket))
+        """
+        Connect a websocket with the framing negotiated by the client.
+
+        Args:
+            websocket (WebSocket): The connecting websocket.
+
+        Returns:
+            bool: False if the connection was rejected because of the connection cap.
+        """
+        if len(self.connections) >= self.max_connections:
+            metrics.increment("ws.connections.rejected")
+            await websocket.close(code=1013)
+            return False
+        await websocket.accept(subprotocol=negotiate_framing(websocket))
+        connection = Client_Connection(
+            websocket, self.max_queue_size, self.slow_consumer_policy
+        )
+        websocket.state.connection = connection
+        self.connections[websocket] = connection
+        return True
 
     async def disconnect(self, websocket: WebSocket):
         """Disconnect a websocket."""
-        if websocket in self.active_connections:
-            self.active_connections.remove(websocket)
-            self.sender_tasks[websocket].cancel()
-            await self.message_queues[websocket].put(None)
-            del self.sender_tasks[websocket]
-            del self.message_queues[websocket]
-
-    async def start_streaming(self, query, urls, websocket):
-        """Start streaming the output."""
-        report = await run_agent(query, urls, websocket)
-        return report
+        connection = self.connections.pop(websocket, None)
+        if connection is not None:
+            connection.close()
+
+    def stats(self):
+        """Returns the number of connections and of their queued frames."""
+        return {
+            "connections": len(self.connections),
+            "queued_frames": sum(len(c.frames) for c in self.connections.values()),
+        }
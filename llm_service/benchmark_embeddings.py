@@ -0,0 +1,74 @@
+import os
+from dotenv import load_dotenv
+
+_ = load_dotenv(".env")
+import time
+import argparse
+import statistics
+from sentence_transformers import SentenceTransformer
+from app.services.database.onnx_embedding import PARITY_TEXTS, load_onnx_model, parity
+
+BATCH_SIZES = [1, 2, 4, 8, 16, 32, 64]
+
+
+def benchmark(model, texts, batch_size, repeats):
+    """
+    Measures the latency of encoding one batch.
+
+    Args:
+        model: The embedding model.
+        texts (list): The texts to sample batches from.
+        batch_size (int): The number of texts per batch.
+        repeats (int): The number of measured batches.
+
+    Returns:
+        tuple: The median and the 95th percentile latency in milliseconds.
+    """
+    batch = [texts[i % len(texts)] for i in range(batch_size)]
+    model.encode(batch, batch_size=batch_size)
+    latencies = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        model.encode(batch, batch_size=batch_size)
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+    return statistics.median(latencies), latencies[int(0.95 * (len(latencies) - 1))]
+
+
+def main():
+    """Compares the PyTorch and the int8 ONNX query embedding backends."""
+    parser = argparse.ArgumentParser(description="Benchmark the embedding backends.")
+    parser.add_argument("--model", default=os.environ.get("embedding_model_name"))
+    parser.add_argument(
+        "--onnx-dir", default=os.environ.get("embedding_onnx_dir", "./onnx_model")
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=int(os.environ.get("embedding_onnx_threads", 0)),
+        help="Intra-op thread count of onnxruntime, 0 for its default.",
+    )
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+
+    models = {
+        "torch": SentenceTransformer(args.model, device="cpu"),
+        "onnx-int8": load_onnx_model(args.model, args.onnx_dir, args.threads),
+    }
+    similarity = parity(
+        models["torch"].encode(PARITY_TEXTS), models["onnx-int8"].encode(PARITY_TEXTS)
+    )
+    print(f"Parity (minimum cosine similarity): {similarity:.4f}\n")
+
+    print(f"{'backend':>10} {'batch':>6} {'p50 ms':>9} {'p95 ms':>9} {'texts/s':>9}")
+    for name, model in models.items():
+        for batch_size in BATCH_SIZES:
+            p50, p95 = benchmark(model, PARITY_TEXTS, batch_size, args.repeats)
+            throughput = batch_size / (p50 / 1000)
+            print(
+                f"{name:>10} {batch_size:>6} {p50:>9.2f} {p95:>9.2f} {throughput:>9.0f}"
+            )
+
+
+if __name__ == "__main__":
+    main()